@@ -22,6 +22,7 @@ import bayou.experiments.low_level_sketches.infer
 import bayou.experiments.nonbayesian.infer
 import bayou.models.core.infer
 import bayou.models.low_level_evidences.infer
+from bayou.models.low_level_evidences.infer import SearchBudget
 
 TIMEOUT = 20  # seconds per query
 
@@ -56,12 +57,14 @@ def main(clargs):
                 evidences = {clargs.evidence: program[clargs.evidence]}
             else:
                 evidences = program
+            # the search of an lle model in progress at the timeout completes its candidates greedily
+            kwargs = {'budget': SearchBudget(seconds=TIMEOUT)} if clargs.model == 'low_level_evidences' else {}
             asts, counts = [], []
             for j in range(100):
                 if time.time() - start > TIMEOUT:
                     break
                 try:
-                    ast = predictor.infer(evidences)
+                    ast = predictor.infer(evidences, **kwargs)
                 except AssertionError:
                     continue
                 try:
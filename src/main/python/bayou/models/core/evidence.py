@@ -20,6 +20,7 @@ import json
 from itertools import chain
 
 from bayou.models.core.utils import CONFIG_ENCODER, C0, UNK
+from bayou.models.embedding_store import EmbeddingStore
 from bayou.lda.model import LDA
 
 
@@ -307,7 +308,12 @@ class Javadoc(Evidence):
         # self.vocab_size = len(self.vocab)
         # max_sentence_length could also be pre-determined and hard-coded
         # self.max_sentence_length = js['javadoc_' + self.order + '_max_length']
-        # embedding
+        # embedding, restored from the checkpoint of the embedding and then memory-mapped from its store until the
+        # embedding is saved again
+        store = os.path.join(embed_save_dir, 'embedding')
+        if EmbeddingStore.is_fresh(store, os.path.join(embed_save_dir, 'checkpoint')):
+            self.final_embedding = EmbeddingStore.load(store).vectors
+            return
         with tf.Session() as sess:
             embedding = tf.get_variable('embedding_' + self.order, [js['vocab_size'], js['embedding_size']],
                                         dtype=tf.float32, trainable=False)
@@ -320,6 +326,12 @@ class Javadoc(Evidence):
             self.final_embedding = normalized_embedding.eval()
             # add embedding for padding character
             self.final_embedding = np.append([[0] * js['embedding_size']], self.final_embedding, axis=0)
+            # in float32, as the store keeps it, so that the embedding is the same whichever way it is loaded
+            self.final_embedding = self.final_embedding.astype(np.float32)
+        try:
+            EmbeddingStore(self.chars, self.final_embedding).save(store)
+        except OSError:  # e.g., in a read-only directory, where the checkpoint is restored every time
+            pass
 
     # def read_data_point(self, program, infer=False):
     def read_data_point(self, program):
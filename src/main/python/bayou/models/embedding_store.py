@@ -0,0 +1,180 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+import argparse
+import os
+import uuid
+import numpy as np
+
+VOCAB_SUFFIX = '.vocab'
+VECTORS_SUFFIX = '.npy'
+
+HELP = """\
+Converts a word embedding file in text (a word and the values of its vector on every line, as in GloVe) into an
+embedding store: the words in <store>{} and their vectors as a float32 matrix in a .npy file next to it. The Javadoc
+evidence converts the embedding file it is given on first use, this does it ahead of time.""".format(VOCAB_SUFFIX)
+
+
+class EmbeddingStore(object):
+    """
+    Word embeddings stored in binary: the words and their vectors as a float32 matrix in a .npy file, which is
+    memory-mapped when the store is loaded. Loading does not parse the vectors, and processes that load the same store
+    (e.g., pre-forked workers) share its pages in the page cache.
+
+    The vocab file of a store (<store>.vocab) names its vectors file on its first line, followed by the words (UTF-8,
+    one per line). Every save writes a new vectors file and then replaces the vocab file, so the words and vectors of a
+    store change together and processes loading it concurrently see either the old or the new store.
+    """
+
+    def __init__(self, words, vectors):
+        """
+        :param words: list of the words
+        :param vectors: matrix of the vectors of the words, one row for each word
+        """
+        self.words = words
+        self.vectors = vectors
+
+    def save(self, store):
+        """
+        Saves the store, replacing the previous one atomically (see EmbeddingStore)
+
+        :param store: path of the store, without the suffixes of its files
+        """
+        previous = EmbeddingStore._vectors_file(store) if os.path.exists(store + VOCAB_SUFFIX) else None
+        vectors_file = '{}.{}{}'.format(store, uuid.uuid4().hex[:12], VECTORS_SUFFIX)
+        np.save(vectors_file, np.asarray(self.vectors, dtype=np.float32))
+        tmp = '{}{}.{}.tmp'.format(store, VOCAB_SUFFIX, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write('\n'.join([os.path.basename(vectors_file)] + list(self.words)).encode('utf-8'))
+        os.replace(tmp, store + VOCAB_SUFFIX)
+        # processes that mapped the previous vectors keep them until they unmap them
+        if previous is not None and os.path.exists(previous):
+            os.remove(previous)
+
+    @staticmethod
+    def _vectors_file(store):
+        with open(store + VOCAB_SUFFIX, 'rb') as f:
+            name = f.readline().decode('utf-8').strip()
+        return os.path.join(os.path.dirname(store), name)
+
+    @staticmethod
+    def exists(store):
+        return os.path.exists(store + VOCAB_SUFFIX)
+
+    @staticmethod
+    def is_fresh(store, source):
+        """
+        Checks whether a store exists and was saved after its source last changed
+
+        :param store: path of the store, without the suffixes of its files
+        :param source: the file the store was made from
+        :return: whether the store is fresh
+        """
+        return EmbeddingStore.exists(store) and os.path.getmtime(store + VOCAB_SUFFIX) >= os.path.getmtime(source)
+
+    @staticmethod
+    def load(store):
+        """
+        Loads a store, memory-mapping its vectors (read-only)
+
+        :param store: path of the store, without the suffixes of its files
+        :return: the EmbeddingStore
+        """
+        for attempt in range(3):
+            with open(store + VOCAB_SUFFIX, 'rb') as f:
+                lines = f.read().decode('utf-8').split('\n')
+            try:
+                vectors = np.load(os.path.join(os.path.dirname(store), lines[0]), mmap_mode='r')
+                break
+            except FileNotFoundError:  # replaced (and removed) by a save since the vocab was read
+                if attempt == 2:
+                    raise
+        words = lines[1:]
+        assert len(words) == len(vectors), 'The vocabulary and vectors of {} do not match'.format(store)
+        return EmbeddingStore(words, vectors)
+
+    @staticmethod
+    def from_text(embedding_file, unk=None):
+        """
+        Reads a word embedding file in text
+
+        :param embedding_file: the file, with a word and the values of its vector on every line
+        :param unk: word for unknown words to add first, with a random vector, or None
+        :return: the EmbeddingStore of the file
+        """
+        words, vectors = [], []
+        with open(embedding_file) as f:
+            for line in f:
+                row = line.strip().split()
+                words.append(row[0])
+                vectors.append(row[1:])
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if unk is not None:
+            words.insert(0, unk)
+            vectors = np.concatenate([np.random.rand(1, vectors.shape[1]).astype(np.float32), vectors])
+        return EmbeddingStore(words, vectors)
+
+    @staticmethod
+    def open(embedding_file, unk=None):
+        """
+        Loads the store of a word embedding file, converting the file into a store next to it (<file>.vocab and a .npy
+        file) if it has not been converted since it last changed. The file may also be a store without its text,
+        named without its suffixes.
+
+        :param embedding_file: the word embedding file
+        :param unk: word for unknown words that the store starts with (see from_text), or None
+        :return: the EmbeddingStore
+        :raise: ValueError if the store does not start with unk and there is no text to convert it from
+        """
+        if not os.path.exists(embedding_file):
+            embeddings = EmbeddingStore.load(embedding_file)
+            if unk is not None and embeddings.words[:1] != [unk]:
+                raise ValueError('The store {} does not start with {}'.format(embedding_file, unk))
+            return embeddings
+
+        if EmbeddingStore.is_fresh(embedding_file, embedding_file):
+            try:
+                embeddings = EmbeddingStore.load(embedding_file)
+                if unk is None or embeddings.words[:1] == [unk]:
+                    return embeddings
+            except (OSError, AssertionError):  # unreadable, converted again below
+                pass
+        embeddings = EmbeddingStore.from_text(embedding_file, unk)
+        try:
+            embeddings.save(embedding_file)
+        except OSError:  # e.g., in a read-only directory, where the file is read from text every time
+            return embeddings
+        return EmbeddingStore.load(embedding_file)
+
+
+def convert(clargs):
+    store = clargs.store if clargs.store is not None else clargs.embedding_file[0]
+    embeddings = EmbeddingStore.from_text(clargs.embedding_file[0], clargs.unk or None)
+    embeddings.save(store)
+    print('Converted {} words of dimension {} to {}'.format(len(embeddings.words), embeddings.vectors.shape[1], store))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=HELP)
+    parser.add_argument('embedding_file', type=str, nargs=1,
+                        help='word embedding file in text')
+    parser.add_argument('--store', type=str, default=None,
+                        help='path of the store (without suffixes), by default that of the embedding file')
+    parser.add_argument('--unk', type=str, default='<unk>',
+                        help='word for unknown words, added first with a random vector as the Javadoc evidence of '
+                             'lle models expects, or an empty string to not add one')
+    clargs = parser.parse_args()
+    convert(clargs)
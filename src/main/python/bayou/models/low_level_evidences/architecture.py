@@ -12,22 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import tensorflow as tf
 from itertools import chain
 
+from bayou.models.low_level_evidences.utils import LazyModule
+
+tf = LazyModule('tensorflow')
+
 
 class BayesianEncoder(object):
     def __init__(self, config):
 
         self.inputs = [ev.placeholder(config) for ev in config.evidence]
         exists = [ev.exists(i) for ev, i in zip(config.evidence, self.inputs)]
-        zeros = tf.zeros([config.batch_size, config.latent_size], dtype=tf.float32)
+        # the batch size is left open (None) during inference, so that many evidences can be encoded at once
+        batch_size = config.batch_size if config.batch_size is not None else tf.shape(self.inputs[0])[0]
+        zeros = tf.zeros([batch_size, config.latent_size], dtype=tf.float32)
 
         # Compute the denominator used for mean and covariance
         for ev in config.evidence:
             ev.init_sigma(config)
-        d = [tf.where(exist, tf.tile([1. / tf.square(ev.sigma)], [config.batch_size]),
-                      tf.zeros(config.batch_size)) for ev, exist in zip(config.evidence, exists)]
+        self.sigmas = [ev.sigma for ev in config.evidence]
+        d = [tf.where(exist, tf.tile([1. / tf.square(ev.sigma)], [batch_size]),
+                      tf.zeros([batch_size])) for ev, exist in zip(config.evidence, exists)]
         d = 1. + tf.reduce_sum(tf.stack(d), axis=0)
         denom = tf.tile(tf.reshape(d, [-1, 1]), [1, config.latent_size])
 
@@ -51,7 +57,7 @@ class BayesianEncoder(object):
 
         # Compute the covariance of Psi
         with tf.variable_scope('covariance'):
-            I = tf.ones([config.batch_size, config.latent_size], dtype=tf.float32)
+            I = tf.ones([batch_size, config.latent_size], dtype=tf.float32)
             self.psi_covariance = I / denom
 
 
@@ -75,11 +81,18 @@ class BayesianDecoder(object):
         att_out_w = tf.get_variable(
             'att_out_w', shape=(config.latent_size + self.cell1.output_size, self.cell1.output_size))
 
-        # placeholders
-        self.initial_state = [initial_state] * config.decoder.num_layers
-        self.nodes = [tf.placeholder(tf.int32, [config.batch_size], name='node{0}'.format(i))
+        # placeholders (during inference the batch size is left open so that many prefixes are run at once,
+        # and the state of every layer can be fed separately to step the decoder)
+        batch_size = None if infer else config.batch_size
+        if infer:
+            self.initial_state = [tf.placeholder_with_default(initial_state, [None, config.decoder.units],
+                                                              name='initial_state{0}'.format(i))
+                                  for i in range(config.decoder.num_layers)]
+        else:
+            self.initial_state = [initial_state] * config.decoder.num_layers
+        self.nodes = [tf.placeholder(tf.int32, [batch_size], name='node{0}'.format(i))
                       for i in range(config.decoder.max_ast_depth)]
-        self.edges = [tf.placeholder(tf.bool, [config.batch_size], name='edge{0}'.format(i))
+        self.edges = [tf.placeholder(tf.bool, [batch_size], name='edge{0}'.format(i))
                       for i in range(config.decoder.max_ast_depth)]
 
         # projection matrices for output
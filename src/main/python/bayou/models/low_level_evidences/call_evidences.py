@@ -0,0 +1,102 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+
+from bayou.models.low_level_evidences.evidence import APICalls, Types, Keywords
+
+CALL_EVIDENCES_FILE = 'call_evidences.pkl'
+
+
+class CallEvidences(object):
+    """
+    Index of the evidences of calls (the API calls, types and keywords of a call, see the from_call methods of the
+    evidences) by call string. Extracting them from a call takes several regexes, so they are extracted once for every
+    distinct call and looked up afterwards: the index of the calls of the training data is saved next to the callmap of
+    a model, and calls that are not in the index are added to it when they are first looked up.
+    """
+
+    def __init__(self, index=None):
+        """
+        :param index: dict of call strings to tuples of frozensets of their API calls, types and keywords, or None
+        """
+        self.index = index if index is not None else dict()
+
+    def lookup(self, callnode):
+        """
+        Gets the evidences of a call
+
+        :param callnode: the call node
+        :return: tuple of frozensets of the API calls, types and keywords of the call
+        """
+        call = callnode['_call']
+        evidences = self.index.get(call)
+        if evidences is None:
+            evidences = (frozenset(APICalls.from_call(callnode)), frozenset(Types.from_call(callnode)),
+                         frozenset(Keywords.from_call(callnode)))
+            self.index[call] = evidences
+        return evidences
+
+    def evidences(self, callnodes):
+        """
+        Gets the evidences of a program from those of its calls
+
+        :param callnodes: the call nodes of the program
+        :return: tuple of sets of the API calls, types and keywords of the calls
+        """
+        apicalls, types, keywords = set(), set(), set()
+        for callnode in callnodes:
+            call_apicalls, call_types, call_keywords = self.lookup(callnode)
+            apicalls |= call_apicalls
+            types |= call_types
+            keywords |= call_keywords
+        return apicalls, types, keywords
+
+    @staticmethod
+    def from_calls(callnodes):
+        """
+        Indexes the evidences of calls
+
+        :param callnodes: the call nodes to index
+        :return: the CallEvidences of the calls
+        """
+        call_evidences = CallEvidences()
+        for callnode in callnodes:
+            call_evidences.lookup(callnode)
+        return call_evidences
+
+    def save(self, save):
+        """
+        Saves the index in the directory of a model
+
+        :param save: directory of the model
+        """
+        with open(os.path.join(save, CALL_EVIDENCES_FILE), 'wb') as f:
+            pickle.dump(self.index, f)
+
+    @staticmethod
+    def load(save):
+        """
+        Loads the index saved in the directory of a model. Models saved without one get an empty index, which fills up
+        as calls are looked up.
+
+        :param save: directory of the model
+        :return: the CallEvidences of the model
+        """
+        path = os.path.join(save, CALL_EVIDENCES_FILE)
+        if not os.path.exists(path):
+            return CallEvidences()
+        with open(path, 'rb') as f:
+            return CallEvidences(pickle.load(f))
@@ -0,0 +1,92 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+import numpy as np
+
+import argparse
+import re
+from collections import defaultdict
+
+from bayou.models.low_level_evidences.utils import LazyModule
+
+tf = LazyModule('tensorflow')
+
+HELP = """\
+Converts the checkpoint of a saved model whose Javadoc encoder has an attention scope per latent dimension
+(encoder_attention_<i>/dense..dense_5) to the fused attention heads of Javadoc.attention_heads, stacking the
+variables of the heads (and their optimizer slots) head-major. The checkpoint is replaced in the save directory,
+the other variables are kept as they are.\
+"""
+
+# a dense layer of an attention head: dense..dense_2 compute the softmax input and dense_3..dense_5 the non-softmax
+# input. Older versions of TensorFlow name the variables weights/biases instead of kernel/bias.
+ATTENTION = re.compile('^(.*)/encoder_attention_([0-9]+)/dense(?:_([0-9]+))?/(kernel|weights|bias|biases)(/.*)?$')
+
+
+def convert_variables(variables):
+    """
+    Maps the variables of a checkpoint with per-head attention scopes to those of the fused attention heads
+
+    :param variables: dict of variable names to values
+    :return: dict of variable names to values, with the variables of the heads stacked
+    :raise: ValueError if the heads of a layer are not numbered 0..latent_size-1
+    """
+    converted, heads = dict(), defaultdict(dict)
+    for name, value in variables.items():
+        match = ATTENTION.match(name)
+        if match is None:
+            converted[name] = value
+            continue
+        scope, head, dense, suffix, slot = match.groups()
+        dense = int(dense) if dense is not None else 0
+        branch = 'softmax' if dense < 3 else 'non_softmax'
+        suffix = 'kernel' if suffix in ['kernel', 'weights'] else 'bias'
+        fused = '{}/{}{}/{}{}'.format(scope, branch, dense % 3, suffix, slot or '')
+        heads[fused][int(head)] = value
+
+    for fused, values in heads.items():
+        if sorted(values) != list(range(len(values))):
+            raise ValueError('Heads of {} are not numbered 0..{}: {}'.format(fused, len(values) - 1, sorted(values)))
+        converted[fused] = np.stack([values[i] for i in range(len(values))])
+    return converted
+
+
+def convert(clargs):
+    ckpt = tf.train.get_checkpoint_state(clargs.save)
+    reader = tf.train.NewCheckpointReader(ckpt.model_checkpoint_path)
+    variables = {name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map()}
+    if not any(ATTENTION.match(name) for name in variables):
+        print('{} has no per-head attention variables, nothing to convert'.format(ckpt.model_checkpoint_path))
+        return
+    converted = convert_variables(variables)
+
+    # the values are fed to the initializers rather than folded into the graph as constants, which may be too large
+    with tf.Graph().as_default():
+        values = {name: tf.placeholder(tf.as_dtype(value.dtype), value.shape) for name, value in converted.items()}
+        var_list = {name: tf.Variable(values[name], name=name) for name in converted}
+        saver = tf.train.Saver(var_list)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer(), {values[name]: value for name, value in converted.items()})
+            saver.save(sess, ckpt.model_checkpoint_path)
+    print('Converted {} variables to {} in {}'.format(len(variables), len(converted), ckpt.model_checkpoint_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=HELP)
+    parser.add_argument('--save', type=str, required=True,
+                        help='directory of the saved model')
+    clargs = parser.parse_args()
+    convert(clargs)
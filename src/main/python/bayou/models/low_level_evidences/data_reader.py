@@ -21,7 +21,8 @@ import pickle
 from collections import Counter
 
 from bayou.models.low_level_evidences.utils import C0, CHILD_EDGE, SIBLING_EDGE, gather_calls
-from bayou.models.low_level_evidences.evidence import Javadoc
+from bayou.models.low_level_evidences.evidence import Javadoc, Keywords
+from bayou.models.low_level_evidences.call_evidences import CallEvidences
 
 class TooLongPathError(Exception):
     pass
@@ -63,8 +64,10 @@ class Reader():
             config.decoder.vocab = dict(zip(config.decoder.chars, range(len(config.decoder.chars))))
             config.decoder.vocab_size = len(config.decoder.vocab)
 
-        # wrangle the evidences and targets into numpy arrays
-        self.inputs = [ev.wrangle(data) for ev, data in zip(config.evidence, raw_evidences)]
+        # wrangle the evidences batch by batch (so that lists of words are only as long as their batch needs), and the
+        # targets into numpy arrays
+        self.inputs = [[ev.wrangle(data[i * config.batch_size:(i + 1) * config.batch_size])
+                        for i in range(config.num_batches)] for ev, data in zip(config.evidence, raw_evidences)]
         self.nodes = np.zeros((sz, config.decoder.max_ast_depth), dtype=np.int32)
         self.edges = np.zeros((sz, config.decoder.max_ast_depth), dtype=np.bool)
         self.targets = np.zeros((sz, config.decoder.max_ast_depth), dtype=np.int32)
@@ -74,7 +77,6 @@ class Reader():
             self.targets[i, :len(path)-1] = self.nodes[i, 1:len(path)]  # shifted left by one
 
         # split into batches
-        self.inputs = [np.split(ev_data, config.num_batches, axis=0) for ev_data in self.inputs]
         self.nodes = np.split(self.nodes, config.num_batches, axis=0)
         self.edges = np.split(self.edges, config.num_batches, axis=0)
         self.targets = np.split(self.targets, config.num_batches, axis=0)
@@ -208,10 +210,15 @@ class Reader():
         random.shuffle(data_points)
         evidences, targets = zip(*data_points)
 
-        # save callmap if save location is given
+        # save callmap (and the index of the evidences of its calls) if save location is given
         if save is not None:
             with open(os.path.join(save, 'callmap.pkl'), 'wb') as f:
                 pickle.dump(callmap, f)
+            CallEvidences.from_calls(callmap.values()).save(save)
+            # and the lemmas of the keywords (see Keywords.lemmatize)
+            for ev in self.config.evidence:
+                if isinstance(ev, Keywords):
+                    ev.save_lemmas(save)
 
         return evidences, targets
 
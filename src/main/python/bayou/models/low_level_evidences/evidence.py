@@ -12,18 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import tensorflow as tf
 import numpy as np
 import os
 import re
 import json
-import nltk
+import logging
+from functools import lru_cache
 from itertools import chain
 from collections import Counter
-from nltk.stem.wordnet import WordNetLemmatizer
 
-from bayou.models.low_level_evidences.utils import CONFIG_ENCODER, CONFIG_INFER, C0, UNK
-from tensorflow.python.ops import embedding_ops
+from bayou.models.low_level_evidences.utils import CONFIG_ENCODER, CONFIG_INFER, C0, UNK, LazyModule
+from bayou.models.embedding_store import EmbeddingStore
+
+tf = LazyModule('tensorflow')
+# NLTK (and its WordNet data) are only loaded when a keyword is first lemmatized
+nltk = LazyModule('nltk')
+wordnet = LazyModule('nltk.stem.wordnet')
+embedding_ops = LazyModule('tensorflow.python.ops.embedding_ops')
 
 
 class Evidence(object):
@@ -64,6 +69,14 @@ class Evidence(object):
     def wrangle(self, data):
         raise NotImplementedError('wrangle() has not been implemented')
 
+    # which rows of wrangled data have the evidence
+    def present(self, wrangled):
+        return np.sum(wrangled.reshape(len(wrangled), -1), axis=1) != 0
+
+    # canonical form of a row of wrangled data, as bytes (e.g., to key caches)
+    def key(self, row):
+        return row.tobytes()
+
     def placeholder(self, config):
         raise NotImplementedError('placeholder() has not been implemented')
 
@@ -80,50 +93,80 @@ class Evidence(object):
         raise NotImplementedError('evidence_loss() has not been implemented')
 
 
-class APICalls(Evidence):
+class SparseEvidence(Evidence):
+    """
+    Evidence that is a set of words from a vocabulary (API calls, types or keywords). A wrangled data point is the
+    sorted list of the indices of its words in the vocabulary, padded with -1 to the longest list of its batch, rather
+    than a multi-hot vector of the size of the vocabulary. The first (dense) layer of the encoder sums the rows of its
+    kernel of the words present, as an embedding bag, so memory and computation are proportional to the number of words.
+    """
 
-    def read_data_point(self, program):
-        apicalls = program['apicalls'] if 'apicalls' in program else []
-        return list(set(apicalls))
-
-    def set_chars_vocab(self, data):
-        counts = Counter([c for apicalls in data for c in apicalls])
-        self.chars = sorted(counts.keys(), key=lambda w: counts[w], reverse=True)
-        self.vocab = dict(zip(self.chars, range(len(self.chars))))
-        self.vocab_size = len(self.vocab)
+    def encodes(self, word):
+        return word in self.vocab
 
     def wrangle(self, data):
-        wrangled = np.zeros((len(data), 1, self.vocab_size), dtype=np.int32)
-        for i, apicalls in enumerate(data):
-            for c in apicalls:
-                if c in self.vocab:
-                    wrangled[i, 0, self.vocab[c]] = 1
+        rows = [sorted(set(self.vocab[w] for w in words if self.encodes(w))) for words in data]
+        wrangled = np.full((len(data), max([1] + [len(row) for row in rows])), -1, dtype=np.int32)
+        for i, row in enumerate(rows):
+            wrangled[i, :len(row)] = row
         return wrangled
 
+    def present(self, wrangled):
+        return wrangled[:, 0] >= 0
+
+    def key(self, row):
+        return row[row >= 0].tobytes()
+
+    def densify(self, wrangled):
+        # the multi-hot vectors (batch_size, 1, vocab_size) of wrangled data, as fed to models exported before
+        dense = np.zeros((len(wrangled), 1, self.vocab_size), dtype=np.float32)
+        rows, cols = np.nonzero(wrangled >= 0)
+        dense[rows, 0, wrangled[rows, cols]] = 1.
+        return dense
+
     def placeholder(self, config):
-        return tf.placeholder(tf.float32, [config.batch_size, 1, self.vocab_size])
+        return tf.placeholder(tf.int32, [config.batch_size, None])
 
     def exists(self, inputs):
-        i = tf.reduce_sum(inputs, axis=2)
-        return tf.not_equal(tf.count_nonzero(i, axis=1), 0)
-
-    def init_sigma(self, config):
-        with tf.variable_scope('apicalls'):
-            self.sigma = tf.get_variable('sigma', [])
+        return tf.reduce_any(tf.greater_equal(inputs, 0), axis=1)
 
     def encode(self, inputs, config):
-        with tf.variable_scope('apicalls'):
-            latent_encoding = tf.zeros([config.batch_size, config.latent_size])
-            inp = tf.slice(inputs, [0, 0, 0], [config.batch_size, 1, self.vocab_size])
-            inp = tf.reshape(inp, [-1, self.vocab_size])
-            encoding = tf.layers.dense(inp, self.units, activation=tf.nn.tanh)
+        with tf.variable_scope(self.name):
+            latent_encoding = tf.zeros([tf.shape(inputs)[0], config.latent_size])
+
+            # the variables of the first layer are those of tf.layers.dense (on the multi-hot vector of the words), so
+            # that checkpoints load with either
+            with tf.variable_scope('dense'):
+                kernel = tf.get_variable('kernel', [self.vocab_size, self.units])
+                bias = tf.get_variable('bias', [self.units], initializer=tf.zeros_initializer())
+            mask = tf.expand_dims(tf.cast(tf.greater_equal(inputs, 0), tf.float32), axis=2)
+            words = tf.gather(kernel, tf.maximum(inputs, 0))
+            encoding = tf.nn.tanh(tf.reduce_sum(words * mask, axis=1) + bias)
+
             for i in range(self.num_layers - 1):
-                encoding = tf.layers.dense(encoding, self.units, activation=tf.nn.tanh)
+                encoding = tf.layers.dense(encoding, self.units, activation=tf.nn.tanh, name='dense_{}'.format(i + 1))
             w = tf.get_variable('w', [self.units, config.latent_size])
             b = tf.get_variable('b', [config.latent_size])
             latent_encoding += tf.nn.xw_plus_b(encoding, w, b)
             return latent_encoding
 
+
+class APICalls(SparseEvidence):
+
+    def read_data_point(self, program):
+        apicalls = program['apicalls'] if 'apicalls' in program else []
+        return list(set(apicalls))
+
+    def set_chars_vocab(self, data):
+        counts = Counter([c for apicalls in data for c in apicalls])
+        self.chars = sorted(counts.keys(), key=lambda w: counts[w], reverse=True)
+        self.vocab = dict(zip(self.chars, range(len(self.chars))))
+        self.vocab_size = len(self.vocab)
+
+    def init_sigma(self, config):
+        with tf.variable_scope('apicalls'):
+            self.sigma = tf.get_variable('sigma', [])
+
     def evidence_loss(self, psi, encoding, config):
         sigma_sq = tf.square(self.sigma)
         loss = 0.5 * (config.latent_size * tf.log(2 * np.pi * sigma_sq + 1e-10)
@@ -139,7 +182,7 @@ class APICalls(Evidence):
         return [name] if name[0].islower() else []  # Java convention
 
 
-class Types(Evidence):
+class Types(SparseEvidence):
 
     def read_data_point(self, program):
         types = program['types'] if 'types' in program else []
@@ -151,38 +194,10 @@ class Types(Evidence):
         self.vocab = dict(zip(self.chars, range(len(self.chars))))
         self.vocab_size = len(self.vocab)
 
-    def wrangle(self, data):
-        wrangled = np.zeros((len(data), 1, self.vocab_size), dtype=np.int32)
-        for i, types in enumerate(data):
-            for t in types:
-                if t in self.vocab:
-                    wrangled[i, 0, self.vocab[t]] = 1
-        return wrangled
-
-    def placeholder(self, config):
-        return tf.placeholder(tf.float32, [config.batch_size, 1, self.vocab_size])
-
-    def exists(self, inputs):
-        i = tf.reduce_sum(inputs, axis=2)
-        return tf.not_equal(tf.count_nonzero(i, axis=1), 0)
-
     def init_sigma(self, config):
         with tf.variable_scope('types'):
             self.sigma = tf.get_variable('sigma', [])
 
-    def encode(self, inputs, config):
-        with tf.variable_scope('types'):
-            latent_encoding = tf.zeros([config.batch_size, config.latent_size])
-            inp = tf.slice(inputs, [0, 0, 0], [config.batch_size, 1, self.vocab_size])
-            inp = tf.reshape(inp, [-1, self.vocab_size])
-            encoding = tf.layers.dense(inp, self.units, activation=tf.nn.tanh)
-            for i in range(self.num_layers - 1):
-                encoding = tf.layers.dense(encoding, self.units, activation=tf.nn.tanh)
-            w = tf.get_variable('w', [self.units, config.latent_size])
-            b = tf.get_variable('b', [config.latent_size])
-            latent_encoding += tf.nn.xw_plus_b(encoding, w, b)
-            return latent_encoding
-
     def evidence_loss(self, psi, encoding, config):
         sigma_sq = tf.square(self.sigma)
         loss = 0.5 * (config.latent_size * tf.log(2 * np.pi * sigma_sq + 1e-10)
@@ -225,10 +240,64 @@ class Types(Evidence):
         return list(set(types))
 
 
-class Keywords(Evidence):
+class Keywords(SparseEvidence):
+
+    NLTK_DATA = 'nltk_data'  # directory of the WordNet data shipped with a model
+    LEMMAS_FILE = 'lemmas.json'  # lemma table saved with a model
+    UNSEEN_LEMMAS = 10000  # size of the LRU cache of the lemmas of words that are not in the lemma table
+
     def __init__(self):
-        nltk.download('wordnet')
-        self.lemmatizer = WordNetLemmatizer()
+        self.lemmatizer = None  # created on first use
+        self.nltk_data = None
+        self.lemmas = dict()  # lemma table, of every word lemmatized in training
+        self.lemmatize_unseen = None  # LRU cache of the lemmas of other words, at inference
+
+    def use_nltk_data(self, save):
+        """
+        Lemmatizes with the WordNet data shipped with a model (see download_nltk_data) if it has any, and otherwise with
+        the data in the default locations of NLTK. The data is never downloaded here, so a model loads offline.
+
+        :param save: directory of the model
+        """
+        path = os.path.join(save, Keywords.NLTK_DATA)
+        self.nltk_data = path if os.path.isdir(path) else None
+
+    @staticmethod
+    def download_nltk_data(save):
+        """
+        Downloads the WordNet data into the directory of a model (when it is trained), unless it is already there
+
+        :param save: directory of the model
+        """
+        path = os.path.join(save, Keywords.NLTK_DATA)
+        if not os.path.isdir(os.path.join(path, 'corpora')):
+            nltk.download('wordnet', download_dir=path)
+
+    def save_lemmas(self, save):
+        """
+        Saves the lemma table in the directory of a model, with the words that are their own lemmas listed apart
+
+        :param save: directory of the model
+        """
+        js = {'words': sorted(w for w, lemma in self.lemmas.items() if w == lemma),
+              'lemmas': {w: lemma for w, lemma in self.lemmas.items() if w != lemma}}
+        with open(os.path.join(save, Keywords.LEMMAS_FILE), 'w') as f:
+            json.dump(js, f, sort_keys=True)
+
+    def load_lemmas(self, save):
+        """
+        Lemmatizes with the lemma table saved with a model (see save_lemmas), falling back to WordNet for the words that
+        are not in it, whose lemmas are kept in an LRU cache. Without a table, every word falls back to WordNet.
+
+        :param save: directory of the model
+        """
+        path = os.path.join(save, Keywords.LEMMAS_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                js = json.load(f)
+            self.lemmas = dict(js['lemmas'])
+            self.lemmas.update((w, w) for w in js['words'])
+        self.lemmatize_unseen = lru_cache(maxsize=Keywords.UNSEEN_LEMMAS)(self._wordnet_lemmatize_unseen)
 
     STOP_WORDS = {  # CoreNLP English stop words
         "'ll", "'s", "'m", "a", "about", "above", "after", "again", "against", "all", "am", "an", "and",
@@ -254,51 +323,48 @@ class Keywords(Evidence):
     }
 
     def lemmatize(self, word):
+        lemma = self.lemmas.get(word)
+        if lemma is not None:
+            return lemma
+        if self.lemmatize_unseen is not None:
+            return self.lemmatize_unseen(word)
+        lemma = self.wordnet_lemmatize(word)
+        self.lemmas[word] = lemma
+        return lemma
+
+    def wordnet_lemmatize(self, word):
+        if self.lemmatizer is None:
+            if self.nltk_data is not None and self.nltk_data not in nltk.data.path:
+                nltk.data.path.insert(0, self.nltk_data)
+            self.lemmatizer = wordnet.WordNetLemmatizer()
         w = self.lemmatizer.lemmatize(word, 'v')
         return self.lemmatizer.lemmatize(w, 'n')
 
+    # at inference, a word is its own lemma if WordNet is not available
+    def _wordnet_lemmatize_unseen(self, word):
+        try:
+            return self.wordnet_lemmatize(word)
+        except (ImportError, LookupError) as e:
+            logging.warning('cannot lemmatize {} without WordNet: {}'.format(word, e))
+            return word
+
     def read_data_point(self, program):
         keywords = [self.lemmatize(k) for k in program['keywords']] if 'keywords' in program else []
         return list(set(keywords))
 
+    def encodes(self, word):
+        return word in self.vocab and word not in Keywords.STOP_WORDS
+
     def set_chars_vocab(self, data):
         counts = Counter([c for keywords in data for c in keywords])
         self.chars = sorted(counts.keys(), key=lambda w: counts[w], reverse=True)
         self.vocab = dict(zip(self.chars, range(len(self.chars))))
         self.vocab_size = len(self.vocab)
 
-    def wrangle(self, data):
-        wrangled = np.zeros((len(data), 1, self.vocab_size), dtype=np.int32)
-        for i, keywords in enumerate(data):
-            for k in keywords:
-                if k in self.vocab and k not in Keywords.STOP_WORDS:
-                    wrangled[i, 0, self.vocab[k]] = 1
-        return wrangled
-
-    def placeholder(self, config):
-        return tf.placeholder(tf.float32, [config.batch_size, 1, self.vocab_size])
-
-    def exists(self, inputs):
-        i = tf.reduce_sum(inputs, axis=2)
-        return tf.not_equal(tf.count_nonzero(i, axis=1), 0)
-
     def init_sigma(self, config):
         with tf.variable_scope('keywords'):
             self.sigma = tf.get_variable('sigma', [])
 
-    def encode(self, inputs, config):
-        with tf.variable_scope('keywords'):
-            latent_encoding = tf.zeros([config.batch_size, config.latent_size])
-            inp = tf.slice(inputs, [0, 0, 0], [config.batch_size, 1, self.vocab_size])
-            inp = tf.reshape(inp, [-1, self.vocab_size])
-            encoding = tf.layers.dense(inp, self.units, activation=tf.nn.tanh)
-            for i in range(self.num_layers - 1):
-                encoding = tf.layers.dense(encoding, self.units, activation=tf.nn.tanh)
-            w = tf.get_variable('w', [self.units, config.latent_size])
-            b = tf.get_variable('b', [config.latent_size])
-            latent_encoding += tf.nn.xw_plus_b(encoding, w, b)
-            return latent_encoding
-
     def evidence_loss(self, psi, encoding, config):
         sigma_sq = tf.square(self.sigma)
         loss = 0.5 * (config.latent_size * tf.log(2 * np.pi * sigma_sq + 1e-10)
@@ -367,20 +433,14 @@ class Javadoc(Evidence):
         # reverse the sentence
         return javadoc.split()[::-1]
 
-    # good, universally used
+    # good, universally used. The embedding file is read from its binary store (see EmbeddingStore.open), which
+    # starts with <unk> and its random vector, and whose vectors are used as they are memory-mapped
     def set_chars_vocab(self, embedding_file):
-        self.chars = []
-        self.chars.append('<unk>')
-        self.vocab_embeddings = []
-        file = open(embedding_file)
-        for line in file.readlines():
-            row = line.strip().split()
-            self.chars.append(row[0])
-            self.vocab_embeddings.append(row[1:])
+        store = EmbeddingStore.open(embedding_file, unk='<unk>')
+        self.chars = store.words
         self.vocab = dict(zip(self.chars, range(len(self.chars))))
         self.vocab_size = len(self.vocab)
-        self.vocab_embeddings.insert(0, np.random.rand(self.embed_dim))
-        self.vocab_embeddings = np.asarray(self.vocab_embeddings, np.float32)
+        self.vocab_embeddings = store.vectors
 
     # def wrangle(self, data):
     #     wrangled = np.zeros((len(data), 1, self.vocab_size), dtype=np.int32)
@@ -443,7 +503,7 @@ class Javadoc(Evidence):
 
             cell_fw = tf.nn.rnn_cell.GRUCell(self.rnn_units)
             cell_bw = tf.nn.rnn_cell.GRUCell(self.rnn_units)
-            lengths_1d = tf.reshape(lengths_2d, shape=[config.batch_size])
+            lengths_1d = tf.reshape(lengths_2d, shape=[-1])
             # outputs=(output_fw, output_bw), [batch_size, max_time, cell_{f/b}w.output_size]
             outputs, _ = tf.nn.bidirectional_dynamic_rnn(cell_fw, cell_bw, inputs=encoder_emb_input, dtype=tf.float32,
                                                          sequence_length=lengths_1d)
@@ -453,58 +513,62 @@ class Javadoc(Evidence):
             # zero out the regions beyond sequences lengths using sequence masking
             # zero out is not necessary due to the properties of bidirectional_dynamic_rnn
 
-            latent_dims = []
-            softmax_input_layers = 3
-            non_softmax_input_layers = 3
-
-            # for getting local tensor values while predicting and checking
-            self.multi_outputs = []
-            self.softmax_outputs = []
-
-            for i in range(config.latent_size):
-                with tf.variable_scope('encoder_attention_' + str(i)):
-                    # prepare softmax input
-                    softmax_input = brnn_outputs
-                    for j in range(softmax_input_layers - 1):
-                        softmax_input = tf.layers.dense(softmax_input, self.rnn_units * 2, tf.nn.tanh)
-                    # (batch_size, max_time, 1)
-                    softmax_input_scalar = tf.layers.dense(softmax_input, 1)
-                    # reshape, (batch_size, max_time)
-                    softmax_input_scalar_squeeze = tf.squeeze(softmax_input_scalar, axis=2)
-                    # mask for inputs beyond actual timesteps, (batch_size, max_time)
-                    mask_flag = tf.sequence_mask(lengths_1d, tf.shape(softmax_input_scalar_squeeze)[1])
-                    # inf_mask = tf.tile(tf.Variable([[-1000000.0]]), tf.Variable([config.batch_size, self.max_words]))
-                    inf_mask = tf.constant(-1000000.0, shape=[config.batch_size, self.max_words])
-                    softmax_input_scalar_mask = tf.where(mask_flag, softmax_input_scalar_squeeze, inf_mask)
-                    # (batch_size, max_time)
-                    softmax_output = tf.nn.softmax(softmax_input_scalar_mask)
-
-                    # prepare another non-softmax input to the multiplication operation
-                    non_softmax_input = brnn_outputs
-                    for j in range(non_softmax_input_layers - 1):
-                        non_softmax_input = tf.layers.dense(non_softmax_input, self.rnn_units * 2, tf.nn.tanh)
-                    non_softmax_input_scalar = tf.layers.dense(non_softmax_input, 1, tf.nn.tanh)
-                    # (batch_size, max_time)
-                    non_softmax_input_scalar_squeeze = tf.squeeze(non_softmax_input_scalar, axis=2)
-                    non_softmax_input_scalar_squeeze = tf.where(mask_flag, non_softmax_input_scalar_squeeze,
-                                                                tf.zeros_like(non_softmax_input_scalar_squeeze))
-
-                    # multiplication (batch_size, max_time)
-                    multi_output = softmax_output * non_softmax_input_scalar_squeeze
-                    self.multi_outputs.append(multi_output)
-                    self.softmax_outputs.append(softmax_output)
-
-                    # reduce_sum, last dimension, (batch_size)
-                    latent_dim = tf.reduce_sum(multi_output, -1)
-                    latent_dims.append(latent_dim)
-
-            # for getting local tensor values while predicting and checking
+            # attention heads, one for each latent dimension, all computed at once (see attention_heads)
+            # mask for inputs beyond actual timesteps, (latent_size, batch_size, max_time)
+            mask_flag = tf.sequence_mask(lengths_1d, tf.shape(brnn_outputs)[1])
+            mask_flag = tf.tile(tf.expand_dims(mask_flag, 0), [config.latent_size, 1, 1])
+
+            # (latent_size, batch_size, max_time)
+            softmax_input_scalar = self.attention_heads(brnn_outputs, 'softmax', config)
+            inf_mask = tf.fill(tf.shape(softmax_input_scalar), -1000000.0)
+            softmax_output = tf.nn.softmax(tf.where(mask_flag, softmax_input_scalar, inf_mask))
+
+            # prepare another non-softmax input to the multiplication operation, (latent_size, batch_size, max_time)
+            non_softmax_input_scalar = tf.tanh(self.attention_heads(brnn_outputs, 'non_softmax', config))
+            non_softmax_input_scalar = tf.where(mask_flag, non_softmax_input_scalar,
+                                                tf.zeros_like(non_softmax_input_scalar))
+
+            # multiplication (latent_size, batch_size, max_time), and reduce_sum over time (latent_size, batch_size)
+            multi_output = softmax_output * non_softmax_input_scalar
+            latent_dims = tf.reduce_sum(multi_output, -1)
+
+            # for getting local tensor values while predicting and checking, stacked by latent dimension
+            self.multi_outputs = multi_output
+            self.softmax_outputs = softmax_output
             self.latent_dims = latent_dims
 
-            # concatenate latent_dims, (batch_size, latent_size)
-            latent_vector = tf.stack(latent_dims, axis=1)
+            # (batch_size, latent_size)
+            latent_vector = tf.transpose(latent_dims)
             return latent_vector
 
+    # the attention heads of the encoder, with a stack of 3 dense layers (tanh, tanh, linear to a scalar) for every
+    # latent dimension. The layers of all heads are fused: kernels are head-major (latent_size, in, out) and biases
+    # (latent_size, out), so every layer is one batched matmul. Kernels are initialized per head as by tf.layers.dense.
+    def attention_heads(self, inputs, name, config):
+        # inputs.shape=(batch_size, max_time, units)
+        units = self.rnn_units * 2
+        batch_time = tf.shape(inputs)[:2]
+        layers = [(units, units), (units, units), (units, 1)]
+        # (batch_size * max_time, units)
+        x = tf.reshape(inputs, [-1, units])
+        for k, (units_in, units_out) in enumerate(layers):
+            limit = np.sqrt(6. / (units_in + units_out))
+            kernel = tf.get_variable('{}{}/kernel'.format(name, k), [config.latent_size, units_in, units_out],
+                                     initializer=tf.random_uniform_initializer(-limit, limit))
+            bias = tf.get_variable('{}{}/bias'.format(name, k), [config.latent_size, units_out],
+                                   initializer=tf.zeros_initializer())
+            if k == 0:
+                # btd,hde->hbte, the inputs are shared by all heads, (latent_size, batch_size * max_time, out)
+                x = tf.transpose(tf.tensordot(x, kernel, [[1], [1]]), [1, 0, 2])
+            else:
+                # hbtd,hde->hbte
+                x = tf.matmul(x, kernel)
+            x = x + tf.expand_dims(bias, 1)
+            if k < len(layers) - 1:
+                x = tf.tanh(x)
+        # (latent_size, batch_size, max_time)
+        return tf.reshape(x, tf.concat([[config.latent_size], batch_time], 0))
+
 
     def evidence_loss(self, psi, encoding, config):
         sigma_sq = tf.square(self.sigma)
@@ -0,0 +1,84 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+import argparse
+import os
+import json
+
+from bayou.models.low_level_evidences.model import Model
+from bayou.models.low_level_evidences.frozen_model import GRAPH_FILE, TENSORS_FILE
+from bayou.models.low_level_evidences.utils import read_config
+
+HELP = """\
+Exports the inference graph of a saved model to {} in the save directory, with the variables folded in as
+constants and the losses and optimizer pruned, along with the names of its tensors in {}. The server loads it
+with the 'frozen' backend.""".format(GRAPH_FILE, TENSORS_FILE)
+
+
+def export(clargs):
+    with open(os.path.join(clargs.save, 'config.json')) as f:
+        config = read_config(json.load(f), chars_vocab=True)
+    model = Model(config, True)
+
+    # tensors used by the inference methods of the model
+    tensors = {'inputs': model.encoder.inputs,
+               'encodings': model.encoder.encodings,
+               'sigmas': model.encoder.sigmas,
+               'psi_mean': model.encoder.psi_mean,
+               'psi_covariance': model.encoder.psi_covariance,
+               'psi': model.psi,
+               'num_psi_samples': model.num_psi_samples,
+               'psi_samples': model.psi_samples,
+               'initial_state': model.initial_state,
+               'decoder_initial_state': model.decoder.initial_state,
+               'nodes': model.decoder.nodes,
+               'edges': model.decoder.edges,
+               'probs': model.probs,
+               'state': model.decoder.state}
+    flat = [t for v in tensors.values() for t in (v if isinstance(v, list) else [v])]
+    outputs = list(set(t.op.name for t in flat))
+
+    # placeholders, which must not be folded even if their default is a constant
+    inputs = [t.op.name for t in model.encoder.inputs + model.decoder.initial_state + model.decoder.nodes +
+              model.decoder.edges + [model.psi, model.num_psi_samples]]
+
+    with tf.Session() as sess:
+        saver = tf.train.Saver(tf.global_variables())
+        ckpt = tf.train.get_checkpoint_state(clargs.save)
+        saver.restore(sess, ckpt.model_checkpoint_path)
+        num_nodes = len(sess.graph_def.node)
+        graph_def = tf.graph_util.convert_variables_to_constants(sess, sess.graph_def, outputs)
+    graph_def = TransformGraph(graph_def, inputs, outputs, ['fold_constants(ignore_errors=true)',
+                                                            'sort_by_execution_order'])
+
+    with open(os.path.join(clargs.save, GRAPH_FILE), 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(os.path.join(clargs.save, TENSORS_FILE), 'w') as f:
+        json.dump({key: [t.name for t in v] if isinstance(v, list) else v.name for key, v in tensors.items()}, f,
+                  indent=2)
+    print('Exported {} nodes (from {}) to {}'.format(len(graph_def.node), num_nodes,
+                                                     os.path.join(clargs.save, GRAPH_FILE)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=HELP)
+    parser.add_argument('--save', type=str, required=True,
+                        help='directory of the saved model')
+    clargs = parser.parse_args()
+    export(clargs)
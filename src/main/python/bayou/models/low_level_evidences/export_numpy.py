@@ -0,0 +1,180 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from __future__ import print_function
+import numpy as np
+import tensorflow as tf
+
+import argparse
+import re
+import os
+import json
+
+from bayou.models.low_level_evidences.model import Model
+from bayou.models.low_level_evidences.evidence import Javadoc
+from bayou.models.low_level_evidences.numpy_model import NumpyModel, WEIGHTS_FILE
+from bayou.models.low_level_evidences.utils import read_config, CHILD_EDGE, SIBLING_EDGE
+
+HELP = """\
+Exports the weights of a saved model to {} in the save directory, so that the model can be used for inference
+in NumPy (BayesianPredictor with backend 'numpy'). The exported model is checked against TensorFlow on random
+inputs before saving.""".format(WEIGHTS_FILE)
+
+# older versions of TensorFlow name the variables of layers and cells weights/biases instead of kernel/bias
+KERNEL = '(kernel|weights)'
+BIAS = '(bias|biases)'
+
+
+def find(variables, pattern):
+    """
+    Finds the value of the only variable whose name matches the pattern
+
+    :param variables: dict of variable names to values
+    :param pattern: regex to match the full name of the variable (without the ':0' suffix)
+    :return: the value of the variable
+    :raise: ValueError if there is not exactly one variable matching the pattern
+    """
+    matches = [name for name in variables if re.match('^' + pattern + '$', name.split(':')[0])]
+    if len(matches) != 1:
+        raise ValueError('{} variables match {}: {}'.format(len(matches), pattern, matches))
+    return variables[matches[0]]
+
+
+def export_gru(variables, scope, name):
+    return {name + '/gates/kernel': find(variables, scope + '/gates/' + KERNEL),
+            name + '/gates/bias': find(variables, scope + '/gates/' + BIAS),
+            name + '/candidate/kernel': find(variables, scope + '/candidate/' + KERNEL),
+            name + '/candidate/bias': find(variables, scope + '/candidate/' + BIAS)}
+
+
+def export_weights(config, variables):
+    """
+    Maps the variables of a model to the weights of NumpyModel
+
+    :param config: the model configuration
+    :param variables: dict of variable names to values
+    :return: dict of weights
+    """
+    weights = {name: find(variables, name) for name in
+               ['lift_w', 'lift_b', 'align_w', 'att_out_w', 'projection_w', 'projection_b', 'decoder/emb']}
+    for cell in ['cell1', 'cell2']:
+        for j in range(config.decoder.num_layers):
+            weights.update(export_gru(variables, 'decoder/rnn/{}/.*cell_{}/[^/]*'.format(cell, j),
+                                      'decoder/{}/{}'.format(cell, j)))
+
+    for ev in config.evidence:
+        weights[ev.name + '/sigma'] = find(variables, ev.name + '/sigma')
+        scope = 'mean/' + ev.name
+        if isinstance(ev, Javadoc):
+            weights['javadoc/embeddings'] = find(variables, scope + '/embeddings')
+            for direction in ['fw', 'bw']:
+                weights.update(export_gru(variables, scope + '/bidirectional_rnn/{}/[^/]*'.format(direction),
+                                          'javadoc/' + direction))
+
+            # the dense layers of the attention heads are fused, with head-major weights (see Javadoc.attention_heads)
+            for branch in ['softmax', 'non_softmax']:
+                for k in range(3):
+                    for suffix in ['kernel', 'bias']:
+                        name = '{}{}/{}'.format(branch, k, suffix)
+                        weights['javadoc/' + name] = find(variables, '{}/{}'.format(scope, name))
+        else:
+            for i in range(ev.num_layers):
+                dense = 'dense' if i == 0 else 'dense_{}'.format(i)
+                weights['{}/dense{}/kernel'.format(ev.name, i)] = find(variables, '{}/{}/{}'.format(scope, dense,
+                                                                                                  KERNEL))
+                weights['{}/dense{}/bias'.format(ev.name, i)] = find(variables, '{}/{}/{}'.format(scope, dense, BIAS))
+            weights[ev.name + '/w'] = find(variables, scope + '/w')
+            weights[ev.name + '/b'] = find(variables, scope + '/b')
+    return weights
+
+
+def check(sess, model, numpy_model, num_rows=8, tolerance=1e-4):
+    """
+    Checks that the NumPy model computes the same as the TensorFlow model on random inputs
+
+    :param sess: the TensorFlow session with the model restored
+    :param model: the TensorFlow model
+    :param numpy_model: the NumPy model
+    :param num_rows: number of rows in the random batches
+    :param tolerance: maximum absolute difference allowed
+    :raise: AssertionError if the models differ
+    """
+    config = model.config
+
+    def assert_close(name, a, b):
+        diff = np.max(np.abs(np.asarray(a) - np.asarray(b)))
+        print('{}: max difference {:.2e}'.format(name, diff))
+        assert diff <= tolerance, '{} differs by {} between TensorFlow and NumPy'.format(name, diff)
+
+    # encoder, on a batch of random evidences (some of which may not exist)
+    inputs = []
+    for ev in config.evidence:
+        if isinstance(ev, Javadoc):
+            inp = np.zeros([num_rows, ev.max_words + 1], dtype=np.int32)
+            for row in range(num_rows):
+                length = np.random.randint(ev.max_words + 1)
+                inp[row, :length] = np.random.randint(1, ev.vocab_size, size=length)
+                inp[row, ev.max_words] = length
+        else:
+            inp = ev.wrangle([[ev.chars[i] for i in np.random.randint(ev.vocab_size, size=np.random.randint(10))]
+                              for _ in range(num_rows)])
+        inputs.append(inp)
+    feed = {model.encoder.inputs[j].name: inputs[j] for j in range(len(inputs))}
+    mean, covariance = sess.run([model.encoder.psi_mean, model.encoder.psi_covariance], feed)
+    np_mean, np_covariance = numpy_model.encode(inputs)
+    assert_close('psi mean', mean, np_mean)
+    assert_close('psi covariance', covariance, np_covariance)
+
+    # decoder
+    psis = np.random.normal(size=[num_rows, config.latent_size]).astype(np.float32)
+    state = model.infer_initial_state(sess, psis)
+    assert_close('initial state', state, numpy_model.infer_initial_state(None, psis))
+    nodes = [config.decoder.chars[i] for i in np.random.randint(config.decoder.vocab_size, size=num_rows)]
+    edges = [CHILD_EDGE if e else SIBLING_EDGE for e in np.random.rand(num_rows) < 0.5]
+    for _ in range(3):
+        probs, new_state = model.infer_step(sess, psis, state, nodes, edges)
+        np_probs, np_new_state = numpy_model.infer_step(None, psis, state, nodes, edges)
+        assert_close('decoder probabilities', probs, np_probs)
+        assert_close('decoder state', new_state, np_new_state)
+        state = new_state
+
+
+def export(clargs):
+    with open(os.path.join(clargs.save, 'config.json')) as f:
+        config = read_config(json.load(f), chars_vocab=True)
+    model = Model(config, True)
+
+    with tf.Session() as sess:
+        tf.global_variables_initializer().run()
+        saver = tf.train.Saver(tf.global_variables())
+        ckpt = tf.train.get_checkpoint_state(clargs.save)
+        saver.restore(sess, ckpt.model_checkpoint_path)
+
+        variables = dict(zip([v.name for v in tf.global_variables()], sess.run(tf.global_variables())))
+        weights = export_weights(config, variables)
+        check(sess, model, NumpyModel(config, weights), tolerance=clargs.tolerance)
+
+    np.savez(os.path.join(clargs.save, WEIGHTS_FILE), **weights)
+    print('Exported {} arrays to {}'.format(len(weights), os.path.join(clargs.save, WEIGHTS_FILE)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     description=HELP)
+    parser.add_argument('--save', type=str, required=True,
+                        help='directory of the saved model')
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                        help='maximum absolute difference allowed between TensorFlow and NumPy outputs')
+    clargs = parser.parse_args()
+    export(clargs)
@@ -0,0 +1,97 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import json
+
+from bayou.models.low_level_evidences.model import Model
+from bayou.models.low_level_evidences.evidence import SparseEvidence
+from bayou.models.low_level_evidences.utils import read_config, LazyModule
+
+tf = LazyModule('tensorflow')
+
+GRAPH_FILE = 'frozen_model.pb'
+TENSORS_FILE = 'frozen_model.json'
+
+
+class FrozenModel(object):
+    """
+    Inference-only model imported from the frozen graph written by export_frozen.py, which holds only the encoder, the
+    initial state and a single decoder step with the weights folded in as constants. Loading it does not rebuild the
+    model in Python nor restore a checkpoint. It has the same inference methods as Model.
+    """
+
+    def __init__(self, config, tensors):
+        self.config = config
+        self.encoder = argparse.Namespace(inputs=tensors['inputs'], encodings=tensors['encodings'],
+                                          sigmas=tensors['sigmas'], psi_mean=tensors['psi_mean'],
+                                          psi_covariance=tensors['psi_covariance'])
+        self.decoder = argparse.Namespace(initial_state=tensors['decoder_initial_state'], nodes=tensors['nodes'],
+                                          edges=tensors['edges'], state=tensors['state'])
+        self.psi = tensors['psi']
+        self.num_psi_samples = tensors['num_psi_samples']
+        self.psi_samples = tensors['psi_samples']
+        self.initial_state = tensors['initial_state']
+        self.probs = tensors['probs']
+
+    @staticmethod
+    def load(save, graph):
+        """
+        Imports the frozen graph saved in a directory
+
+        :param save: the directory
+        :param graph: the graph to import into (that of the session the model will be run in)
+        :return: the model
+        """
+        with open(os.path.join(save, 'config.json')) as f:
+            config = read_config(json.load(f), chars_vocab=True)
+        config.batch_size = 1
+        config.decoder.max_ast_depth = 1
+
+        graph_def = tf.GraphDef()
+        with open(os.path.join(save, GRAPH_FILE), 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+
+        # names of the tensors, either a single name or a list of names
+        with open(os.path.join(save, TENSORS_FILE)) as f:
+            names = json.load(f)
+        tensors = {key: [graph.get_tensor_by_name(n) for n in name] if isinstance(name, list)
+                   else graph.get_tensor_by_name(name) for key, name in names.items()}
+        return FrozenModel(config, tensors)
+
+    evidence_inputs = Model.evidence_inputs
+    evidence_inputs_batch = Model.evidence_inputs_batch
+    evidence_feed = Model.evidence_feed
+
+    def encoder_feed(self, inputs, indices):
+        # graphs exported before sets of words were wrangled into lists of indices take their multi-hot vectors
+        feed = Model.encoder_feed(self, inputs, indices)
+        for i in indices:
+            ev = self.config.evidence[i]
+            if isinstance(ev, SparseEvidence) and self.encoder.inputs[i].shape.ndims == 3:
+                feed[self.encoder.inputs[i].name] = ev.densify(inputs[i])
+        return feed
+
+    infer_encodings = Model.infer_encodings
+    infer_psi = Model.infer_psi
+    infer_psi_params = Model.infer_psi_params
+    infer_psi_params_batch = Model.infer_psi_params_batch
+    infer_psi_samples = Model.infer_psi_samples
+    infer_initial_state = Model.infer_initial_state
+    infer_step = Model.infer_step
+    infer_ast_batch = Model.infer_ast_batch
+    infer_ast = Model.infer_ast
@@ -13,72 +13,419 @@
 # limitations under the License.
 
 from __future__ import print_function
-import tensorflow as tf
 import numpy as np
 
 import os
 import pickle
 import json
+import heapq
+import time
+from collections import OrderedDict
 
 from bayou.models.low_level_evidences.model import Model
 from bayou.models.low_level_evidences.utils import CHILD_EDGE, SIBLING_EDGE
-from bayou.models.low_level_evidences.utils import read_config
+from bayou.models.low_level_evidences.utils import read_config, LazyModule
+from bayou.models.low_level_evidences.state_cache import DecoderStateCache
+from bayou.models.low_level_evidences.numpy_model import NumpyModel
+from bayou.models.low_level_evidences.call_evidences import CallEvidences
+from bayou.models.low_level_evidences.frozen_model import FrozenModel
+from bayou.models.search import SearchBudget, SearchStats, SearchProgress
+
+tf = LazyModule('tensorflow')
 
 MAX_GEN_UNTIL_STOP = 20
 MAX_AST_DEPTH = 5
 
-from bayou.models.low_level_evidences.evidence import Javadoc
+from bayou.models.low_level_evidences.evidence import Javadoc, Keywords
 
 class TooLongPathError(Exception):
     pass
 
 
-class IncompletePathError(Exception):
+class InvalidSketchError(Exception):
     pass
 
 
-class InvalidSketchError(Exception):
-    pass
+class PathState(object):
+    """
+    State of the pushdown automaton that parses a production path, updated in O(1) as tokens are appended to the path.
+    Once the path takes the child edge of a DBranch, DExcept or DLoop, it can only be completed within that node, so
+    besides the block being consumed the state only needs the blocks of the innermost such node that remain. The state
+    also keeps the counts that bound the path (its length, the number of DBranch/DExcept/DLoop nodes, and the calls
+    seen so far), and the error that invalidates the path, if any.
+    """
+    __slots__ = ['length', 'counts', 'calls', 'check_call', 'blocks', 'complete', 'error']
+
+    MAX_LENGTH = 30
+    MAX_COUNT = 2
+    NODES = {'DBranch': 0, 'DExcept': 1, 'DLoop': 2}
+    BLOCKS = {'DBranch': (True, False, False),  # _cond, _then, _else (True if the block must only have calls)
+              'DExcept': (False, False),  # _try, _catch
+              'DLoop': (True, False)}  # _cond, _body
+
+    def __init__(self, length=1, counts=(0, 0, 0), calls=frozenset(), check_call=False, blocks=(), complete=False,
+                 error=None):
+        self.length = length
+        self.counts = counts
+        self.calls = calls
+        self.check_call = check_call
+        self.blocks = blocks
+        self.complete = complete
+        self.error = error
+
+    def step(self, node, edge):
+        """
+        Gets the state of the path after appending a token to it
+
+        :param node: the node of the token
+        :param edge: the edge of the token
+        :return: the new state
+        :raise: ValueError if the path takes a child edge from a node that cannot have one
+        """
+        length, counts, calls = self.length + 1, self.counts, self.calls
+        check_call, blocks, complete, error = self.check_call, self.blocks, self.complete, self.error
+
+        # bounds on the path
+        if length > PathState.MAX_LENGTH:
+            error = TooLongPathError
+        if node in PathState.NODES:
+            i = PathState.NODES[node]
+            counts = counts[:i] + (counts[i] + 1,) + counts[i+1:]
+            if counts[i] > PathState.MAX_COUNT:
+                error = TooLongPathError
+        elif node not in ['DSubTree', 'STOP']:
+            if node in calls:
+                error = TooLongPathError
+            calls = calls | {node}
+
+        # parse the token, tokens after the path is complete are ignored
+        if complete or error is not None:
+            pass
+        elif node == 'STOP':
+            if len(blocks) == 0:
+                complete = True
+            else:
+                check_call, blocks = blocks[0], blocks[1:]
+        elif check_call:
+            if node in ['DBranch', 'DExcept', 'DLoop', 'DSubTree']:
+                error = InvalidSketchError
+        elif edge == SIBLING_EDGE:
+            pass
+        elif node in PathState.BLOCKS:
+            check_call, blocks = PathState.BLOCKS[node][0], PathState.BLOCKS[node][1:]
+        else:
+            raise ValueError('Invalid node/edge: ' + str((node, edge)))
+
+        return PathState(length, counts, calls, check_call, blocks, complete, error)
+
+    def legal(self, vocab, call_only):
+        """
+        Gets the tokens that can be appended to the path (with a sibling edge, and also a child edge for a DBranch,
+        DExcept or DLoop) without making it invalid
+
+        :param vocab: the decoder vocabulary
+        :param call_only: boolean mask over the vocabulary of the tokens allowed in a block that must only have calls
+        :return: boolean mask over the vocabulary of the legal tokens
+        """
+        if self.error is not None or self.length + 1 > PathState.MAX_LENGTH:
+            return np.zeros(len(vocab), dtype=bool)
+        mask = np.copy(call_only) if self.check_call and not self.complete else np.ones(len(vocab), dtype=bool)
+        for node, i in PathState.NODES.items():
+            if self.counts[i] >= PathState.MAX_COUNT and node in vocab:
+                mask[vocab[node]] = False
+        for call in self.calls:
+            if call in vocab:
+                mask[vocab[call]] = False
+        return mask
+
+
+class BeamHeap(object):
+    """
+    Bounded min-heap holding the most likely candidates of a beam search step, without duplicates
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.heap = []
+        self.fingerprints = set()
+        self.count = 0
+
+    def admits(self, log_pr):
+        """
+        Checks if a candidate with the given log-likelihood would enter the beam
+
+        :param log_pr: log-likelihood of the candidate
+        :return: boolean indicating if the candidate would enter the beam
+        """
+        return len(self.heap) < self.width or log_pr > self.heap[0][0]
+
+    def push(self, fingerprint, candidate, log_pr):
+        """
+        Adds a candidate to the beam, evicting the least likely one if the beam is full. Ties are broken in favor of
+        the candidate that was pushed first.
+
+        :param fingerprint: fingerprint of the candidate
+        :param candidate: list of production paths in the candidate
+        :param log_pr: log-likelihood of the candidate
+        """
+        if fingerprint in self.fingerprints or not self.admits(log_pr):
+            return
+        self.count += 1
+        heapq.heappush(self.heap, (log_pr, -self.count, fingerprint, candidate))
+        self.fingerprints.add(fingerprint)
+        if len(self.heap) > self.width:
+            _, _, evicted, _ = heapq.heappop(self.heap)
+            self.fingerprints.discard(evicted)
+
+    def candidates(self):
+        """
+        Gets the candidates in the beam
+
+        :return: list of (candidate, log-likelihood) ordered by likelihood
+        """
+        return [(candidate, log_pr) for (log_pr, _, _, candidate) in sorted(self.heap, reverse=True)]
+
+
+class BeamSearchSteps(object):
+    """
+    Resumable beam search of a predictor, running the decoder of the predictor. Every call to next() runs one step of
+    the search (a single batched decoder call), so the caller can stop (and close) the search between steps, e.g., when
+    it is no longer needed. Once the iteration stops, the ASTs are in result.
+    """
+
+    def __init__(self, predictor, psi, beam_width, progress=None, budget=None):
+        self.predictor = predictor
+        self.psi = psi
+        self.search = predictor.beam_search(psi, beam_width, progress, budget)
+        self.paths = None
+        self.steps = 0
+        self.result = None
+        self.done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        predictor = self.predictor
+        try:
+            if self.paths is None:
+                self.paths = next(self.search)
+            dists = predictor.model.infer_ast_batch(predictor.sess, self.psi, self.paths, cache=predictor.state_cache)
+            self.steps += 1
+            self.paths = self.search.send(dists)
+        except StopIteration as e:
+            self.result = e.value
+            self.done = True
+            raise StopIteration
+        return self.steps
+
+    @property
+    def iterations(self):
+        # every iteration of the search runs a step, except for the last one, which finds that all candidates are
+        # complete
+        return self.steps + 1 if self.result is not None else self.steps
+
+    def close(self):
+        """
+        Cancels the search if it has not finished
+        """
+        self.done = True
+        self.search.close()
 
 
 class BayesianPredictor(object):
 
-    def __init__(self, save, sess, embed_file=None):
+    def __init__(self, save, sess, embed_file=None, backend='tf', psi_cache=None, state_cache=None):
+        """
+        Loads a saved model for inference
+
+        :param save: directory of the saved model
+        :param sess: the TensorFlow session (unused, and may be None, with the NumPy backend)
+        :param embed_file: word embedding file (or embedding store) for the Javadoc evidence, or None to use the
+                           vocabulary of the config and the embedding of the checkpoint
+        :param backend: 'tf' to run the model in TensorFlow, 'frozen' to run the graph exported with
+                        export_frozen.py in TensorFlow, or 'numpy' to run the weights exported with export_numpy.py in
+                        NumPy, without importing TensorFlow
+        :param psi_cache: PsiCache of encoder outputs, or None to run the encoder on every request
+        :param state_cache: DecoderStateCache of decoder states shared across searches, or None for one of the default
+                            size
+        :raise: ValueError if the backend is unknown
+        """
         self.sess = sess
+        self.save = save
+        self.load_seconds = OrderedDict()  # time spent in each phase of loading the model
+        start = time.time()
 
         # load the saved config
-        with open(os.path.join(save, 'config.json')) as f:
-            config = read_config(json.load(f), chars_vocab=True)
-        self.model = Model(config, True)
-
+        if backend == 'tf':
+            with open(os.path.join(save, 'config.json')) as f:
+                config = read_config(json.load(f), chars_vocab=True)
+            self.model = Model(config, True)
+        elif backend == 'frozen':
+            self.model = FrozenModel.load(save, self.sess.graph)
+            config = self.model.config
+        elif backend == 'numpy':
+            self.model = NumpyModel.load(save)
+            config = self.model.config
+        else:
+            raise ValueError('Invalid backend: {}'.format(backend))
+        self.load_seconds['model'] = time.time() - start
+
+        start = time.time()
         for ev in config.evidence:
-            if isinstance(ev, Javadoc):
+            if isinstance(ev, Javadoc) and embed_file is not None:
                 ev.set_chars_vocab(embed_file)
+            if isinstance(ev, Keywords):
+                ev.use_nltk_data(save)
+                ev.load_lemmas(save)
+        self.load_seconds['evidences'] = time.time() - start
 
-        # load the callmap
-        with open(os.path.join(save, 'callmap.pkl'), 'rb') as f:
-            self.callmap = pickle.load(f)
+        # the callmap and the evidences of its calls are loaded on first use (see callmap and call_evidences)
+        self._callmap = None
+        self._call_evidences = None
 
         # restore the saved model
-        tf.global_variables_initializer().run()
-        saver = tf.train.Saver(tf.global_variables())
-        ckpt = tf.train.get_checkpoint_state(save)
-        saver.restore(self.sess, ckpt.model_checkpoint_path)
+        if backend == 'tf':
+            start = time.time()
+            tf.global_variables_initializer().run()
+            saver = tf.train.Saver(tf.global_variables())
+            ckpt = tf.train.get_checkpoint_state(save)
+            saver.restore(self.sess, ckpt.model_checkpoint_path)
+            self.load_seconds['restore'] = time.time() - start
+
+        # decoder states of production path prefixes, shared across searches with the same intent
+        self.state_cache = state_cache if state_cache is not None else DecoderStateCache()
+        self.psi_cache = psi_cache
+
+    @property
+    def callmap(self):
+        """
+        The calls of the training data by name (used to check the evidences of generated ASTs), loaded on first use
 
-    def infer(self, evidences, num_psi_samples=100, beam_width=25):
+        :return: dict of the names of calls to their nodes
+        """
+        if self._callmap is None:
+            with open(os.path.join(self.save, 'callmap.pkl'), 'rb') as f:
+                self._callmap = pickle.load(f)
+        return self._callmap
+
+    @property
+    def call_evidences(self):
+        """
+        The index of the evidences of the calls of the training data (see CallEvidences), loaded on first use
+
+        :return: the CallEvidences of the model
+        """
+        if self._call_evidences is None:
+            self._call_evidences = CallEvidences.load(self.save)
+        return self._call_evidences
+
+    def infer(self, evidences, num_psi_samples=100, beam_width=25, psi_mode='sample', stats=None, budget=None):
         """
         Returns an ordered (by probability) list of ASTs from the model, given evidences, using beam search
 
         :param evidences: the input evidences
         :param num_psi_samples: number of samples of the intent, averaged before AST construction
         :param beam_width: width of the beam search
+        :param psi_mode: how samples of the intent are averaged (see psi_average_from_evidence)
+        :param stats: object whose psi_seconds, search_seconds, decoder_steps and beam_iterations are incremented by
+                      the work done (e.g., bayou.server.metrics.RequestStats), or None
+        :param budget: SearchBudget of the search, or None to run it to the end
         :return: list of ASTs ordered by their probabilities
         """
-        psis = []
-        for i in range(num_psi_samples):
-            psis.append(self.psi_from_evidence(evidences))
-        psi = np.mean(psis, axis=0)
-        return self.generate_asts_beam_search(psi, beam_width)
+        start = time.time()
+        psi = self.psi_average_from_evidence(evidences, num_psi_samples, psi_mode)
+        if stats is not None:
+            stats.psi_seconds += time.time() - start
+        return self.generate_asts_beam_search(psi, beam_width, stats, budget)
+
+    def infer_stream(self, evidences, num_psi_samples=100, beam_width=25, psi_mode='sample', provisional=False,
+                     stats=None, budget=None):
+        """
+        Generates the ASTs of infer as the beam search completes them (see SearchProgress)
+
+        :param evidences: the input evidences
+        :param num_psi_samples: number of samples of the intent, averaged before AST construction
+        :param beam_width: width of the beam search
+        :param psi_mode: how samples of the intent are averaged (see psi_average_from_evidence)
+        :param provisional: whether to also generate ASTs that are complete but not yet final
+        :param stats: object to add the work done to (see infer), or None
+        :param budget: SearchBudget of the search, or None to run it to the end
+        :return: generator of records of ASTs
+        """
+        start = time.time()
+        psi = self.psi_average_from_evidence(evidences, num_psi_samples, psi_mode)
+        if stats is not None:
+            stats.psi_seconds += time.time() - start
+        progress = SearchProgress(self, provisional)
+        steps = self.beam_search_steps(psi, beam_width, progress, budget)
+        start = time.time()
+        for _ in steps:
+            yield from progress.pop()
+        if stats is not None:
+            stats.search_seconds += time.time() - start  # including the time the records waited to be consumed
+            stats.decoder_steps += steps.steps
+            stats.beam_iterations += steps.iterations
+        yield from progress.pop()
+
+    def infer_batch(self, evidences_list, num_psi_samples=100, beam_width=25, psi_mode='sample', max_batch=16,
+                    stats=None, budget=None):
+        """
+        Generates the ASTs of infer for many sets of evidences, running up to max_batch of them together: the
+        evidences of items that start together are encoded in a single batch, and every step of their beam searches
+        shares a single batched decoder call. An item starts as soon as another one finishes.
+
+        :param evidences_list: list of evidences
+        :param num_psi_samples: number of samples of the intent, averaged before AST construction
+        :param beam_width: width of the beam search
+        :param psi_mode: how samples of the intent are averaged (see psi_average_from_evidence)
+        :param max_batch: maximum number of items run together
+        :param stats: object to add the work done for all items to (see infer), or None
+        :param budget: SearchBudget shared by the searches of all items, or None to run them to the end
+        :return: generator of (index of the evidences in the list, list of ASTs), in the order the items finish
+        """
+        if stats is None:
+            stats = SearchStats()
+        active = []  # list of [index, psi, search, paths the search is waiting for]
+        start = 0
+        while start < len(evidences_list) or len(active) > 0:
+            if start < len(evidences_list) and len(active) < max_batch:
+                indices = list(range(start, min(len(evidences_list), start + max_batch - len(active))))
+                start = indices[-1] + 1
+                psi_start = time.time()
+                mean, covariance = self.psi_params_from_evidence_batch([evidences_list[i] for i in indices])
+                stats.psi_seconds += time.time() - psi_start
+                for j, i in enumerate(indices):
+                    psi = self.psi_average(mean[j:j+1], covariance[j:j+1], num_psi_samples, psi_mode)
+                    search = self.beam_search(psi, beam_width, budget=budget)
+                    stats.beam_iterations += 1  # the last iteration of the search, which does not yield
+                    try:
+                        active.append([i, psi, search, next(search)])
+                    except StopIteration as e:
+                        yield i, e.value
+                if len(active) == 0:
+                    continue
+
+            psis = np.concatenate([np.repeat(psi, len(paths), axis=0) for (_, psi, _, paths) in active])
+            paths = [path for (_, _, _, paths) in active for path in paths]
+            search_start = time.time()
+            dists = self.model.infer_ast_batch(self.sess, psis, paths, cache=self.state_cache)
+            stats.search_seconds += time.time() - search_start
+            stats.decoder_steps += 1
+            stats.beam_iterations += len(active)
+            running = []
+            offset = 0
+            for entry in active:
+                i, _, search, paths = entry
+                try:
+                    entry[3] = search.send(dists[offset:offset + len(paths)])
+                    running.append(entry)
+                except StopIteration as e:
+                    yield i, e.value
+                offset += len(paths)
+            active = running
 
     def psi_random(self):
         """
@@ -95,200 +442,338 @@ class BayesianPredictor(object):
         :param js_evidences: the evidences
         :return: the latent intent
         """
-        return self.model.infer_psi(self.sess, js_evidences)
+        if self.psi_cache is None:
+            return self.model.infer_psi(self.sess, js_evidences)
+        mean, covariance = self.psi_params_from_evidence(js_evidences)
+        return mean + np.sqrt(covariance) * np.random.normal(size=mean.shape).astype(np.float32)
+
+    def psi_samples_from_evidence(self, js_evidences, num_samples):
+        """
+        Gets a batch of latent intents from the model, given some evidences, running the encoder only once
 
-    def generate_asts_beam_search(self, psi, beam_width):
+        :param js_evidences: the evidences
+        :param num_samples: number of samples of the intent
+        :return: the latent intents, one in each row
+        """
+        if self.psi_cache is None:
+            return self.model.infer_psi_samples(self.sess, js_evidences, num_samples)
+        mean, covariance = self.psi_params_from_evidence(js_evidences)
+        samples = np.random.normal(size=[num_samples, self.model.config.latent_size]).astype(np.float32)
+        return mean + np.sqrt(covariance) * samples
+
+    def psi_params_from_evidence(self, js_evidences):
+        """
+        Gets the mean and (diagonal) covariance of the latent intent, given some evidences, reusing the encoder
+        outputs in the psi cache if there is one
+
+        :param js_evidences: the evidences
+        :return: mean and covariance of the intent
+        """
+        if self.psi_cache is None:
+            return self.model.infer_psi_params(self.sess, js_evidences)
+        return self.psi_cache.psi_params(self.model, self.sess, self.model.evidence_inputs(js_evidences))
+
+    def psi_params_from_evidence_batch(self, js_evidences_list):
+        """
+        Gets the mean and (diagonal) covariance of the latent intent for many sets of evidences, running the encoder on
+        all of them at once
+
+        :param js_evidences_list: list of evidences
+        :return: mean and covariance of the intents, one row for each set of evidences
+        """
+        if self.psi_cache is None:
+            return self.model.infer_psi_params_batch(self.sess, js_evidences_list)
+        return self.psi_cache.psi_params(self.model, self.sess, self.model.evidence_inputs_batch(js_evidences_list))
+
+    def evidence_key(self, js_evidences):
+        """
+        Gets a key of some evidences as the model reads them, which is the same for all evidences that the encoder
+        cannot tell apart (e.g., that differ in the order of, or duplicates in, lists, or in keywords with the same
+        lemmas)
+
+        :param js_evidences: the evidences
+        :return: the key (str)
+        """
+        inputs = self.model.evidence_inputs(js_evidences)
+        return ' '.join('{}:{}'.format(ev.name, ev.key(inp[0]).hex() if ev.present(inp)[0] else '')
+                        for ev, inp in zip(self.model.config.evidence, inputs))
+
+    def psi_average_from_evidence(self, js_evidences, num_samples=100, mode='sample'):
+        """
+        Gets the average of a number of samples of the latent intent, given some evidences. The encoder is run only
+        once to get the mean and covariance of the intent, and the samples are drawn (or averaged analytically) in NumPy
+
+        :param js_evidences: the evidences
+        :param num_samples: number of samples of the intent to average
+        :param mode: 'sample' to draw and average the samples, 'mean' to use their expectation (deterministic)
+        :return: the averaged latent intent
+        """
+        mean, covariance = self.psi_params_from_evidence(js_evidences)
+        return self.psi_average(mean, covariance, num_samples, mode)
+
+    @staticmethod
+    def psi_average(mean, covariance, num_samples=100, mode='sample'):
+        """
+        Gets the average of a number of samples of the latent intent, given its mean and covariance
+
+        :param mean: mean of the intent
+        :param covariance: (diagonal) covariance of the intent
+        :param num_samples: number of samples of the intent to average
+        :param mode: 'sample' to draw and average the samples, 'mean' to use their expectation (deterministic)
+        :return: the averaged latent intent
+        """
+        if mode == 'mean':
+            return mean
+        elif mode == 'sample':
+            samples = np.random.normal(size=[num_samples] + list(mean.shape))
+            psi = mean + np.sqrt(covariance) * np.mean(samples, axis=0)
+            return psi.astype(np.float32)
+        else:
+            raise ValueError('Invalid psi mode: ' + mode)
+
+    def generate_asts_beam_search(self, psi, beam_width, stats=None, budget=None):
         """
         Performs beam search to construct the top-k ASTs
 
         :param psi: the intent
         :param beam_width: width of beam search (corresponds to the number of results)
+        :param stats: object to add the work done to (see infer), or None
+        :param budget: SearchBudget of the search, or None to run it to the end
         :return: an ordered list of top-k ASTs
         """
+        start = time.time()
+        steps = self.beam_search_steps(psi, beam_width, budget=budget)
+        for _ in steps:
+            pass
+        if stats is not None:
+            stats.search_seconds += time.time() - start
+            stats.decoder_steps += steps.steps
+            stats.beam_iterations += steps.iterations
+        return steps.result
+
+    def beam_search_steps(self, psi, beam_width, progress=None, budget=None):
+        """
+        Beam search to construct the top-k ASTs, as an iterator that runs one step of the search at a time
+
+        :param psi: the intent
+        :param beam_width: width of beam search (corresponds to the number of results)
+        :param progress: function called after every step of the search (see beam_search)
+        :param budget: SearchBudget of the search, or None to run it to the end
+        :return: BeamSearchSteps of the search
+        """
+        return BeamSearchSteps(self, psi, beam_width, progress, budget)
 
-        # each candidate is (list of production paths in the AST, likelihood of AST so far)
-        candidates = [([[('DSubTree', CHILD_EDGE)]], 1.)]
-        complete_candidates = []
-        complete_pr_keys = []
-        cache = dict()
+    def beam_search(self, psi, beam_width, progress=None, budget=None):
+        """
+        Beam search to construct the top-k ASTs, as a generator that leaves running the decoder to the caller so that
+        steps of many searches can be run together. At every step it yields the production path prefixes (a list of
+        (nodes, edges)) whose next token distributions it needs, and must be sent the distributions (as returned by
+        Model.infer_ast_batch with the given psi).
 
-        # hack: use 16-digit probability as candidate ID to check for duplicates that might block out the beam
-        def get_key(prob):
-            return float('{:16f}'.format(prob))
+        :param psi: the intent
+        :param beam_width: width of beam search (corresponds to the number of results)
+        :param progress: function called after every step with the top-k complete candidates so far and the number of
+                         those that are guaranteed to be in the final top-k (see SearchProgress)
+        :param budget: SearchBudget of the search, or None to run it to the end. Once it runs out, the search
+                       completes its candidates greedily, and the ASTs it returns may not be the top-k.
+        :return: an ordered list of top-k ASTs (as the value of StopIteration)
+        """
 
+        # each candidate is (list of production paths in the AST along with their parse states, log-likelihood of AST
+        # so far)
+        candidates = [([([('DSubTree', CHILD_EDGE)], PathState())], 0.)]
+        complete_candidates = dict()
+        chars = self.model.config.decoder.chars
+        vocab = self.model.config.decoder.vocab
+
+        # tokens allowed in the _cond of a DBranch or DLoop
+        call_only = np.ones(len(chars), dtype=bool)
+        for node in ['DBranch', 'DExcept', 'DLoop', 'DSubTree']:
+            if node in vocab:
+                call_only[vocab[node]] = False
+
+        steps = 0
+        greedy = False
         partial_candidate = True
         while partial_candidate:
             partial_candidate = False
-            new_candidates = []
-            pr_keys = []
-            for (candidate, pr) in candidates:
-
-                # gather candidate's complete and incomplete paths
-                complete_paths, incomplete_paths = [], []
-                try:
-                    for path in candidate:
-                        if self.is_complete_path(path):
-                            complete_paths.append(path)
-                        else:
-                            incomplete_paths.append(path)
-                except (InvalidSketchError, TooLongPathError) as e:
+            beam = BeamHeap(beam_width)
+
+            # once out of budget, only partial candidates more likely than the k-th complete candidate can still make
+            # the top-k, and they are completed greedily
+            if not greedy and budget is not None and budget.expired(steps):
+                greedy = True
+                budget.truncated += 1
+            if greedy and len(complete_candidates) >= beam_width:
+                kth = min(log_pr for (_, log_pr) in complete_candidates.values())
+                candidates = [(candidate, log_pr) for (candidate, log_pr) in candidates
+                              if log_pr > kth or all(state.complete for (_, state) in candidate)]
+
+            # gather every candidate's complete and incomplete paths, and the frontier of unique incomplete paths along
+            # with the tokens that can legally extend them
+            expansions = []
+            frontier = OrderedDict()
+            legal = dict()
+            for (candidate, log_pr) in candidates:
+                if any(state.error is not None for (_, state) in candidate):
                     continue  # throw out the candidate
+                complete_paths = [(path, state) for (path, state) in candidate if state.complete]
+                incomplete_paths = [(path, state) for (path, state) in candidate if not state.complete]
+                for (inc_path, inc_state) in incomplete_paths:
+                    key = tuple(inc_path)
+                    if key not in legal:
+                        legal[key] = inc_state.legal(vocab, call_only)
+                if any(not legal[tuple(inc_path)].any() for (inc_path, _) in incomplete_paths):
+                    continue  # throw out the candidate, it has a path that cannot be completed
+                expansions.append((candidate, log_pr, complete_paths, incomplete_paths))
+                for (inc_path, _) in incomplete_paths:
+                    frontier[tuple(inc_path)] = None
+
+            # score the whole frontier with a single batched decoder call
+            if len(frontier) > 0:
+                paths = [list(zip(*path)) for path in frontier]
+                steps += 1
+                dists = yield paths
+                frontier = dict(zip(frontier.keys(), dists))
+
+            for (candidate, log_pr, complete_paths, incomplete_paths) in expansions:
 
                 # if candidate is a fully formed AST, add it to new candidates and continue
                 if len(incomplete_paths) == 0:
-                    pr_key = get_key(pr)
-                    if pr_key not in complete_pr_keys:
-                        complete_pr_keys.append(pr_key)
-                        complete_candidates.append((candidate, pr))
-                    if pr_key not in pr_keys:
-                        pr_keys.append(pr_key)
-                        new_candidates.append((candidate, pr))
+                    fingerprint = self.fingerprint(candidate)
+                    complete_candidates[fingerprint] = (candidate, log_pr)
+                    beam.push(fingerprint, candidate, log_pr)
                     continue
                 partial_candidate = True
 
-                # for every incomplete path, create k new candidates from the top k in the next step's dist
-                for i, inc_path in enumerate(incomplete_paths):
-                    nodes, edges = zip(*inc_path)
-                    dist = list(enumerate(self.model.infer_ast(self.sess, psi, nodes, edges, cache=cache)))
-                    dist.sort(key=lambda x: x[1], reverse=True)
-                    topk = dist[:beam_width]
+                # extend every incomplete path with its most likely legal token, into a single new candidate
+                if greedy:
+                    new_candidate = list(complete_paths)
+                    new_log_pr = log_pr
+                    for (inc_path, inc_state) in incomplete_paths:
+                        dist = np.where(legal[tuple(inc_path)], frontier[tuple(inc_path)], -1.)
+                        idx = int(np.argmax(dist))
+                        with np.errstate(divide='ignore'):
+                            log_p = np.log(np.float64(dist[idx]))
+                        new_log_pr += self.token_log_pr(chars[idx], log_p)
+                        new_candidate += self.extend_path(inc_path, inc_state, chars[idx])
+                    beam.push(self.fingerprint(new_candidate), new_candidate, new_log_pr)
+                    continue
+
+                # for every incomplete path, create k new candidates from the top k legal tokens in the next step's dist
+                for i, (inc_path, inc_state) in enumerate(incomplete_paths):
+                    mask = legal[tuple(inc_path)]
+                    dist = np.where(mask, frontier[tuple(inc_path)], -1.)  # illegal tokens are never in the top k
+                    k = min(beam_width, np.count_nonzero(mask))
+                    topk = np.argpartition(-dist, k - 1)[:k]
+                    topk = topk[np.argsort(-dist[topk], kind='mergesort')]
+                    with np.errstate(divide='ignore'):
+                        log_dist = np.log(dist[topk].astype(np.float64))
+
+                    for (idx, log_p) in zip(topk, log_dist):
+                        prediction = chars[idx]
+                        new_log_pr = log_pr + self.token_log_pr(prediction, log_p)
+                        if not beam.admits(new_log_pr):
+                            continue  # would be bounded out of the beam anyway
 
-                    for (idx, p) in topk:
                         new_candidate = [path for path in complete_paths] + \
                                         [path for (j, path) in enumerate(incomplete_paths) if i != j]
-                        prediction = self.model.config.decoder.chars[idx]
-
-                        inc_path_step_SIBLING = inc_path + [(prediction, SIBLING_EDGE)]
-                        if prediction in ['DBranch', 'DExcept', 'DLoop']:
-                            inc_path_step_CHILD = inc_path + [(prediction, CHILD_EDGE)]
-                            new_pr = pr * p * p
-                            pr_key = get_key(new_pr)
-                            if pr_key not in pr_keys:
-                                pr_keys.append(pr_key)
-                                new_candidates.append((new_candidate + [inc_path_step_CHILD, inc_path_step_SIBLING],
-                                                       new_pr))
-                        else:
-                            new_pr = pr * p
-                            pr_key = get_key(new_pr)
-                            if pr_key not in pr_keys:
-                                pr_keys.append(pr_key)
-                                new_candidates.append((new_candidate + [inc_path_step_SIBLING], new_pr))
-
-            # bound candidates with the beam width
-            new_candidates += [c for c in complete_candidates if c not in new_candidates]
-            new_candidates.sort(key=lambda x: x[1], reverse=True)
-            candidates = new_candidates[:beam_width]
-
-        # convert each set of paths into an AST
-        asts = []
-        for (candidate, pr) in candidates:
-            ast = {'ast': self.paths_to_ast(candidate),
-                   'probability': '{:e}'.format(pr)}
-            if ast not in asts:
-                asts.append(ast)
-        return asts
+                        new_candidate += self.extend_path(inc_path, inc_state, prediction)
+                        beam.push(self.fingerprint(new_candidate), new_candidate, new_log_pr)
+
+            # bound candidates with the beam width, also considering complete candidates from earlier steps
+            if len(complete_candidates) > beam_width:
+                best = heapq.nlargest(beam_width, complete_candidates.items(), key=lambda x: x[1][1])
+                complete_candidates = dict(best)
+            for fingerprint, (candidate, log_pr) in complete_candidates.items():
+                beam.push(fingerprint, candidate, log_pr)
+            candidates = beam.candidates()
+
+            # complete candidates so far, those more likely than every partial candidate are final (their
+            # completions can only be less likely)
+            if progress is not None:
+                complete = OrderedDict()
+                bound = -np.inf
+                for (candidate, log_pr) in candidates:
+                    if any(state.error is not None for (_, state) in candidate):
+                        continue  # thrown out at the next step
+                    elif all(state.complete for (_, state) in candidate):
+                        complete[self.fingerprint(candidate)] = (candidate, log_pr)
+                    else:
+                        bound = max(bound, log_pr)
+                for fingerprint, (candidate, log_pr) in complete_candidates.items():
+                    complete.setdefault(fingerprint, (candidate, log_pr))
+                ranked = sorted([(fingerprint, candidate, log_pr) for fingerprint, (candidate, log_pr)
+                                 in complete.items()], key=lambda x: -x[2])[:beam_width]
+                num_final = len([log_pr for (_, _, log_pr) in ranked if log_pr > bound])
+                progress(ranked, num_final)
+
+        # convert each set of paths into an AST (candidates in the beam are already unique by their fingerprints)
+        return [self.candidate_ast(candidate, log_pr) for (candidate, log_pr) in candidates]
+
+    @staticmethod
+    def token_log_pr(prediction, log_p):
+        """
+        Gets the log-likelihood a token adds to a candidate
 
-    def is_complete_path(self, path):
+        :param prediction: the token
+        :param log_p: log-probability of the token in the next token distribution of its path
+        :return: the log-likelihood added, counting a DBranch, DExcept or DLoop twice (for its child and sibling paths)
         """
-        Checks if a production path is complete (i.e., no more productions need to be triggered)
+        return 2 * log_p if prediction in ['DBranch', 'DExcept', 'DLoop'] else log_p
 
-        :param path: the path to check for completeness
-        :return: boolean indicating if path is complete
-        :raise: InvalidSketchError if there is a parse error in the path, TooLongPathError is path is too long
+    @staticmethod
+    def extend_path(inc_path, inc_state, prediction):
         """
-        try:
-            if len(path) > 30:
-                raise TooLongPathError
-            nodes = [node for (node, edge) in path]
-            if nodes.count('DBranch') > 2 or nodes.count('DLoop') > 2 or nodes.count('DExcept') > 2:
-                raise TooLongPathError
-            calls = [call for (call, edge) in path if call not in ['DSubTree', 'DBranch', 'DLoop', 'DExcept', 'STOP']]
-            for call in calls:
-                if nodes.count(call) > 1:
-                    raise TooLongPathError
-            self.consume_until_STOP(path, 1)
-            return True
-        except IncompletePathError:
-            return False
-
-    def consume_until_STOP(self, path, idx, check_call=False):
-        """
-        Consumes a path until STOP is encountered, or throw an IncompletePathError. If a DBranch, DExcept or DLoop
-        is seen midway when going through the path, recursively attempts to consume the respective node type.
-
-        :param path: the path to consume
-        :param idx: current index to start consumption
-        :param check_call: if True, check and validate if the nodes in path are call nodes
-        :return: the index at which STOP was encountered if there were no recursive consumptions, otherwise -1
-        :raise: InvalidSketchError if check_call was True and failed, IncompletePathError if path is not complete
-        """
-
-        if idx >= len(path):
-            raise IncompletePathError
-        while path[idx][0] != 'STOP':
-            node, edge = path[idx]
-            if check_call:
-                if node in ['DBranch', 'DExcept', 'DLoop', 'DSubTree']:
-                    raise InvalidSketchError
-                idx += 1
-                if idx >= len(path):
-                    raise IncompletePathError
-                continue
-            if edge == SIBLING_EDGE:
-                idx += 1
-                if idx >= len(path):
-                    raise IncompletePathError
-                continue
-            if node == 'DBranch':
-                self.consume_DBranch(path, idx)
-                return -1
-            elif node == 'DExcept':
-                self.consume_DExcept(path, idx)
-                return -1
-            elif node == 'DLoop':
-                self.consume_DLoop(path, idx)
-                return -1
-            else:
-                raise ValueError('Invalid node/edge: ' + str((node, edge)))
-        return idx
+        Extends an incomplete production path with a token
 
-    def consume_DBranch(self, path, idx):
+        :param inc_path: the path
+        :param inc_state: the parse state of the path
+        :param prediction: the token
+        :return: list of the new paths (with their parse states), with a sibling edge and also a child edge (first) for
+                 a DBranch, DExcept or DLoop
         """
-        Consumes a branch node at the given index in the path
+        inc_path_step_SIBLING = (inc_path + [(prediction, SIBLING_EDGE)], inc_state.step(prediction, SIBLING_EDGE))
+        if prediction in ['DBranch', 'DExcept', 'DLoop']:
+            inc_path_step_CHILD = (inc_path + [(prediction, CHILD_EDGE)], inc_state.step(prediction, CHILD_EDGE))
+            return [inc_path_step_CHILD, inc_path_step_SIBLING]
+        return [inc_path_step_SIBLING]
 
-        :param path: the path to consume
-        :param idx: index of the branch node
-        :raise: InvalidSketchError if there is a parse error in the path, IncompletePathError if path is not complete
+    def candidate_ast(self, candidate, log_pr):
         """
-        idx = self.consume_until_STOP(path, idx+1, check_call=True)
-        if idx > 0:
-            idx = self.consume_until_STOP(path, idx+1)
-            if idx > 0:
-                self.consume_until_STOP(path, idx+1)
+        Converts a complete candidate of the beam search into an AST
 
-    def consume_DExcept(self, path, idx):
+        :param candidate: list of production paths in the candidate along with their parse states
+        :param log_pr: log-likelihood of the candidate
+        :return: the AST, with its probability
         """
-        Consumes an except node at the given index in the path
+        return {'ast': self.paths_to_ast([path for (path, _) in candidate]),
+                'probability': '{:e}'.format(np.exp(log_pr))}
 
-        :param path: the path to consume
-        :param idx: index of the except node
-        :raise: InvalidSketchError if there is a parse error in the path, IncompletePathError if path is not complete
+    @staticmethod
+    def fingerprint(paths):
         """
-        idx = self.consume_until_STOP(path, idx+1)
-        if idx > 0:
-            self.consume_until_STOP(path, idx+1)
+        Gets the canonical form of a set of production paths, used to identify duplicate candidates
 
-    def consume_DLoop(self, path, idx):
+        :param paths: the set of paths along with their parse states
+        :return: hashable fingerprint of the paths, independent of their order
         """
-        Consumes a loop node at the given index in the path
+        return tuple(sorted(tuple(path) for (path, _) in paths))
 
-        :param path: the path to consume
-        :param idx: index of the loop node
-        :raise: InvalidSketchError if there is a parse error in the path, IncompletePathError if path is not complete
+    def is_complete_path(self, path):
+        """
+        Checks if a production path is complete (i.e., no more productions need to be triggered)
+
+        :param path: the path to check for completeness
+        :return: boolean indicating if path is complete
+        :raise: InvalidSketchError if there is a parse error in the path, TooLongPathError is path is too long
         """
-        idx = self.consume_until_STOP(path, idx+1, check_call=True)
-        if idx > 0:
-            self.consume_until_STOP(path, idx+1)
+        state = PathState()
+        for (node, edge) in path[1:]:
+            state = state.step(node, edge)
+        if state.error is not None:
+            raise state.error
+        return state.complete
 
     def paths_to_ast(self, paths):
         """
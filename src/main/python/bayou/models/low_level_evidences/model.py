@@ -12,12 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import tensorflow as tf
-from tensorflow.contrib import legacy_seq2seq as seq2seq
 import numpy as np
+from collections import OrderedDict
 
 from bayou.models.low_level_evidences.architecture import BayesianEncoder, BayesianDecoder
 from bayou.models.low_level_evidences.data_reader import CHILD_EDGE, SIBLING_EDGE
+from bayou.models.low_level_evidences.state_cache import DecoderStateCache
+from bayou.models.low_level_evidences.utils import LazyModule
+
+tf = LazyModule('tensorflow')
+seq2seq = LazyModule('tensorflow.contrib.legacy_seq2seq')
 
 
 class Model():
@@ -25,14 +29,22 @@ class Model():
         assert config.model == 'lle', 'Trying to load different model implementation: ' + config.model
         self.config = config
         if infer:
-            config.batch_size = 1
+            config.batch_size = None  # open, see BayesianEncoder
             config.decoder.max_ast_depth = 1
 
         # setup the encoder
         self.encoder = BayesianEncoder(config)
-        samples = tf.random_normal([config.batch_size, config.latent_size],
-                                   mean=0., stddev=1., dtype=tf.float32)
+        samples = tf.random_normal(tf.shape(self.encoder.psi_mean), mean=0., stddev=1., dtype=tf.float32)
         self.psi = self.encoder.psi_mean + tf.sqrt(self.encoder.psi_covariance) * samples
+        if infer:
+            # batched sampler of intents from a single run of the encoder
+            self.num_psi_samples = tf.placeholder_with_default(1, [], name='num_psi_samples')
+            psi_samples = tf.random_normal([self.num_psi_samples, config.latent_size],
+                                           mean=0., stddev=1., dtype=tf.float32)
+            self.psi_samples = self.encoder.psi_mean + tf.sqrt(self.encoder.psi_covariance) * psi_samples
+
+            # during inference the decoder is fed a batch of intents, one for each production path prefix
+            self.psi = tf.placeholder_with_default(self.psi, [None, config.latent_size], name='psi')
 
         # setup the decoder with psi as the initial state
         lift_w = tf.get_variable('lift_w', [config.latent_size, config.decoder.units])
@@ -47,6 +59,10 @@ class Model():
         logits = tf.matmul(output, self.decoder.projection_w) + self.decoder.projection_b
         self.probs = tf.nn.softmax(logits)
 
+        # the losses and the optimizer are only needed for training
+        if infer:
+            return
+
         # 1. generation loss: log P(X | \Psi)
         self.targets = tf.placeholder(tf.int32, [config.batch_size, config.decoder.max_ast_depth])
         self.gen_loss = seq2seq.sequence_loss([logits], [tf.reshape(self.targets, [-1])],
@@ -70,48 +86,123 @@ class Model():
 
         var_params = [np.prod([dim.value for dim in var.get_shape()])
                       for var in tf.trainable_variables()]
-        if not infer:
-            print('Model parameters: {}'.format(np.sum(var_params)))
+        print('Model parameters: {}'.format(np.sum(var_params)))
 
-    def infer_psi(self, sess, evidences):
+    def evidence_inputs(self, evidences):
         # read and wrangle (with batch_size 1) the data
-        inputs = [ev.wrangle([ev.read_data_point(evidences)]) for ev in self.config.evidence]
+        return self.evidence_inputs_batch([evidences])
+
+    def evidence_inputs_batch(self, evidences_list):
+        # read and wrangle the data, one row for each set of evidences
+        return [ev.wrangle([ev.read_data_point(evidences) for evidences in evidences_list])
+                for ev in self.config.evidence]
+
+    def evidence_feed(self, evidences):
+        inputs = self.evidence_inputs(evidences)
 
         # setup initial states and feed
-        feed = {}
-        for j, ev in enumerate(self.config.evidence):
-            feed[self.encoder.inputs[j].name] = inputs[j]
-        psi = sess.run(self.psi, feed)
+        return self.encoder_feed(inputs, range(len(self.config.evidence)))
+
+    def encoder_feed(self, inputs, indices):
+        # feed the wrangled inputs of the given evidence types to the encoder
+        return {self.encoder.inputs[i].name: inputs[i] for i in indices}
+
+    def infer_psi(self, sess, evidences):
+        psi = sess.run(self.psi, self.evidence_feed(evidences))
         return psi
 
+    def infer_psi_params(self, sess, evidences):
+        # mean and (diagonal) covariance of the distribution of psi
+        [mean, covariance] = sess.run([self.encoder.psi_mean, self.encoder.psi_covariance],
+                                      self.evidence_feed(evidences))
+        return mean, covariance
+
+    def infer_encodings(self, sess, inputs, indices):
+        # run the encoders of only the given evidence types, and get their encodings and sigmas
+        feed = self.encoder_feed(inputs, indices)
+        fetches = [[self.encoder.encodings[i], self.encoder.sigmas[i]] for i in indices]
+        return [(encoding, sigma) for encoding, sigma in sess.run(fetches, feed)]
+
+    def infer_psi_params_batch(self, sess, evidences_list):
+        # mean and (diagonal) covariance of psi for many sets of evidences, with a single run of the encoder
+        inputs = self.evidence_inputs_batch(evidences_list)
+        feed = self.encoder_feed(inputs, range(len(inputs)))
+        [mean, covariance] = sess.run([self.encoder.psi_mean, self.encoder.psi_covariance], feed)
+        return mean, covariance
+
+    def infer_psi_samples(self, sess, evidences, num_samples):
+        feed = self.evidence_feed(evidences)
+        feed[self.num_psi_samples.name] = num_samples
+        psis = sess.run(self.psi_samples, feed)
+        return psis
+
+    def infer_initial_state(self, sess, psis):
+        # use the given psis and get decoder's start state (one per layer)
+        state = sess.run(self.initial_state, {self.psi: psis})
+        return [np.copy(state) for _ in range(self.config.decoder.num_layers)]
+
+    def infer_step(self, sess, psis, state, nodes, edges):
+        # run a single decoder step for a batch of (psi, state, node, edge)
+        n = np.array([self.config.decoder.vocab[node] for node in nodes], dtype=np.int32)
+        e = np.array([edge == CHILD_EDGE for edge in edges], dtype=bool)
+
+        feed = {self.decoder.nodes[0].name: n,
+                self.decoder.edges[0].name: e,
+                self.psi.name: psis}
+        for i in range(self.config.decoder.num_layers):
+            feed[self.decoder.initial_state[i].name] = state[i]
+        [probs, state] = sess.run([self.probs, self.decoder.state], feed)
+        return probs, state
+
+    def infer_ast_batch(self, sess, psis, paths, cache=None):
+        # paths is a list of (nodes, edges) prefixes, psis has one row per prefix (or a single row shared by all)
+        psis = np.asarray(psis, dtype=np.float32)
+        if len(psis) == 1 and len(paths) > 1:
+            psis = np.repeat(psis, len(paths), axis=0)
+        if cache is None:
+            cache = DecoderStateCache()
+        tokens = [list(zip(nodes, edges)) for nodes, edges in paths]
+        for path in tokens:
+            for node, edge in path:
+                assert edge == CHILD_EDGE or edge == SIBLING_EDGE, 'invalid edge: {}'.format(edge)
+
+        # get the trie roots of every psi, running the decoder's start state for the ones not cached
+        roots = [cache.get_root(psi) for psi in psis]
+        missing = [i for i, root in enumerate(roots) if root is None]
+        if len(missing) > 0:
+            state = self.infer_initial_state(sess, psis[missing])
+            for k, i in enumerate(missing):
+                roots[i] = cache.add_root(psis[i], [np.copy(s[k]) for s in state])
+
+        # resume every prefix from its longest cached prefix
+        nodes, depths = [], []
+        for root, path in zip(roots, tokens):
+            node, depth = cache.lookup(root, path)
+            nodes.append(node)
+            depths.append(depth)
+
+        # run the decoder in lock-step over the remaining tokens, stepping every distinct (prefix, token) only once
+        while True:
+            steps = OrderedDict()
+            for i, path in enumerate(tokens):
+                if depths[i] < len(path):
+                    steps.setdefault((nodes[i], path[depths[i]]), []).append(i)
+            if len(steps) == 0:
+                break
+            keys, rows = list(steps.keys()), list(steps.values())
+            state = [np.stack([node.state[j] for node, _ in keys]) for j in range(self.config.decoder.num_layers)]
+            probs, state = self.infer_step(sess, psis[[r[0] for r in rows]], state,
+                                           [token[0] for _, token in keys],
+                                           [token[1] for _, token in keys])
+            for k, (node, token) in enumerate(keys):
+                # copies, so that cached nodes do not keep the whole batch alive
+                child = cache.insert(node, token, [np.copy(s[k]) for s in state], np.copy(probs[k]))
+                for i in rows[k]:
+                    nodes[i] = child
+                    depths[i] += 1
+
+        cache.trim()
+        return np.stack([node.dist for node in nodes])
+
     def infer_ast(self, sess, psi, nodes, edges, cache=None):
-        # check cache if provided
-        if cache is not None:
-            serialized = ','.join(['(' + node + ',' + edge + ')' for node, edge in zip(nodes, edges)])
-            if serialized in cache:
-                return cache[serialized]
-
-        # use the given psi and get decoder's start state
-        state = sess.run(self.initial_state, {self.psi: psi})
-        state = [state] * self.config.decoder.num_layers
-
-        # run the decoder for every time step
-        for node, edge in zip(nodes, edges):
-            assert edge == CHILD_EDGE or edge == SIBLING_EDGE, 'invalid edge: {}'.format(edge)
-            n = np.array([self.config.decoder.vocab[node]], dtype=np.int32)
-            e = np.array([edge == CHILD_EDGE], dtype=np.bool)
-
-            feed = {self.decoder.nodes[0].name: n,
-                    self.decoder.edges[0].name: e}
-            for i in range(self.config.decoder.num_layers):
-                feed[self.decoder.initial_state[i].name] = state[i]
-            feed[self.psi.name] = psi
-            [probs, state] = sess.run([self.probs, self.decoder.state], feed)
-
-        dist = probs[0]
-
-        # save in cache if provided
-        if cache is not None:
-            cache[serialized] = dist
-
-        return dist
+        return self.infer_ast_batch(sess, psi, [(nodes, edges)], cache=cache)[0]
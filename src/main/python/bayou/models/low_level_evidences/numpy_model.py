@@ -0,0 +1,205 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import os
+import json
+
+from bayou.models.low_level_evidences.model import Model
+from bayou.models.low_level_evidences.evidence import Javadoc
+from bayou.models.low_level_evidences.utils import CHILD_EDGE, read_config
+
+WEIGHTS_FILE = 'numpy_model.npz'
+
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+def softmax(x, axis=-1):
+    e = np.exp(x - np.max(x, axis=axis, keepdims=True))
+    return e / np.sum(e, axis=axis, keepdims=True)
+
+
+def gru(x, h, weights, prefix):
+    """
+    A step of a GRU cell, computed as in TensorFlow's GRUCell
+
+    :param x: the inputs (batch_size, input_size)
+    :param h: the state (batch_size, units)
+    :param weights: the weights of the model
+    :param prefix: name of the cell in the weights
+    :return: the new state, which is also the output of the cell
+    """
+    gates = sigmoid(np.dot(np.concatenate([x, h], axis=1), weights[prefix + '/gates/kernel'])
+                    + weights[prefix + '/gates/bias'])
+    r, u = np.split(gates, 2, axis=1)
+    c = np.tanh(np.dot(np.concatenate([x, r * h], axis=1), weights[prefix + '/candidate/kernel'])
+                + weights[prefix + '/candidate/bias'])
+    return u * h + (1. - u) * c
+
+
+class NumpyModel(object):
+    """
+    Inference-only implementation of the model in NumPy, using weights exported from a checkpoint with
+    export_numpy.py. It can be used by BayesianPredictor in place of the TensorFlow model, and does not import
+    TensorFlow. The session argument of every method is ignored.
+    """
+
+    def __init__(self, config, weights):
+        self.config = config
+        self.weights = weights
+
+    @staticmethod
+    def load(save):
+        """
+        Loads the model saved in a directory, which must contain the exported weights
+
+        :param save: the directory
+        :return: the model
+        """
+        with open(os.path.join(save, 'config.json')) as f:
+            config = read_config(json.load(f), chars_vocab=True)
+        config.batch_size = 1
+        config.decoder.max_ast_depth = 1
+        with np.load(os.path.join(save, WEIGHTS_FILE)) as f:
+            weights = {name: f[name] for name in f.files}
+        return NumpyModel(config, weights)
+
+    def encode(self, inputs):
+        """
+        Runs the encoder on a batch of wrangled evidences
+
+        :param inputs: list of wrangled inputs, one for each evidence type
+        :return: mean and covariance of psi for every row in the batch
+        """
+        config = self.config
+        batch_size = len(inputs[0])
+        d = np.ones(batch_size, dtype=np.float32)
+        mean = np.zeros([batch_size, config.latent_size], dtype=np.float32)
+        for ev, inp in zip(config.evidence, inputs):
+            encoding = self.encode_evidence(ev, inp)
+            exists = ev.present(inp)
+            sigma_sq = np.square(self.weights[ev.name + '/sigma'])
+            d += np.where(exists, 1. / sigma_sq, 0.)
+            mean += ev.tile * np.where(exists[:, None], encoding / sigma_sq, 0.)
+        mean /= d[:, None]
+        covariance = np.tile(1. / d[:, None], [1, config.latent_size])
+        return mean.astype(np.float32), covariance.astype(np.float32)
+
+    def encode_evidence(self, ev, inp):
+        if isinstance(ev, Javadoc):
+            return self.encode_javadoc(ev, inp)
+        return self.encode_sparse(ev, inp)
+
+    def encode_sparse(self, ev, inp):
+        # APICalls, Types and Keywords, the first layer sums the rows of its kernel of the words present
+        words = self.weights[ev.name + '/dense0/kernel'][np.maximum(inp, 0)]
+        encoding = np.tanh(np.sum(words * (inp >= 0)[:, :, None], axis=1) + self.weights[ev.name + '/dense0/bias'])
+        for i in range(1, ev.num_layers):
+            encoding = np.tanh(np.dot(encoding, self.weights['{}/dense{}/kernel'.format(ev.name, i)])
+                               + self.weights['{}/dense{}/bias'.format(ev.name, i)])
+        return np.dot(encoding, self.weights[ev.name + '/w']) + self.weights[ev.name + '/b']
+
+    def encode_javadoc(self, ev, inp):
+        w = self.weights
+        words = inp[:, :ev.max_words].astype(np.int32)
+        lengths = inp[:, ev.max_words].astype(np.int32)
+        emb = w['javadoc/embeddings'][words]
+        batch_size, max_time = words.shape
+
+        # bidirectional GRU, outputs beyond the length of each sequence are zero
+        outputs = []
+        for direction, steps in [('fw', range(max_time)), ('bw', reversed(range(max_time)))]:
+            h = np.zeros([batch_size, ev.rnn_units], dtype=np.float32)
+            output = np.zeros([batch_size, max_time, ev.rnn_units], dtype=np.float32)
+            for t in steps:
+                active = (t < lengths)[:, None]
+                h = np.where(active, gru(emb[:, t], h, w, 'javadoc/' + direction), h)
+                output[:, t] = np.where(active, h, 0.)
+            outputs.append(output)
+        brnn_outputs = np.concatenate(outputs, axis=2)
+        mask = np.arange(max_time)[None, :] < lengths[:, None]
+
+        # attention heads, one for each latent dimension, with head-major weights (latent_size, in, out)
+        def heads(name, activation):
+            x = np.tanh(np.einsum('btd,hde->hbte', brnn_outputs, w[name + '0/kernel'])
+                        + w[name + '0/bias'][:, None, None, :])
+            x = np.tanh(np.einsum('hbtd,hde->hbte', x, w[name + '1/kernel'])
+                        + w[name + '1/bias'][:, None, None, :])
+            x = np.einsum('hbtd,hd->hbt', x, w[name + '2/kernel'][:, :, 0]) + w[name + '2/bias'][:, 0, None, None]
+            return activation(x)
+
+        softmax_input = heads('javadoc/softmax', lambda x: x)
+        softmax_output = softmax(np.where(mask[None], softmax_input, -1000000.0), axis=-1)
+        non_softmax_output = np.where(mask[None], heads('javadoc/non_softmax', np.tanh), 0.)
+        latent_dims = np.sum(softmax_output * non_softmax_output, axis=-1)
+        return np.transpose(latent_dims)
+
+    # reading and wrangling of the data is shared with the TensorFlow model
+    evidence_inputs = Model.evidence_inputs
+    evidence_inputs_batch = Model.evidence_inputs_batch
+
+    def infer_encodings(self, sess, inputs, indices):
+        # run the encoders of only the given evidence types, and get their encodings and sigmas
+        return [(self.encode_evidence(self.config.evidence[i], inputs[i]),
+                 self.weights[self.config.evidence[i].name + '/sigma']) for i in indices]
+
+    def infer_psi(self, sess, evidences):
+        mean, covariance = self.encode(self.evidence_inputs(evidences))
+        return mean + np.sqrt(covariance) * np.random.normal(size=mean.shape).astype(np.float32)
+
+    def infer_psi_params(self, sess, evidences):
+        return self.encode(self.evidence_inputs(evidences))
+
+    def infer_psi_params_batch(self, sess, evidences_list):
+        return self.encode(self.evidence_inputs_batch(evidences_list))
+
+    def infer_psi_samples(self, sess, evidences, num_samples):
+        mean, covariance = self.encode(self.evidence_inputs(evidences))
+        samples = np.random.normal(size=[num_samples, self.config.latent_size]).astype(np.float32)
+        return mean + np.sqrt(covariance) * samples
+
+    def infer_initial_state(self, sess, psis):
+        state = np.dot(psis, self.weights['lift_w']) + self.weights['lift_b']
+        return [np.copy(state) for _ in range(self.config.decoder.num_layers)]
+
+    def infer_step(self, sess, psis, state, nodes, edges):
+        w = self.weights
+        n = np.array([self.config.decoder.vocab[node] for node in nodes], dtype=np.int32)
+        e = np.array([edge == CHILD_EDGE for edge in edges], dtype=bool)
+        inp = w['decoder/emb'][n]
+
+        # run only the rows that take each cell (cell1 handles CHILD_EDGE, cell2 handles SIBLING_EDGE)
+        output = np.zeros([len(n), self.config.decoder.units], dtype=np.float32)
+        new_state = [np.zeros_like(s) for s in state]
+        for cell, rows in [('cell1', np.flatnonzero(e)), ('cell2', np.flatnonzero(~e))]:
+            if len(rows) == 0:
+                continue
+            x = inp[rows]
+            for j in range(self.config.decoder.num_layers):
+                x = gru(x, state[j][rows], w, 'decoder/{}/{}'.format(cell, j))
+                new_state[j][rows] = x
+            output[rows] = x
+
+        # combine attention and output to produce new_output
+        align = np.dot(output, w['align_w'])
+        context = align * psis
+        output = np.tanh(np.dot(np.concatenate([context, output], axis=1), w['att_out_w']))
+        logits = np.dot(output, w['projection_w']) + w['projection_b']
+        return softmax(logits).astype(np.float32), new_state
+
+    # decoding of production path prefixes (with the decoder state cache) is shared with the TensorFlow model
+    infer_ast_batch = Model.infer_ast_batch
+    infer_ast = Model.infer_ast
@@ -0,0 +1,129 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import threading
+import time
+from collections import OrderedDict
+
+
+class PsiCache(object):
+    """
+    Cache of the encoder outputs used to compute the distribution of the intent (psi). The mean and precision of psi
+    are sums of independent terms, one for each evidence type, so each evidence type has its own sub-cache and requests
+    that share only some of their evidences still reuse the encoder outputs of those. An evidence is keyed by its
+    wrangled input to the encoder, which is its canonical form: keywords are lemmatized, and sets of evidences are
+    deduplicated and ordered by the vocabulary, with words outside of it (and the padding of the batch) dropped.
+
+    Each sub-cache holds at most max_size entries, evicting least recently used ones first, and entries expire ttl
+    seconds after they were added.
+    """
+
+    def __init__(self, max_size=1000, ttl=3600.):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.caches = dict()
+        self.hits = dict()
+        self.misses = dict()
+        self.lock = threading.Lock()
+
+    def get(self, name, key):
+        """
+        Gets a cached entry
+
+        :param name: name of the evidence type
+        :param key: the key of the evidence
+        :return: the entry, or None if it is not cached or has expired
+        """
+        with self.lock:
+            cache = self.caches.setdefault(name, OrderedDict())
+            if key in cache and time.time() - cache[key][0] <= self.ttl:
+                cache.move_to_end(key)
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return cache[key][1]
+            cache.pop(key, None)
+            self.misses[name] = self.misses.get(name, 0) + 1
+            return None
+
+    def put(self, name, key, value):
+        """
+        Adds an entry, evicting least recently used entries if the sub-cache is full
+
+        :param name: name of the evidence type
+        :param key: the key of the evidence
+        :param value: the entry
+        """
+        with self.lock:
+            cache = self.caches.setdefault(name, OrderedDict())
+            cache[key] = (time.time(), value)
+            cache.move_to_end(key)
+            while len(cache) > self.max_size:
+                cache.popitem(last=False)
+
+    def psi_params(self, model, sess, inputs):
+        """
+        Gets the mean and covariance of psi as computed by the encoder of the model, running the encoders of only
+        those evidences that are not cached. The evidences of every evidence type that are not cached are encoded in a
+        single batch.
+
+        :param model: the model
+        :param sess: the session to run the model in
+        :param inputs: list of wrangled inputs, one for each evidence type, with one row for each set of evidences
+        :return: mean and covariance of psi, one row for each set of evidences
+        """
+        evidence = model.config.evidence
+        num_rows = len(inputs[0])
+        terms = [[None] * num_rows for _ in evidence]
+        missing = [[] for _ in evidence]
+        for i, (ev, inp) in enumerate(zip(evidence, inputs)):
+            present = ev.present(inp)
+            for row in range(num_rows):
+                if not present[row]:  # the evidence does not exist, and does not contribute to psi
+                    terms[i][row] = (0., 0.)
+                    continue
+                terms[i][row] = self.get(ev.name, ev.key(inp[row]))
+                if terms[i][row] is None:
+                    missing[i].append(row)
+
+        indices = [i for i in range(len(evidence)) if len(missing[i]) > 0]
+        if len(indices) > 0:
+            batches = [inputs[i][missing[i]] for i in range(len(evidence))]
+            for i, (encodings, sigma) in zip(indices, model.infer_encodings(sess, batches, indices)):
+                sigma_sq = np.square(sigma)
+                for row, encoding in zip(missing[i], encodings):
+                    terms[i][row] = (evidence[i].tile * encoding / sigma_sq, 1. / sigma_sq)
+                    self.put(evidence[i].name, evidence[i].key(inputs[i][row]), terms[i][row])
+
+        mean = np.zeros([num_rows, model.config.latent_size], dtype=np.float32)
+        covariance = np.zeros([num_rows, model.config.latent_size], dtype=np.float32)
+        for row in range(num_rows):
+            d = 1. + sum(terms[i][row][1] for i in range(len(evidence)))
+            mean[row] = sum(terms[i][row][0] for i in range(len(evidence))) / d
+            covariance[row] = 1. / d
+        return mean, covariance
+
+    def clear(self):
+        with self.lock:
+            self.caches.clear()
+
+    def stats(self):
+        """
+        Gets the hit and miss counts of every evidence type
+
+        :return: dict of evidence type names to their counts
+        """
+        with self.lock:
+            return {name: {'hits': self.hits.get(name, 0), 'misses': self.misses.get(name, 0),
+                           'size': len(self.caches.get(name, ()))}
+                    for name in set(self.hits) | set(self.misses)}
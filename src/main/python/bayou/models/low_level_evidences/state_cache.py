@@ -0,0 +1,167 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from collections import OrderedDict
+
+
+class TrieNode(object):
+    __slots__ = ['parent', 'token', 'children', 'state', 'dist']
+
+    def __init__(self, parent, token, state, dist=None):
+        self.parent = parent
+        self.token = token
+        self.children = dict()
+        self.state = state  # list of states, one for each decoder layer, after consuming the prefix
+        self.dist = dist  # decoder's output distribution for the next token (None for a root)
+
+
+class DecoderStateCache(object):
+    """
+    Prefix trie of decoder states. Each intent (psi) has its own root holding the decoder's initial state, and every
+    trie node below it corresponds to a (node, edge) prefix of a production path, holding the state of every decoder
+    layer after consuming the prefix along with the distribution of the next token. Extending a cached prefix by one
+    token therefore costs a single decoder step.
+
+    The trie is bounded by the total size of the states and distributions of its nodes, and evicts least recently used
+    leaves first. It is shared by the searches of a predictor, which may run in several threads, so every operation
+    holds its lock. A node evicted while a search still holds it stays valid for that search, and a prefix extended
+    from it is simply not reachable from its root.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.roots = dict()
+        self.lru = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def psi_key(psi):
+        return psi.tobytes()
+
+    @staticmethod
+    def node_bytes(node):
+        return sum(s.nbytes for s in node.state) + (node.dist.nbytes if node.dist is not None else 0)
+
+    def __len__(self):
+        return len(self.lru)
+
+    def get_root(self, psi):
+        """
+        Gets the root of the trie for the given intent
+
+        :param psi: the intent (a single row)
+        :return: the root node, or None if it is not cached
+        """
+        with self.lock:
+            return self.roots.get(self.psi_key(psi))
+
+    def add_root(self, psi, state):
+        """
+        Adds the root of the trie for the given intent, unless another search added it first
+
+        :param psi: the intent (a single row)
+        :param state: list of initial states, one for each decoder layer
+        :return: the root node
+        """
+        key = self.psi_key(psi)
+        with self.lock:
+            root = self.roots.get(key)
+            if root is None:
+                root = TrieNode(None, key, state)
+                self.roots[key] = root
+                self._add(root)
+            return root
+
+    def lookup(self, root, tokens):
+        """
+        Finds the longest cached prefix of the given tokens, and counts a hit if the whole prefix was cached
+
+        :param root: the root to start the lookup from
+        :param tokens: list of (node, edge) tokens
+        :return: the trie node of the longest cached prefix and its length
+        """
+        with self.lock:
+            node, depth = root, 0
+            while depth < len(tokens):
+                child = node.children.get(tokens[depth])
+                if child is None:
+                    break
+                node = child
+                depth += 1
+            self._touch(node)
+            if depth == len(tokens):
+                self.hits += 1
+            else:
+                self.misses += 1
+            return node, depth
+
+    def insert(self, parent, token, state, dist):
+        """
+        Extends a cached prefix by a token, unless another search extended it first
+
+        :param parent: the trie node of the prefix
+        :param token: the (node, edge) token
+        :param state: list of states, one for each decoder layer, after consuming the token
+        :param dist: the decoder's output distribution after consuming the token
+        :return: the trie node of the extended prefix
+        """
+        with self.lock:
+            node = parent.children.get(token)
+            if node is None:
+                node = TrieNode(parent, token, state, dist)
+                parent.children[token] = node
+                self._add(node)
+            self._touch(node)
+            return node
+
+    def _add(self, node):
+        self.lru[node] = None
+        self.size += self.node_bytes(node)
+
+    def _touch(self, node):
+        # mark the node and all its ancestors as most recently used, ancestors last so that they are always more
+        # recently used than their descendants and only leaves are evicted
+        while node is not None:
+            if node in self.lru:
+                self.lru.move_to_end(node)
+            node = node.parent
+
+    def trim(self):
+        """
+        Evicts least recently used leaves until the trie is within its bound
+        """
+        with self.lock:
+            while self.size > self.max_bytes and len(self.lru) > 0:
+                node, _ = self.lru.popitem(last=False)
+                self.size -= self.node_bytes(node)
+                if node.parent is None:
+                    if self.roots.get(node.token) is node:
+                        del self.roots[node.token]
+                elif node.parent.children.get(node.token) is node:
+                    del node.parent.children[node.token]
+
+    def clear(self):
+        with self.lock:
+            self.roots.clear()
+            self.lru.clear()
+            self.size = 0
+
+    def hit_rate(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return float(self.hits) / total if total > 0 else 0.
@@ -24,6 +24,7 @@ import json
 import textwrap
 
 from bayou.models.low_level_evidences.data_reader import Reader
+from bayou.models.low_level_evidences.evidence import Keywords
 from bayou.models.low_level_evidences.model import Model
 from bayou.models.low_level_evidences.utils import read_config, dump_config
 
@@ -74,6 +75,11 @@ def train(clargs):
         config = read_config(json.load(f), chars_vocab=clargs.continue_from)
     # for attention branch
     config.embedding_file = clargs.embedding_file
+    # the model ships with the WordNet data its keywords are lemmatized with, so that inference does not download it
+    for ev in config.evidence:
+        if isinstance(ev, Keywords):
+            Keywords.download_nltk_data(clargs.save)
+            ev.use_nltk_data(clargs.save)
     reader = Reader(clargs, config)
     
     jsconfig = dump_config(config)
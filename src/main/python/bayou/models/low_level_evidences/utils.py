@@ -14,8 +14,8 @@
 
 from __future__ import print_function
 import argparse
+import importlib
 import re
-import tensorflow as tf
 from itertools import chain
 
 CONFIG_GENERAL = ['model', 'latent_size', 'batch_size', 'num_epochs',
@@ -30,6 +30,25 @@ CHILD_EDGE = 'V'
 SIBLING_EDGE = 'H'
 
 
+class LazyModule(object):
+    """
+    Stand-in for a module that is imported only when one of its attributes is first accessed, so that inference
+    with the NumPy engine does not import TensorFlow
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+tf = LazyModule('tensorflow')
+
+
 def length(tensor):
     elems = tf.sign(tf.reduce_max(tensor, axis=2))
     return tf.reduce_sum(elems, axis=1)
@@ -0,0 +1,99 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+
+
+class SearchBudget(object):
+    """
+    Budget of beam searches, in seconds (from when the budget is created, so that it can include the time spent before
+    the searches start) and/or in decoder steps (of each search). A search that runs out of budget stops expanding its
+    beam: it keeps the complete candidates found so far and completes the partial candidates that could still make the
+    top-k greedily, extending every incomplete path with its most likely legal token at every step. As paths are at most
+    PathState.MAX_LENGTH tokens long, this takes a bounded number of further steps.
+    """
+
+    def __init__(self, seconds=None, steps=None):
+        """
+        :param seconds: seconds the searches may take, or None for no time limit
+        :param steps: decoder steps every search may take, or None for no step limit
+        """
+        self.deadline = None if seconds is None else time.time() + seconds
+        self.steps = steps
+        self.truncated = 0  # number of searches that ran out of budget
+
+    def expired(self, steps=0):
+        """
+        Checks if a search has run out of budget
+
+        :param steps: decoder steps the search has taken
+        :return: boolean indicating if the search has run out of budget
+        """
+        return (self.steps is not None and steps >= self.steps) or \
+            (self.deadline is not None and time.time() >= self.deadline)
+
+
+class SearchStats(object):
+    """
+    Work done by searches (see BayesianPredictor.infer)
+    """
+
+    def __init__(self):
+        self.psi_seconds = 0.
+        self.search_seconds = 0.
+        self.decoder_steps = 0
+        self.beam_iterations = 0
+
+
+class SearchProgress(object):
+    """
+    Progress of a beam search, collecting its ASTs as records to be streamed as soon as they are complete. A record is
+    final once the AST is guaranteed to be in the final top-k, which it is if no partial candidate is as likely (every
+    step only makes candidates less likely), and final records come in the order of the final top-k. Unless provisional
+    is set, ASTs that are complete but not yet final are not recorded.
+    """
+
+    def __init__(self, predictor, provisional=False):
+        self.predictor = predictor
+        self.provisional = provisional
+        self.records = []
+        self.num_final = 0
+        self.reported = set()
+
+    def __call__(self, ranked, num_final):
+        """
+        Called by the search after every step
+
+        :param ranked: list of (fingerprint, candidate, log-likelihood) of the top-k complete candidates so far
+        :param num_final: number of (leading) candidates in ranked that are guaranteed to be in the final top-k
+        """
+        for i in range(self.num_final, num_final):
+            _, candidate, log_pr = ranked[i]
+            self.records.append(dict(self.predictor.candidate_ast(candidate, log_pr), rank=i, final=True))
+        self.num_final = max(self.num_final, num_final)
+        if self.provisional:
+            for (fingerprint, candidate, log_pr) in ranked[num_final:]:
+                if fingerprint not in self.reported:
+                    self.reported.add(fingerprint)
+                    self.records.append(dict(self.predictor.candidate_ast(candidate, log_pr), final=False))
+
+    def pop(self):
+        """
+        Gets the records collected since the last call
+
+        :return: list of records, each an AST (as returned by infer) with its rank in the final top-k if it is final
+        """
+        records, self.records = self.records, []
+        return records
@@ -13,32 +13,76 @@
 # limitations under the License.
 
 import argparse
+import contextlib
 import json
 import logging.handlers
 import os
+import signal
+import threading
+import time
+from collections import OrderedDict
 from itertools import chain
 from flask import request, Response, Flask
 
-import tensorflow as tf
-import bayou.models.low_level_evidences.evidence
-import bayou.models.core.infer
-import bayou.models.low_level_evidences.infer
 from bayou.models.low_level_evidences.evidence import Keywords
-from bayou.models.low_level_evidences.utils import gather_calls
+from bayou.models.low_level_evidences.utils import gather_calls, LazyModule
+from bayou.models.low_level_evidences.psi_cache import PsiCache
+from bayou.models.low_level_evidences.state_cache import DecoderStateCache
+from bayou.models.search import SearchBudget
+from bayou.server.response_cache import ResponseCache
+from bayou.server.prefork import PreforkServer
+from bayou.server.scheduler import BatchScheduler
+from bayou.server.metrics import ServerMetrics, CountingSession
+from bayou.server.request_log import JsonFormatter, QueueLogging, RequestLog
+from bayou.server.model_host import HostedModel, ModelHost
+
+# TensorFlow (and the core model, which always runs in TensorFlow) are not imported with the numpy backend, and the
+# inference of a model family is only imported when a model of the family is loaded (see _load_predictor)
+tf = LazyModule('tensorflow')
+
+# metrics of the requests served by this process
+_metrics = ServerMetrics()
+
+# log of the requests served by this process, and the logging of the process (see _setup_logging)
+_request_log = RequestLog()
+_logging = None
 
 
 # called when a POST request is sent to the server at the index path
-def _handle_http_post_request_index(predictor):
+def _handle_http_post_request_index(models, max_bulk_batch=16, deadline=None, max_steps=None):
 
     request_json = request.data.decode("utf-8")  # read request string
-    logging.debug("request_json:" + request_json)
     request_dict = json.loads(request_json)  # parse request as a JSON string
 
     request_type = request_dict['request type']
+    name = request_dict.get('model')  # the model to run, the default model if None
+    budget = _request_budget(request_dict, deadline, max_steps)
 
     if request_type == 'generate asts':
-        asts = _handle_generate_asts_request(request_dict, predictor)
+        with _request(request_type, request_json, budget=budget) as stats, models.use(name) as model:
+            asts = _handle_generate_asts_request(request_dict, model.predictor, model.search_params,
+                                                 model.response_cache, stats)
+            stats.response = asts
         return Response(asts, mimetype="application/json")
+    elif request_type == 'generate asts stream':
+        js = json.loads(request_dict['evidence'])  # the evidence string of the request is also JSON
+        models.get(name)  # fail before the response starts if there is no such model
+        records = _measured_stream(request_type, request_json, budget, models, name, lambda stats, model: _stream_asts(
+            js, model.predictor, model.search_params, request_dict.get('provisional', False), stats))
+        return Response(records, mimetype="application/x-ndjson")
+    elif request_type == 'generate asts batch':
+        evidences_list, params = _batch_request(request_dict, models.get(name).search_params)
+        if request_dict.get('stream', False):
+            records = _measured_stream(request_type, request_json, budget, models, name,
+                                       lambda stats, model: _stream_batch_results(evidences_list, _generate_asts_batch(
+                                           evidences_list, model.predictor, params, max_bulk_batch, stats)))
+            return Response(records, mimetype="application/x-ndjson")
+        with _request(request_type, request_json, budget=budget) as stats, models.use(name) as model:
+            results = _generate_asts_batch(evidences_list, model.predictor, params, max_bulk_batch, stats)
+            stats.response = response = _batch_response(evidences_list, results)
+        return Response(response, mimetype="application/json")
+    elif request_type == 'reload model':
+        return Response(_reload_response(models, name), mimetype="application/json")
     elif request_type == 'shutdown':
         _shutdown()  # does not return
 
@@ -50,17 +94,87 @@ def _handle_http_get_request_health():
     return Response("Ok")
 
 
-# handle an asts generation request by generating asts
-def _handle_generate_asts_request(request_dict, predictor):
+# called when a GET request is sent to the server at the /metrics path
+def _handle_http_get_request_metrics():
+    return Response(_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# the budget of the searches of a request: the deadline (seconds from now) and maximum steps of every search set by the
+# request, bounded by those of the server (None for no limit). Returns None if there is no limit.
+def _request_budget(request_dict, deadline=None, max_steps=None):
+    limits = []
+    for name, limit in [('deadline', deadline), ('max steps', max_steps)]:
+        values = [value for value in [request_dict.get(name), limit] if value is not None]
+        limits.append(min(values) if len(values) > 0 else None)
+    if limits == [None, None]:
+        return None
+    return SearchBudget(*limits)
+
+
+# measure and log a request while in the context (see ServerMetrics.request). The record of the request in the log
+# includes its payload if it is sampled or fails, along with the response that the handler sets as stats.response.
+@contextlib.contextmanager
+def _request(request_type, request_json, track=True, budget=None):
+    start = time.time()
+    stats = None
+    error = None
+    try:
+        with _metrics.request(request_type, track) as stats:
+            stats.budget = budget
+            yield stats
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        if error is not None or _request_log.sampled():
+            _request_log.log(request_type, time.time() - start, stats, error, request_json,
+                             stats.response if stats is not None and error is None else None)
+        else:
+            _request_log.log(request_type, time.time() - start, stats)
+
+
+# measure a streamed request until its response has been sent, using the named model until then. make_chunks is given
+# the stats of the request and the model.
+def _measured_stream(request_type, request_json, budget, models, name, make_chunks):
+    with _request(request_type, request_json, budget=budget) as stats, models.use(name) as model:
+        yield from make_chunks(stats, model)
+
+
+# start reloading a model (or all models if name is None) from its directory, e.g., once it has a new checkpoint, and
+# serialize the response with the names of the models being reloaded. With pre-forked workers, only the worker that
+# serves the request reloads its models (SIGHUP to the master reloads those of all workers).
+def _reload_response(models, name=None):
+    return json.dumps({'reloading': models.reload(name)})
+
+
+# handle an asts generation request by generating asts (or getting its serialized ASTs from the cache, which only keeps
+# those of searches that ran to the end)
+def _handle_generate_asts_request(request_dict, predictor, search_params=None, response_cache=None, stats=None):
 
     evidence_json_str = request_dict['evidence']  # get the evidence string from the request (also JSON)
 
-    asts = _generate_asts(evidence_json_str, predictor)
-    logging.debug(asts)
-    return asts
+    if response_cache is None:
+        return _generate_asts(evidence_json_str, predictor, search_params=search_params, stats=stats)
+
+    js = json.loads(evidence_json_str)
+    key = _response_cache_key(js, predictor, search_params)
+    asts = response_cache.get(key)
+    if asts is None:
+        asts = predictor.infer(js, **_search_kwargs(predictor, search_params, stats))
+        asts = _serialized_asts(js, asts, predictor).encode('utf-8')
+        if stats is None or stats.budget is None or stats.budget.truncated == 0:
+            response_cache.put(key, asts)
+    return _response_with_evidences(js, asts)
+
 
+# the key of a generate asts request in the response cache: the evidences as the model reads them (lle models), so that
+# requests it cannot tell apart share their ASTs, and the parameters of the search
+def _response_cache_key(js, predictor, search_params=None, okay_check=False):
+    evidences = predictor.evidence_key(js) if _lle(predictor) else js
+    return ResponseCache.key(evidences, okay_check=okay_check, **(search_params or {}))
 
-def _generate_asts(evidence_json: str, predictor, okay_check=False):
+
+def _generate_asts(evidence_json: str, predictor, okay_check=False, search_params=None, stats=None):
     logging.debug("entering")
 
     js = json.loads(evidence_json)  # parse evidence as a JSON string
@@ -74,61 +188,349 @@ def _generate_asts(evidence_json: str, predictor, okay_check=False):
     #
     # Generate ASTs from evidence.
     #
-    asts = predictor.infer(js)
+    asts = predictor.infer(js, **_search_kwargs(predictor, search_params, stats))
+
+    logging.debug("exiting")
+    return _asts_response(js, asts, predictor, okay_check)
+
 
+# serialize the response to a generate asts request
+def _asts_response(js, asts, predictor, okay_check=False):
+    return _response_with_evidences(js, _serialized_asts(js, asts, predictor, okay_check))
+
+
+# serialize the ASTs of the response to a generate asts request, as they are nested in the response
+def _serialized_asts(js, asts, predictor, okay_check=False):
     #
     # If okay_check is set, retain only those asts that pass the _okay(...) filter. Otherwise retain all asts.
     #
     if okay_check:
-        okay_asts = []
-        for ast in asts:
-            if _okay(js, ast, predictor):
-                okay_asts.append(ast)
-        okay_asts = asts if okay_asts == [] else okay_asts
+        with _metrics.timer(_metrics.okay):
+            okay_asts = []
+            for ast in asts:
+                if _okay(js, ast, predictor):
+                    okay_asts.append(ast)
+            okay_asts = asts if okay_asts == [] else okay_asts
     else:
         okay_asts = asts
 
-    logging.debug("exiting")
-    return json.dumps({'evidences': js, 'asts': okay_asts}, indent=2)
+    with _metrics.timer(_metrics.serialization):
+        # strings are serialized without newlines, so every line after the first is nested one level deeper
+        return json.dumps(okay_asts, indent=2).replace('\n', '\n  ')
+
+
+# the response to a generate asts request with its serialized ASTs (str, or bytes for a response in bytes), as
+# json.dumps({'evidences': js, 'asts': asts}, indent=2) would serialize it
+def _response_with_evidences(js, serialized_asts):
+    with _metrics.timer(_metrics.serialization):
+        head = json.dumps({'evidences': js}, indent=2)[:-len('\n}')] + ',\n  "asts": '
+    if isinstance(serialized_asts, bytes):
+        return head.encode('utf-8') + serialized_asts + b'\n}'
+    return head + serialized_asts + '\n}'
+
+
+# the keyword args of the search of the predictor, which adds the work done to the stats of the request, and runs within
+# the budget of the request (lle models)
+def _search_kwargs(predictor, search_params=None, stats=None):
+    kwargs = dict(search_params or {})
+    if stats is not None and _lle(predictor):
+        kwargs['stats'] = stats
+        if stats.budget is not None:
+            kwargs['budget'] = stats.budget
+    return kwargs
+
+
+# whether a predictor (or the BatchScheduler of one) is that of an lle model, whose search is step-wise. Checked by its
+# methods rather than its class, so that the inference of lle models is not imported to check.
+def _lle(predictor):
+    return hasattr(predictor, 'beam_search_steps')
+
+
+# serialize the ASTs of a generate asts stream request as they are generated, one JSON record per line, ending with a
+# record of the number of final ASTs
+def _stream_asts(js, predictor, search_params=None, provisional=False, stats=None):
+    if _lle(predictor):
+        records = predictor.infer_stream(js, provisional=provisional, **_search_kwargs(predictor, search_params, stats))
+    else:  # the search of core models is not step-wise, all of its ASTs are final at once
+        records = (dict(ast, rank=i, final=True) for i, ast in enumerate(predictor.infer(js, **(search_params or {}))))
+
+    count = 0
+    for record in records:
+        count += 1 if record['final'] else 0
+        yield json.dumps(record) + '\n'
+    yield json.dumps({'done': True, 'count': count}) + '\n'
+
+
+# parse a generate asts batch request into its list of evidences (each a JSON object, or a string of one) and the
+# parameters of its search, which override those of the server
+def _batch_request(request_dict, search_params=None):
+    evidences_list = [json.loads(js) if isinstance(js, str) else js for js in request_dict['evidences']]
+    params = dict(search_params or {})
+    for name, value in request_dict.get('search parameters', {}).items():
+        if name not in params:
+            raise ValueError('Invalid search parameter: ' + name)
+        params[name] = value
+    return evidences_list, params
+
+
+# generate the ASTs of every set of evidences of a batch, as (index, asts) in the order they are done
+def _generate_asts_batch(evidences_list, predictor, search_params=None, max_batch=16, stats=None):
+    if _lle(predictor):
+        return predictor.infer_batch(evidences_list, max_batch=max_batch,
+                                     **_search_kwargs(predictor, search_params, stats))
+    # core models run every item on its own
+    return ((i, predictor.infer(js, **(search_params or {}))) for i, js in enumerate(evidences_list))
+
+
+# serialize the results of a batch, in the order of its evidences
+def _batch_response(evidences_list, results):
+    asts = [None] * len(evidences_list)
+    for i, item_asts in results:
+        asts[i] = item_asts
+    with _metrics.timer(_metrics.serialization):
+        return json.dumps({'results': [{'evidences': js, 'asts': item_asts}
+                                       for js, item_asts in zip(evidences_list, asts)]}, indent=2)
+
+
+# serialize the results of a batch as they are done, one JSON record per line (with the index of its evidences),
+# ending with a record of their number
+def _stream_batch_results(evidences_list, results):
+    count = 0
+    for i, asts in results:
+        count += 1
+        yield _batch_record(evidences_list, i, asts)
+    yield json.dumps({'done': True, 'count': count}) + '\n'
+
+
+def _batch_record(evidences_list, i, asts):
+    return json.dumps({'index': i, 'evidences': evidences_list[i], 'asts': asts}) + '\n'
 
 
 # Include in here any conditions that dictate whether an AST should be returned or not
 def _okay(js, ast, predictor):
     calls = [predictor.callmap[call['_call']] for call in gather_calls(ast['ast'])]
-    apicalls = list(set(chain.from_iterable(
-        [bayou.models.low_level_evidences.evidence.APICalls.from_call(call) for call in calls])))
-    types = list(set(chain.from_iterable(
-        [bayou.models.low_level_evidences.evidence.Types.from_call(call) for call in calls])))
-    keywords = list(set(chain.from_iterable(
-        [bayou.models.low_level_evidences.evidence.Keywords.from_call(call) for call in calls])))
-
-    ev_okay = all([c in apicalls for c in js['apicalls']]) and all([t in types for t in js['types']]) \
-        and all([k in keywords for k in js['keywords']])
+    apicalls, types, keywords = predictor.call_evidences.evidences(calls)
+
+    ev_okay = apicalls.issuperset(js['apicalls']) and types.issuperset(js['types']) \
+        and keywords.issuperset(js['keywords'])
     return ev_okay
 
 
-# terminates the Python process. Does not return.
-def _shutdown():
-    print("===================================")
-    print("            Bayou Stopping         ")
-    print("===================================")
-    os._exit(0)
+# the session a version of a model runs in, with a graph of its own so that models (and versions of a model) can be
+# loaded side by side. The NumPy backend does not need one.
+def _session(backend):
+    return tf.Session(graph=tf.Graph()) if backend in ['tf', 'frozen'] else None
 
 
-if __name__ == '__main__':
+# make the session (and its graph) the default while in the context, so that a model is built in its graph
+@contextlib.contextmanager
+def _default_session(sess):
+    if sess is None:
+        yield
+    else:
+        with sess.graph.as_default(), sess.as_default():
+            yield
 
-    # Parse command line args.
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--save_dir', type=str, required=True, help='model directory to laod from')
+
+# load the model in save_dir and create a predictor that can generates ASTs from evidence, along with the parameters of
+# its search. Only the model family named in the config of the model is imported. The time spent in each phase of
+# loading the model is added to timings, if given.
+def _load_predictor(args, save_dir, sess, timings=None):
+    timings = timings if timings is not None else OrderedDict()
+    with _phase(timings, 'config'):
+        with open(os.path.join(save_dir, 'config.json')) as f:
+            model_type = json.load(f)['model']
+    if model_type == 'core':
+        if args.backend != 'tf':
+            raise ValueError('Backend {} is not supported by core models'.format(args.backend))
+        with _phase(timings, 'import'):
+            import bayou.models.core.infer
+        with _phase(timings, 'model'):
+            bp = bayou.models.core.infer.BayesianPredictor(save_dir, sess)
+        bp.sess = CountingSession(bp.sess)
+        return bp, {}
+    elif model_type == 'lle':
+        with _phase(timings, 'import'):
+            import bayou.models.low_level_evidences.infer
+        psi_cache = PsiCache(args.psi_cache_size, args.psi_cache_ttl) if args.psi_cache_size > 0 else None
+        state_cache = DecoderStateCache(int(args.state_cache_mb * 1024 * 1024))
+        bp = bayou.models.low_level_evidences.infer.BayesianPredictor(save_dir, sess, backend=args.backend,
+                                                                      psi_cache=psi_cache, state_cache=state_cache)
+        timings.update(bp.load_seconds)
+        if bp.sess is not None:
+            bp.sess = CountingSession(bp.sess)
+        search_params = {'beam_width': args.beam_width, 'num_psi_samples': args.psi_samples,
+                         'psi_mode': args.psi_mode}
+        return bp, search_params
+    else:
+        raise ValueError('Invalid model type in config: ' + model_type)
+
+
+# add the time spent in the context to a phase of the timings
+@contextlib.contextmanager
+def _phase(timings, phase):
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.) + time.time() - start
+
+
+# log the time spent in each phase of loading a model (or of starting the server), as a structured record
+def _log_startup(what, timings):
+    total = sum(timings.values())
+    logging.info('{} took {:.2f}s ({})'.format(what, total, ', '.join('{} {:.2f}s'.format(phase, seconds)
+                                                                      for phase, seconds in timings.items())),
+                 extra={'fields': {'startup': what, 'seconds': total, 'phases': timings}})
+
+
+# evidences of the search that warms up a new version of a model
+_WARM_UP_EVIDENCES = {'apicalls': [], 'types': [], 'keywords': [], 'javadoc': ''}
+
+
+# load a version of a named model in a session of its own, unless the predictor (with its session and search parameters)
+# is already loaded, and make it ready to serve requests: concurrent requests are batched if max_batch > 1 (lle models
+# only), and responses are cached if response_cache_mb > 0. The model is warmed up before it is returned, and its caches
+# are added to the metrics.
+def _load_model(args, name, save_dir, loaded=None, max_batch=1, batch_window_ms=5., response_cache_mb=0.):
+    timings = OrderedDict()
+    if loaded is None:
+        with _phase(timings, 'session'):
+            sess = _session(args.backend)
+        with _default_session(sess):
+            bp, search_params = _load_predictor(args, save_dir, sess, timings)
+    else:
+        sess, bp, search_params = loaded  # its loading was reported by the process that loaded it
+    lle = _lle(bp)
+
+    # the first run of a model is slower (e.g., while TensorFlow initializes), so it is not left to the first request
+    with _default_session(sess), _phase(timings, 'warm up'):
+        if lle:
+            budget = SearchBudget(steps=1)
+            bp.infer(_WARM_UP_EVIDENCES, budget=budget, **search_params)
+        else:
+            bp.psi_from_evidence(_WARM_UP_EVIDENCES)
+    _log_startup('loading model {} from {}'.format(name, save_dir), timings)
+
+    # the scheduler runs in a thread, so it is created in the process that serves requests
+    predictor = BatchScheduler(bp, max_batch, batch_window_ms / 1000.) if lle and max_batch > 1 else bp
+    response_cache = ResponseCache(int(response_cache_mb * 1024 * 1024)) if response_cache_mb > 0 else None
+
+    def close():
+        if predictor is not bp:
+            predictor.close()
+        if sess is not None:
+            sess.close()
+
+    if lle:
+        _metrics.add_cache(name + '/decoder_state', lambda: {
+            name + '/decoder_state': (bp.state_cache.hits, bp.state_cache.misses)})
+        if bp.psi_cache is not None:
+            _metrics.add_cache(name + '/psi', lambda: {name + '/psi/' + evidence: (counts['hits'], counts['misses'])
+                                                       for evidence, counts in bp.psi_cache.stats().items()})
+    if response_cache is not None:
+        _metrics.add_cache(name + '/response', lambda: {
+            name + '/response': (response_cache.hits, response_cache.misses)})
+    return HostedModel(name, save_dir, predictor, search_params, response_cache, close)
+
+
+# the directories of the models to host by name, the model of --save_dir (if any) is named default
+def _model_dirs(args):
+    model_dirs = OrderedDict()
+    if args.save_dir is not None:
+        model_dirs['default'] = args.save_dir
+    for model in args.models:
+        name, sep, save_dir = model.partition('=')
+        if sep == '' or name == '' or save_dir == '':
+            raise ValueError('Invalid model (expected NAME=DIR): ' + model)
+        model_dirs[name] = save_dir
+    if len(model_dirs) == 0:
+        raise ValueError('No model to host, set --save_dir or --models')
+    return model_dirs
+
+
+# host the models, loaded with load(name, save_dir, loaded) unless preloaded has them (see _load_model). The first
+# model is the default one, and SIGHUP reloads all of them from their directories.
+def _host_models(model_dirs, load, preloaded=None):
+    models = ModelHost(load)
+    for name, save_dir in model_dirs.items():
+        models.add(name, save_dir, load(name, save_dir, (preloaded or {}).get(name)))
+    _metrics.add_models(models.versions)
+    # the handler only sets the event, the models are reloaded by the thread that waits on it (see reload_on)
+    reload = threading.Event()
+    models.reload_on(reload)
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload.set())
+    return models
+
+
+# set up the HTTP server, but do not start it (yet)
+def _make_http_server(models, args):
+    http_server = Flask(__name__)
+
+    # route POST requests to / to _handle_http_post_request_index(...)
+    http_server.add_url_rule("/", "index",
+                             lambda: _handle_http_post_request_index(models, args.max_bulk_batch,
+                                                                     args.deadline or None, args.max_steps or None),
+                             methods=['POST'])
+    # route GET requests to /asthealth to _handle_http_get_request_health
+    http_server.add_url_rule("/asthealth", "/asthealth", _handle_http_get_request_health, methods=['GET'])
+    # route GET requests to /metrics to _handle_http_get_request_metrics
+    http_server.add_url_rule("/metrics", "/metrics", _handle_http_get_request_metrics, methods=['GET'])
+    return http_server
+
+
+# add the command line args of the model (shared by the servers)
+def _add_model_arguments(parser):
+    parser.add_argument('--save_dir', type=str, required=False,
+                        help='directory of the default model (see --models)')
+    parser.add_argument('--models', type=str, nargs='+', default=[], metavar='NAME=DIR',
+                        help='directories of named models to host along with the default one, requests choose one by '
+                             'name with their "model" field. Without --save_dir, the first model is the default.')
     parser.add_argument('--logs_dir', type=str, required=False, help='the directories to store log information '
                                                                      'separated by the OS path separator')
-    args = parser.parse_args()
-
-    if args.logs_dir is None:
+    parser.add_argument('--backend', type=str, default='tf', choices=['tf', 'frozen', 'numpy'],
+                        help='run the model in TensorFlow, from the graph exported with export_frozen.py, or in NumPy '
+                             'from weights exported with export_numpy.py (lle models only)')
+    parser.add_argument('--psi_cache_size', type=int, default=1000,
+                        help='number of encoder outputs cached for each evidence type, 0 to disable (lle models only)')
+    parser.add_argument('--psi_cache_ttl', type=float, default=3600.,
+                        help='seconds after which cached encoder outputs expire')
+    parser.add_argument('--state_cache_mb', type=float, default=256,
+                        help='size (in MB) of the cache of decoder states shared by the searches of a model, '
+                             'which evicts least recently used states (lle models only)')
+    parser.add_argument('--beam_width', type=int, default=25, help='width of the beam search (lle models only)')
+    parser.add_argument('--psi_samples', type=int, default=100,
+                        help='number of samples of the intent averaged before the search (lle models only)')
+    parser.add_argument('--psi_mode', type=str, default='sample', choices=['sample', 'mean'],
+                        help='average samples of the intent, or use their expectation so that the search is '
+                             'deterministic (lle models only)')
+    parser.add_argument('--response_cache_mb', type=float, default=0,
+                        help='size (in MB) of the cache of responses to identical requests, 0 to disable. Unless '
+                             'psi_mode is mean, a cached response is the result of one of many possible searches.')
+    parser.add_argument('--max_bulk_batch', type=int, default=16,
+                        help='maximum number of items of a generate asts batch request run together (lle models only)')
+    parser.add_argument('--deadline', type=float, default=0,
+                        help='seconds a generate asts request may take (a request can set a shorter deadline) before '
+                             'its searches complete their best candidates greedily, 0 for no deadline (lle models only)')
+    parser.add_argument('--max_steps', type=int, default=0,
+                        help='decoder steps a search may take (a request can set fewer) before it completes its best '
+                             'candidates greedily, 0 for no limit (lle models only)')
+    parser.add_argument('--log_level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='level of the messages to log')
+    parser.add_argument('--log_sample_rate', type=float, default=0.01,
+                        help='fraction of requests whose payloads (and responses) are logged, along with those of all '
+                             'failed requests')
+
+
+# log to ast_server.log in the directories of logs_dir, or in the default directory if it is None, one JSON object per
+# line written by a background thread
+def _setup_logging(logs_dir, level='INFO', sample_rate=0.):
+    global _logging
+    if logs_dir is None:
         dir_path = os.path.dirname(__file__)
         log_paths = [os.path.join(dir_path, "../../../logs/ast_server.log")]
     else:
-        log_paths = [(d + "/ast_server.log") for d in args.logs_dir.split(os.pathsep)]
+        log_paths = [(d + "/ast_server.log") for d in logs_dir.split(os.pathsep)]
 
     # ensure the parent directory of each log path exists or create it
     for log_path in log_paths:
@@ -136,43 +538,98 @@ if __name__ == '__main__':
             os.makedirs(os.path.dirname(log_path))
 
     # Create the logger for the application.
-    logging.basicConfig(
-        format='%(asctime)s,%(msecs)d %(levelname)-8s [%(threadName)s %(filename)s:%(lineno)d] %(message)s',
-        datefmt='%d-%m-%Y:%H:%M:%S',
-        level=logging.DEBUG,
-        handlers=[logging.handlers.RotatingFileHandler(log_path, maxBytes=100000000, backupCount=9) for log_path in
-                  log_paths])
+    handlers = [logging.handlers.RotatingFileHandler(log_path, maxBytes=100000000, backupCount=9) for log_path in
+                log_paths]
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+    _logging = QueueLogging(handlers, getattr(logging, level))
+    _logging.start()
+    _request_log.sample_rate = sample_rate
+
+
+# pid of the master process when serving with pre-forked workers
+_master_pid = None
+
+
+# terminates the Python process (and, in a pre-forked worker, the master and all workers). Does not return.
+def _shutdown():
+    print("===================================")
+    print("            Bayou Stopping         ")
+    print("===================================")
+    if _master_pid is not None and os.getpid() != _master_pid:
+        os.kill(_master_pid, signal.SIGTERM)
+    if _logging is not None:
+        _logging.stop()  # write the queued records
+    os._exit(0)
+
+
+if __name__ == '__main__':
+
+    # Parse command line args.
+    parser = argparse.ArgumentParser()
+    _add_model_arguments(parser)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='number of pre-forked worker processes serving requests, 0 to serve from a single '
+                             'process with the development server')
+    parser.add_argument('--worker_timeout', type=float, default=300.,
+                        help='seconds after which a worker stuck in a request is restarted')
+    parser.add_argument('--max_batch', type=int, default=1,
+                        help='maximum number of concurrent requests run together through the encoder and decoder, 1 '
+                             'to run every request on its own (lle models only)')
+    parser.add_argument('--batch_window_ms', type=float, default=5.,
+                        help='milliseconds to wait for other requests to batch with one that arrives')
+    args = parser.parse_args()
+
+    _setup_logging(args.logs_dir, args.log_level, args.log_sample_rate)
 
     logging.debug("entering")  # can't move line up in program because logger not configured until this point
 
-    # Set up HTTP server, but do no start it (yet).
-    http_server = Flask(__name__)
+    model_dirs = _model_dirs(args)
 
-    # Load model and start processing any sent requests.
-    with tf.Session() as sess:
-        logging.info("loading model")
+    def load(name, save_dir, loaded=None):
+        return _load_model(args, name, save_dir, loaded, args.max_batch, args.batch_window_ms, args.response_cache_mb)
+
+    if args.workers == 0:
+        # Load models and start processing any sent requests.
+        logging.info("loading models")
 
         print("===================================")
         print("    Loading Model. Please Wait.    ")
         print("===================================")
 
-        with open(os.path.join(args.save_dir, 'config.json')) as f:
-            model_type = json.load(f)['model']
-        if model_type == 'core':
-            model = bayou.models.core.infer.BayesianPredictor
-        elif model_type == 'lle':
-            model = bayou.models.low_level_evidences.infer.BayesianPredictor
-        else:
-            raise ValueError('Invalid model type in config: ' + model_type)
-        bp = model(args.save_dir, sess)  # create a predictor that can generates ASTs from evidence
-
-        # route POST requests to / to _handle_http_post_request_index(...)
-        http_server.add_url_rule("/", "index", lambda: _handle_http_post_request_index(bp), methods=['POST'])
-        # route GET requests to /asthealth to _handle_http_get_request_health
-        http_server.add_url_rule("/asthealth", "/asthealth", _handle_http_get_request_health, methods=['GET'])
+        http_server = _make_http_server(_host_models(model_dirs, load), args)
 
         print("===================================")
         print("            Bayou Ready            ")
         print("===================================")
         http_server.run(host='0.0.0.0', port=8084)  # does not return
         _shutdown()  # we don't shut down flask directly, but if for some reason it ever stops go ahead and stop Bayou
+    else:
+        _master_pid = os.getpid()
+        preloaded = dict()
+        if args.backend == 'numpy':
+            # load the models once in the master, the workers share their weights copy-on-write (until they reload them)
+            logging.info("loading models")
+
+            print("===================================")
+            print("    Loading Model. Please Wait.    ")
+            print("===================================")
+
+            for name, save_dir in model_dirs.items():
+                timings = OrderedDict()
+                preloaded[name] = (None,) + _load_predictor(args, save_dir, None, timings)
+                _log_startup('preloading model {} from {}'.format(name, save_dir), timings)
+
+        # TensorFlow sessions do not survive a fork, so with the other backends every worker loads the models in
+        # sessions of its own
+        def make_app():
+            _logging.start()  # the logging thread of the master does not run in a worker
+            logging.info("loading models")
+            return _make_http_server(_host_models(model_dirs, load, preloaded), args)
+
+        print("===================================")
+        print("   Bayou Starting {} Workers".format(args.workers))
+        print("===================================")
+        PreforkServer('0.0.0.0', 8084, args.workers, make_app, timeout=args.worker_timeout,
+                      threaded=args.max_batch > 1).serve_forever()
+        _shutdown()
@@ -0,0 +1,339 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bayou.models.search import SearchProgress
+from bayou.server.ast_server import _add_model_arguments, _setup_logging, _load_model, _model_dirs, _host_models, \
+    _response_cache_key, _serialized_asts, _response_with_evidences, _batch_request, _generate_asts_batch, \
+    _batch_response, _batch_record, _shutdown, _metrics, _request, _request_budget, _reload_response, _lle
+from bayou.server.metrics import tracked
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 411: 'Length Required', 500: 'Internal Server Error',
+            503: 'Service Unavailable'}
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class AsyncASTServer(object):
+    """
+    Asynchronous front end of the AST server, serving the same requests as ast_server.py. Connections are handled by
+    an asyncio event loop, so any number of them can be open (and waiting) at once, while the model runs in a single
+    dedicated executor thread. The beam search of an (lle) request is run one step at a time, and steps of concurrent
+    requests take turns in the executor. Between steps, a request is cancelled if its client has disconnected or it has
+    run for longer than the request timeout, unless its searches complete greedily once they run out of its budget
+    (deadline or steps), well before the timeout. Searches of core models cannot be cancelled, and run to completion.
+
+    Models are hosted by a ModelHost, and reloaded in the background (outside of the executor) while the current
+    versions keep serving requests.
+    """
+
+    def __init__(self, models, request_timeout=None, max_bulk_batch=16, deadline=None, max_steps=None):
+        """
+        :param models: ModelHost of the models
+        :param request_timeout: seconds after which a request is cancelled, or None to never cancel it
+        :param max_bulk_batch: maximum number of items of a generate asts batch request run together
+        :param deadline: seconds a request may take before its searches complete greedily, or None for no deadline
+        :param max_steps: decoder steps a search may take before it completes greedily, or None for no limit
+        """
+        self.models = models
+        self.request_timeout = request_timeout
+        self.max_bulk_batch = max_bulk_batch
+        self.deadline = deadline
+        self.max_steps = max_steps
+        self.executor = ThreadPoolExecutor(max_workers=1)  # the model (and its caches) are not thread-safe
+        self.loop = None
+
+    def serve_forever(self, host, port):
+        self.loop = loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(asyncio.start_server(self._handle_connection, host, port, backlog=1024))
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            self.executor.shutdown()
+
+    def _run(self, stats, fn, *args):
+        # run a function in the executor, tracking the stats of the request
+        return self.loop.run_in_executor(self.executor, tracked, stats, fn, *args)
+
+    @staticmethod
+    def _timed(stats, attr, fn, *args):
+        # call a function, adding the time it takes to an attribute of the stats
+        start = time.time()
+        try:
+            return fn(*args)
+        finally:
+            setattr(stats, attr, getattr(stats, attr) + time.time() - start)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request = await self._read_request(reader, writer)
+            if request is None:
+                return
+            method, path, body = request
+            if path == '/asthealth' and method == 'GET':
+                status, content_type, body = 200, 'text/html; charset=utf-8', b'Ok'
+            elif path == '/metrics' and method == 'GET':
+                status, content_type, body = 200, 'text/plain; version=0.0.4', _metrics.render().encode('utf-8')
+            elif path == '/' and method == 'POST':
+                response = await self._handle_post(body, writer)
+                if response is None:
+                    return  # streamed
+                status, content_type, body = 200, 'application/json', response
+            else:
+                status, content_type, body = 404, 'text/html; charset=utf-8', b''
+            self._write_response(writer, status, content_type, body)
+            await writer.drain()
+        except RequestCancelled as e:
+            logging.info('request cancelled: {}'.format(e))
+            self._write_response(writer, 503, 'text/html; charset=utf-8', str(e).encode('utf-8'))
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logging.debug('connection lost: {}'.format(e))
+        except Exception:
+            logging.exception('request failed')
+            self._write_response(writer, 500, 'text/html; charset=utf-8', b'')
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        # parse an HTTP/1.1 request with a body of known length, returns None if the client sent nothing
+        request_line = await reader.readline()
+        if len(request_line) == 0:
+            return None
+        method, target = request_line.decode('latin-1').split()[:2]
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in [b'\r\n', b'\n', b'']:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            self._write_response(writer, 411, 'text/html; charset=utf-8', b'')
+            return None
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        length = int(headers.get('content-length', 0))
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method, target.split('?')[0], body
+
+    @staticmethod
+    def _write_response(writer, status, content_type, body):
+        head = 'HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(
+            status, _REASONS[status], content_type, len(body))
+        writer.write(head.encode('latin-1') + body)
+
+    async def _handle_post(self, body, writer):
+        request_json = body.decode('utf-8')  # read request string
+        request_dict = json.loads(request_json)  # parse request as a JSON string
+
+        request_type = request_dict['request type']
+        name = request_dict.get('model')  # the model to run, the default model if None
+        budget = _request_budget(request_dict, self.deadline, self.max_steps)
+
+        if request_type == 'generate asts':
+            js = json.loads(request_dict['evidence'])  # the evidence string of the request is also JSON
+            with _request(request_type, request_json, track=False, budget=budget) as stats, \
+                    self.models.use(name) as model:
+                stats.response = await self._generate_asts_response(model, js, writer, stats)
+                return stats.response
+        elif request_type == 'generate asts stream':
+            js = json.loads(request_dict['evidence'])
+            self.models.get(name)  # fail before the response starts if there is no such model
+            with _request(request_type, request_json, track=False, budget=budget) as stats, \
+                    self.models.use(name) as model:
+                await self._stream_asts(model, js, request_dict.get('provisional', False), writer, stats)
+            return None
+        elif request_type == 'generate asts batch':
+            evidences_list, params = _batch_request(request_dict, self.models.get(name).search_params)
+            with _request(request_type, request_json, track=False, budget=budget) as stats, \
+                    self.models.use(name) as model:
+                results = _generate_asts_batch(evidences_list, model.predictor, params, self.max_bulk_batch, stats)
+                if request_dict.get('stream', False):
+                    await self._stream(writer, self._generate_asts_batch(evidences_list, results, writer, stats,
+                                                                         stream=True))
+                    return None
+                results = await self._generate_asts_batch(evidences_list, results, writer, stats)
+                stats.response = (await self._run(stats, _batch_response, evidences_list, results)).encode('utf-8')
+                return stats.response
+        elif request_type == 'reload model':
+            return _reload_response(self.models, name).encode('utf-8')
+        elif request_type == 'shutdown':
+            _shutdown()  # does not return
+
+        return b''
+
+    def _deadline(self):
+        return None if self.request_timeout is None else time.time() + self.request_timeout
+
+    @staticmethod
+    def _check(writer, deadline, done):
+        # a client may shut down its side of the connection after sending its request and still read the response, so
+        # only a connection that is lost (reset, or failed to write) cancels the request, not the end of its input
+        if writer.transport.is_closing():
+            raise RequestCancelled('client disconnected after {}'.format(done))
+        if deadline is not None and time.time() > deadline:
+            raise RequestCancelled('timed out after {}'.format(done))
+
+    async def _generate_asts_response(self, model, js, writer, stats):
+        # serialize the response to a generate asts request, with its ASTs from the response cache of the model if they
+        # are cached (see ast_server._handle_generate_asts_request)
+        predictor, response_cache = model.predictor, model.response_cache
+        key = None
+        if response_cache is not None:
+            key = await self._run(stats, _response_cache_key, js, predictor, model.search_params)
+            asts = response_cache.get(key)
+            if asts is not None:
+                return _response_with_evidences(js, asts)
+        asts = await self._generate_asts(model, js, writer, stats)
+        # filtering and serializing the ASTs takes a while for large responses, so it does not hold up the event loop
+        asts = (await self._run(stats, _serialized_asts, js, asts, predictor)).encode('utf-8')
+        if key is not None and (stats.budget is None or stats.budget.truncated == 0):
+            response_cache.put(key, asts)
+        return _response_with_evidences(js, asts)
+
+    async def _generate_asts(self, model, js, writer, stats, progress=None):
+        # search the ASTs of the evidences js, writing their records to the connection writer if progress is given
+        deadline = self._deadline()
+        predictor, search_params = model.predictor, model.search_params
+        if not _lle(predictor):
+            asts = await self._run(stats, lambda: predictor.infer(js, **search_params))
+            if progress is not None:  # the search of core models is not step-wise, all of its ASTs are final
+                progress.records += [dict(ast, rank=i, final=True) for i, ast in enumerate(asts)]
+                progress.num_final = len(asts)
+                await self._write_records(writer, progress)
+            return asts
+
+        psi = await self._run(stats, self._timed, stats, 'psi_seconds', predictor.psi_average_from_evidence,
+                              js, search_params['num_psi_samples'], search_params['psi_mode'])
+        steps = predictor.beam_search_steps(psi, search_params['beam_width'], progress, stats.budget)
+        try:
+            while await self._run(stats, self._timed, stats, 'search_seconds', self._step, steps):
+                self._check(writer, deadline, '{} steps'.format(steps.steps))
+                if progress is not None:
+                    await self._write_records(writer, progress)
+        finally:
+            self.executor.submit(steps.close)  # after any step still running, does nothing if the search is done
+            stats.decoder_steps += steps.steps
+            stats.beam_iterations += steps.iterations
+        if progress is not None:
+            await self._write_records(writer, progress)
+        return steps.result
+
+    async def _generate_asts_batch(self, evidences_list, results, writer, stats, stream=False):
+        # run the items of a batch in the executor until each is done, so that the batch is cancelled between them like
+        # a search, and write the record of every result if streaming. Returns the results, or the end record of the
+        # stream.
+        deadline = self._deadline()
+        done = []
+        try:
+            while True:
+                result = await self._run(stats, next, results, None)
+                if result is None:
+                    break
+                done.append(result)
+                if stream:
+                    self._write_chunk(writer, _batch_record(evidences_list, *result).encode('utf-8'))
+                    await writer.drain()
+                self._check(writer, deadline, '{} of {} items'.format(len(done), len(evidences_list)))
+        finally:
+            self.executor.submit(results.close)  # after any item still running
+        return done if not stream else {'done': True, 'count': len(done)}
+
+    async def _stream_asts(self, model, js, provisional, writer, stats):
+        # stream the records of ASTs (see ast_server._stream_asts)
+        progress = SearchProgress(model.predictor, provisional)
+
+        async def generate():
+            await self._generate_asts(model, js, writer, stats, progress)
+            return {'done': True, 'count': progress.num_final}
+        await self._stream(writer, generate())
+
+    async def _stream(self, writer, generate):
+        # stream records in a chunked response, written by the coroutine generate, which returns the end record. The
+        # response ends with a record of the error instead if the request fails after the response has started.
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n'
+                     b'Connection: close\r\n\r\n')
+        try:
+            end = await generate
+        except RequestCancelled as e:
+            logging.info('request cancelled: {}'.format(e))
+            end = {'done': False, 'error': str(e)}
+        except ConnectionError:
+            raise
+        except Exception as e:
+            logging.exception('request failed')
+            end = {'done': False, 'error': str(e)}
+        self._write_chunk(writer, (json.dumps(end) + '\n').encode('utf-8'))
+        self._write_chunk(writer, b'')
+        await writer.drain()
+
+    async def _write_records(self, writer, progress):
+        records = progress.pop()
+        if len(records) == 0:
+            return
+        self._write_chunk(writer, ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer, data):
+        writer.write('{:x}\r\n'.format(len(data)).encode('latin-1') + data + b'\r\n')
+
+    @staticmethod
+    def _step(steps):
+        # runs a step of the search, returns whether the search goes on
+        return next(steps, None) is not None
+
+
+if __name__ == '__main__':
+
+    # Parse command line args.
+    parser = argparse.ArgumentParser()
+    _add_model_arguments(parser)
+    parser.add_argument('--request_timeout', type=float, default=0,
+                        help='seconds after which a request is cancelled, 0 to never cancel requests (lle models only)')
+    args = parser.parse_args()
+
+    _setup_logging(args.logs_dir, args.log_level, args.log_sample_rate)
+
+    logging.debug("entering")  # can't move line up in program because logger not configured until this point
+
+    # Load models and start processing any sent requests.
+    logging.info("loading models")
+
+    print("===================================")
+    print("    Loading Model. Please Wait.    ")
+    print("===================================")
+
+    models = _host_models(_model_dirs(args), lambda name, save_dir, loaded=None: _load_model(
+        args, name, save_dir, response_cache_mb=args.response_cache_mb))
+    server = AsyncASTServer(models, args.request_timeout if args.request_timeout > 0 else None, args.max_bulk_batch,
+                            args.deadline or None, args.max_steps or None)
+
+    print("===================================")
+    print("            Bayou Ready            ")
+    print("===================================")
+    server.serve_forever('0.0.0.0', 8084)
+    _shutdown()
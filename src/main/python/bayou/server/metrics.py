@@ -0,0 +1,294 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import threading
+import time
+
+from bayou.models.search import SearchStats
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 25., 60.)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value not in [float('inf'), float('-inf')] else ('+Inf' if value > 0 else '-Inf')
+
+
+class Counter(object):
+    """
+    Counter in the Prometheus text format, with a value for every combination of its labels. Its values are either
+    incremented, or collected when it is rendered from a function that returns a dict of label values (tuples) to
+    values, e.g., counts kept by a cache.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.function = function
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, key, value) for key, value in self.function().items()]
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.type)]
+        for name, key, value in self.samples():
+            lines.append('{}{} {}'.format(name, _format_labels(self.labelnames, key), _format_value(value)))
+        return lines
+
+
+class Gauge(Counter):
+    """
+    Gauge in the Prometheus text format. Its values are either set, or collected when it is rendered from a function
+    that returns a dict of label values (tuples) to values.
+    """
+
+    type = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Counter):
+    """
+    Histogram in the Prometheus text format, with cumulative buckets bounded by the given (sorted) upper bounds
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        Counter.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} {}'.format(self.name, self.type)]
+        for _, key, (counts, total) in self.samples():
+            for bound, count in zip(self.buckets, counts):
+                lines.append('{}_bucket{} {}'.format(self.name, _format_labels(self.labelnames, key,
+                                                                               [('le', _format_value(bound))]), count))
+            lines.append('{}_sum{} {}'.format(self.name, _format_labels(self.labelnames, key), _format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, _format_labels(self.labelnames, key), counts[-1]))
+        return lines
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, (list(counts), total)) for key, (counts, total) in self.values.items()]
+
+
+class RequestStats(SearchStats):
+    """
+    Work done for a request. The predictor adds the time spent on psi and the beam search, and the number of decoder
+    steps and beam iterations, to the stats it is given. Session runs are counted by a CountingSession while the stats
+    are tracked (see tracking). The searches of the request run within its budget, if any.
+    """
+
+    def __init__(self):
+        SearchStats.__init__(self)
+        self.session_runs = 0
+        self.response = None  # payload of the response, for the request log
+        self.budget = None  # SearchBudget of the searches of the request, if any
+
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def tracking(stats):
+    """
+    Attributes the session runs of the current thread to the given stats while in the context
+
+    :param stats: RequestStats, or a list of RequestStats that all share the runs (e.g., those of a batch)
+    """
+    previous = getattr(_local, 'stats', [])
+    _local.stats = stats if isinstance(stats, list) else [stats]
+    try:
+        yield
+    finally:
+        _local.stats = previous
+
+
+def tracked(stats, fn, *args):
+    """
+    Calls a function, tracking the stats (see tracking)
+
+    :return: the result of the function
+    """
+    with tracking(stats):
+        return fn(*args)
+
+
+class CountingSession(object):
+    """
+    Session that counts its runs in the stats tracked by the current thread, and is otherwise the wrapped session
+    """
+
+    def __init__(self, sess):
+        self.sess = sess
+
+    def __getattr__(self, attr):
+        return getattr(self.sess, attr)
+
+    def run(self, *args, **kwargs):
+        for stats in getattr(_local, 'stats', []):
+            stats.session_runs += 1
+        return self.sess.run(*args, **kwargs)
+
+
+class ServerMetrics(object):
+    """
+    Metrics of the AST server, rendered in the Prometheus text format by the /metrics endpoint. Every process has its
+    own metrics, so with pre-forked workers a scrape gets those of the worker that serves it.
+    """
+
+    def __init__(self):
+        self.requests = Counter('bayou_requests_total', 'Requests by type.', ['type'])
+        self.errors = Counter('bayou_request_errors_total', 'Requests that failed, by type.', ['type'])
+        self.in_flight = Gauge('bayou_requests_in_flight', 'Requests being served.')
+        self.in_flight.set(0)
+        self.latency = Histogram('bayou_request_seconds', 'End-to-end latency of requests, by type.', ['type'])
+        self.psi = Histogram('bayou_psi_seconds', 'Time spent computing psi, per request.')
+        self.search = Histogram('bayou_beam_search_seconds', 'Time spent in the beam search, per request.')
+        self.okay = Histogram('bayou_okay_filter_seconds', 'Time spent filtering ASTs with _okay, per request.')
+        self.serialization = Histogram('bayou_serialization_seconds', 'Time spent serializing responses, per request.')
+        self.session_runs = Histogram('bayou_session_runs_per_request', 'TensorFlow session runs per request, '
+                                      'including runs shared with other requests of a batch.', buckets=COUNT_BUCKETS)
+        self.decoder_steps = Histogram('bayou_decoder_steps_per_request', 'Decoder steps (batched decoder calls) per '
+                                       'request.', buckets=COUNT_BUCKETS)
+        self.beam_iterations = Histogram('bayou_beam_iterations_per_request', 'Beam search iterations per request.',
+                                         buckets=COUNT_BUCKETS)
+        self.truncated = Counter('bayou_searches_truncated_total', 'Beam searches that ran out of the budget of their '
+                                 'request and were completed greedily.')
+        self.truncated.inc(0)
+        self.caches = dict()
+        self.cache_hits = Counter('bayou_cache_hits_total', 'Cache hits, by cache.', ['cache'],
+                                  lambda: self._caches(lambda hits, misses: hits))
+        self.cache_misses = Counter('bayou_cache_misses_total', 'Cache misses, by cache.', ['cache'],
+                                    lambda: self._caches(lambda hits, misses: misses))
+        self.cache_hit_ratio = Gauge('bayou_cache_hit_ratio', 'Ratio of cache lookups that hit, by cache.', ['cache'],
+                                     lambda: self._caches(lambda hits, misses: float(hits) / max(hits + misses, 1)))
+        self.versions = lambda: {}  # no hosted models until add_models
+        self.model_versions = Gauge('bayou_model_version', 'Version of every hosted model, counting the times it was '
+                                    'loaded.', ['model'],
+                                    lambda: {(name,): version for name, version in self.versions().items()})
+        self.metrics = [self.requests, self.errors, self.in_flight, self.latency, self.psi, self.search, self.okay,
+                        self.serialization, self.session_runs, self.decoder_steps, self.beam_iterations,
+                        self.truncated, self.cache_hits, self.cache_misses, self.cache_hit_ratio, self.model_versions]
+
+    def add_cache(self, name, counts):
+        """
+        Adds a cache to the cache metrics
+
+        :param name: name of the cache
+        :param counts: function that returns a dict of names (of the cache, or of its parts) to (hits, misses)
+        """
+        self.caches[name] = counts
+
+    def add_models(self, versions):
+        """
+        Adds the versions of the hosted models to the metrics
+
+        :param versions: function that returns a dict of the names of the models to their versions
+        """
+        self.versions = versions
+
+    def _caches(self, value):
+        return {(name,): value(hits, misses) for counts in list(self.caches.values())
+                for name, (hits, misses) in counts().items()}
+
+    @contextlib.contextmanager
+    def request(self, request_type, track=True):
+        """
+        Measures a request while in the context
+
+        :param request_type: type of the request
+        :param track: whether to track the stats of the request in the current thread (see tracking)
+        :return: the RequestStats of the request (as the value of the context)
+        """
+        stats = RequestStats()
+        self.requests.inc(type=request_type)
+        self.in_flight.inc()
+        start = time.time()
+        try:
+            if track:
+                with tracking(stats):
+                    yield stats
+            else:
+                yield stats
+        except Exception:
+            self.errors.inc(type=request_type)
+            raise
+        finally:
+            self.in_flight.dec()
+            self.latency.observe(time.time() - start, type=request_type)
+            if request_type.startswith('generate asts'):
+                self.psi.observe(stats.psi_seconds)
+                self.search.observe(stats.search_seconds)
+                self.session_runs.observe(stats.session_runs)
+                self.decoder_steps.observe(stats.decoder_steps)
+                self.beam_iterations.observe(stats.beam_iterations)
+                self.truncated.inc(stats.budget.truncated if stats.budget is not None else 0)
+
+    @contextlib.contextmanager
+    def timer(self, histogram):
+        """
+        Observes the time spent in the context in a histogram
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            histogram.observe(time.time() - start)
+
+    def render(self):
+        """
+        Renders the metrics
+
+        :return: the metrics in the Prometheus text format
+        """
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
@@ -0,0 +1,201 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+class HostedModel(object):
+    """
+    A version of a hosted model: its predictor and the parameters of its search, along with everything else that belongs
+    to the version (e.g., the caches of its results), which goes away with it. Once the version is retired, it is
+    closed as soon as no request is using it.
+    """
+
+    def __init__(self, name, save_dir, predictor, search_params, response_cache=None, close=None):
+        """
+        :param name: name of the model
+        :param save_dir: directory the model was loaded from
+        :param predictor: the predictor of the model
+        :param search_params: parameters of the search (see ast_server._load_predictor)
+        :param response_cache: ResponseCache of the responses of the version, or None
+        :param close: function that releases the resources of the version (e.g., its session), or None
+        """
+        self.name = name
+        self.save_dir = save_dir
+        self.predictor = predictor
+        self.search_params = search_params
+        self.response_cache = response_cache
+        self.close = close
+        self.version = 0  # set by the ModelHost
+        self.in_use = 0
+        self.retired = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.in_use += 1
+
+    def release(self):
+        with self.lock:
+            self.in_use -= 1
+            closing = self.retired and self.in_use == 0
+        if closing:
+            self._close()
+
+    def retire(self):
+        with self.lock:
+            self.retired = True
+            closing = self.in_use == 0
+        if closing:
+            self._close()
+
+    def _close(self):
+        logging.info('closing version {} of model {}'.format(self.version, self.name))
+        if self.close is not None:
+            self.close()
+
+
+class ModelHost(object):
+    """
+    Named models served by one process, to which requests are routed by name. A model is reloaded (e.g., from the new
+    checkpoint in its directory) in a background thread: the new version is loaded and warmed up while the current one
+    keeps serving requests, and is then swapped in atomically. Requests that started on the previous version finish on
+    it, and it is closed once they are done. Caches belong to a version, so a reload invalidates those of its model only.
+    """
+
+    def __init__(self, load):
+        """
+        :param load: function called with the name and directory of a model that loads (and warms up) a version of it,
+                     returning its HostedModel
+        """
+        self.load = load
+        self.models = OrderedDict()
+        self.default = None
+        self.reloading = set()
+        self.lock = threading.Lock()
+
+    def add(self, name, save_dir, model=None):
+        """
+        Adds a model, the first one added is the default model of requests that do not name one
+
+        :param name: name of the model
+        :param save_dir: directory of the model
+        :param model: HostedModel of the model if it is already loaded, or None to load it (in the calling thread)
+        """
+        model = model if model is not None else self.load(name, save_dir)
+        model.version = 1
+        with self.lock:
+            self.models[name] = model
+            if self.default is None:
+                self.default = name
+
+    def get(self, name=None):
+        """
+        Gets the current version of a model
+
+        :param name: name of the model, or None for the default model
+        :return: the HostedModel of the model
+        :raise: ValueError if there is no such model
+        """
+        with self.lock:
+            return self._get(name)
+
+    def _get(self, name):
+        name = name if name is not None else self.default
+        if name not in self.models:
+            raise ValueError('Invalid model: {}'.format(name))
+        return self.models[name]
+
+    @contextlib.contextmanager
+    def use(self, name=None):
+        """
+        Uses the current version of a model while in the context, so that it is not closed (even if a new version is
+        swapped in) until the context exits
+
+        :param name: name of the model, or None for the default model
+        :return: the HostedModel of the model (as the value of the context)
+        :raise: ValueError if there is no such model
+        """
+        with self.lock:
+            model = self._get(name)
+            model.acquire()  # before a new version can be swapped in, and this one retired
+        try:
+            yield model
+        finally:
+            model.release()
+
+    def reload(self, name=None):
+        """
+        Starts reloading a model from its directory in a background thread, unless it is already being reloaded
+
+        :param name: name of the model, or None to reload all models
+        :return: list of the names of the models whose reload started
+        :raise: ValueError if there is no such model
+        """
+        names = [self.get(name).name] if name is not None else list(self.models.keys())
+        started = []
+        for name in names:
+            with self.lock:
+                if name in self.reloading:
+                    continue
+                self.reloading.add(name)
+            threading.Thread(target=self._reload, args=(name,), name='reload-' + name, daemon=True).start()
+            started.append(name)
+        return started
+
+    def reload_on(self, event):
+        """
+        Reloads all models whenever an event is set, from a background thread. Signal handlers set the event rather
+        than reload the models themselves: they run in the main thread, which may be holding the lock of the host
+        (e.g., while it serves a request) when the signal arrives.
+
+        :param event: threading.Event that requests a reload
+        """
+        def watch():
+            while True:
+                event.wait()
+                event.clear()
+                self.reload()
+        threading.Thread(target=watch, name='reload-on-event', daemon=True).start()
+
+    def _reload(self, name):
+        try:
+            current = self.get(name)
+            logging.info('reloading model {} from {}'.format(name, current.save_dir))
+            try:
+                model = self.load(name, current.save_dir)
+            except Exception:
+                logging.exception('reloading model {} failed, keeping version {}'.format(name, current.version))
+                return
+            with self.lock:
+                current = self.models[name]
+                model.version = current.version + 1
+                self.models[name] = model
+            current.retire()
+            logging.info('model {} is now at version {}'.format(name, model.version))
+        finally:
+            with self.lock:
+                self.reloading.discard(name)
+
+    def versions(self):
+        """
+        Gets the versions of the models, counting the times each was loaded
+
+        :return: dict of the names of the models to their current versions
+        """
+        with self.lock:
+            return {name: model.version for name, model in self.models.items()}
@@ -0,0 +1,191 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+
+class _RequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+class _WorkerServer(WSGIServer):
+    """
+    WSGI server of a worker, accepting connections on the listening socket shared by all workers and beating its
+    heart every time it polls for (or has handled) a request
+    """
+
+    def __init__(self, listener, app, heartbeat):
+        WSGIServer.__init__(self, listener.getsockname()[:2], _RequestHandler, bind_and_activate=False)
+        self.socket = listener
+        self.server_name = socket.getfqdn(listener.getsockname()[0])
+        self.server_port = listener.getsockname()[1]
+        self.setup_environ()
+        self.set_app(app)
+        self.heartbeat = heartbeat
+
+    def service_actions(self):
+        self.heartbeat()
+
+
+class _ThreadingWorkerServer(ThreadingMixIn, _WorkerServer):
+    daemon_threads = True
+
+
+class PreforkServer(object):
+    """
+    Pre-forking HTTP server. The master process opens the listening socket and forks the workers, which accept
+    connections on the shared socket (the kernel hands every connection to one of them) and handle one request at a
+    time. Anything loaded by the master before serve_forever() is shared copy-on-write by the workers. The master
+    supervises the workers, restarting those that exit and killing (and then restarting) those whose heartbeat stops
+    for longer than the timeout, and stops them all when it receives SIGTERM or SIGINT. SIGHUP is forwarded to the
+    workers, which ignore it unless make_app sets a handler (e.g., to reload their models).
+
+    Threaded workers handle every request in a new thread (e.g., so that concurrent requests can be batched), in which
+    case the heartbeat only shows that a worker still accepts connections.
+    """
+
+    def __init__(self, host, port, num_workers, make_app, timeout=300., poll_interval=0.5, threaded=False):
+        """
+        :param host: host to listen on
+        :param port: port to listen on
+        :param num_workers: number of worker processes
+        :param make_app: function called in every worker (after it is forked) that returns the WSGI application
+        :param timeout: seconds after which a worker without a heartbeat (e.g., stuck in a request) is restarted
+        :param poll_interval: seconds between heartbeats of an idle worker
+        :param threaded: whether workers handle every request in a new thread
+        """
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        self.make_app = make_app
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.threaded = threaded
+        self.workers = [None] * num_workers
+        self.heartbeats = None
+        self.listener = None
+        self.stopping = False
+
+    def serve_forever(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(128)
+        # workers that lose the race for a connection must not block in accept(), or they would miss heartbeats
+        self.listener.setblocking(False)
+
+        # shared memory for the heartbeats, allocated before forking
+        self.heartbeats = multiprocessing.RawArray('d', self.num_workers)
+
+        # objects loaded so far will not be freed, keep the garbage collector from touching (and copying) them
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._forward)
+        for i in range(self.num_workers):
+            self._spawn(i)
+        logging.info('started {} workers'.format(self.num_workers))
+
+        try:
+            while not self.stopping:
+                time.sleep(1.)
+                self._supervise()
+        finally:
+            self._stop_workers()
+            self.listener.close()
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _forward(self, signum, frame):
+        for pid in self.workers:
+            if pid is not None:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def _spawn(self, i):
+        self.heartbeats[i] = time.time()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            status = 1
+            try:
+                self._run_worker(i)
+                status = 0
+            except Exception:
+                logging.exception('worker {} failed'.format(i))
+            finally:
+                os._exit(status)
+        self.workers[i] = pid
+
+    def _run_worker(self, i):
+        def heartbeat():
+            self.heartbeats[i] = time.time()
+
+        server_class = _ThreadingWorkerServer if self.threaded else _WorkerServer
+        server = server_class(self.listener, self.make_app(), heartbeat)
+        logging.info('worker {} (pid {}) ready'.format(i, os.getpid()))
+        server.serve_forever(poll_interval=self.poll_interval)
+
+    def _supervise(self):
+        # restart workers that exited
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in self.workers and not self.stopping:
+                i = self.workers.index(pid)
+                logging.warning('worker {} (pid {}) exited with status {}, restarting'.format(i, pid, status))
+                self._spawn(i)
+
+        # kill workers whose heartbeat stopped, they are restarted once they are reaped
+        now = time.time()
+        for i, pid in enumerate(self.workers):
+            if now - self.heartbeats[i] > self.timeout:
+                logging.warning('worker {} (pid {}) timed out, killing'.format(i, pid))
+                self.heartbeats[i] = now
+                os.kill(pid, signal.SIGKILL)
+
+    def _stop_workers(self):
+        for pid in self.workers:
+            if pid is not None:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for pid in self.workers:
+            if pid is not None:
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
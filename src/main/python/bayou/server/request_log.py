@@ -0,0 +1,112 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a compact JSON object on a single line, with the structured fields of the record (passed as
+    extra={'fields': dict}) next to its message
+    """
+
+    def format(self, record):
+        entry = {'time': '{},{:03d}'.format(self.formatTime(record, '%Y-%m-%dT%H:%M:%S'), int(record.msecs)),
+                 'level': record.levelname,
+                 'thread': record.threadName,
+                 'source': '{}:{}'.format(record.filename, record.lineno),
+                 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, separators=(',', ':'))
+
+
+class QueueLogging(object):
+    """
+    Logging through a queue: the root logger only puts records in the queue, and a background thread writes them
+    with the given handlers, so that formatting and I/O are off the path of requests
+    """
+
+    def __init__(self, handlers, level=logging.INFO):
+        self.handlers = handlers
+        self.level = level
+        self.handler = None
+        self.listener = None
+
+    def start(self):
+        """
+        Starts the background thread, or restarts it in a forked process (where the thread of the parent does not
+        run). Records queued but not written by the parent are not written by the child.
+        """
+        root = logging.getLogger()
+        if self.handler is not None:
+            root.removeHandler(self.handler)
+        records = queue.Queue()
+        self.handler = QueueHandler(records)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener = QueueListener(records, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """
+        Writes the queued records, and stops the background thread
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+class RequestLog(object):
+    """
+    Log of requests, with a structured record of the type, outcome and timing of every request. The payloads of a
+    sample (of the given rate) of requests, and of all failed requests, are added to their records.
+    """
+
+    def __init__(self, sample_rate=0.):
+        self.sample_rate = sample_rate
+        self.logger = logging.getLogger('bayou.requests')
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def log(self, request_type, seconds, stats=None, error=None, request=None, response=None):
+        """
+        Logs a request
+
+        :param request_type: type of the request
+        :param seconds: end-to-end latency of the request
+        :param stats: RequestStats of the request, or None
+        :param error: the exception the request failed with, or None
+        :param request: payload of the request (str), or None to leave it out
+        :param response: payload of the response (str or bytes), or None to leave it out
+        """
+        fields = {'request_type': request_type, 'seconds': round(seconds, 6)}
+        if stats is not None:
+            fields.update({'psi_seconds': round(stats.psi_seconds, 6), 'search_seconds': round(stats.search_seconds, 6),
+                           'decoder_steps': stats.decoder_steps, 'beam_iterations': stats.beam_iterations,
+                           'session_runs': stats.session_runs})
+            if stats.budget is not None:
+                fields['truncated_searches'] = stats.budget.truncated
+        if error is not None:
+            fields['error'] = '{}: {}'.format(type(error).__name__, error)
+        if request is not None:
+            fields['request'] = request
+        if response is not None:
+            fields['response'] = response.decode('utf-8') if isinstance(response, bytes) else response
+        self.logger.log(logging.WARNING if error is not None else logging.INFO, 'request',
+                        extra={'fields': fields})
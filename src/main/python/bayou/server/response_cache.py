@@ -0,0 +1,97 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache(object):
+    """
+    Cache of the serialized ASTs of responses to 'generate asts' requests, bounded by the total size of its keys and
+    values and evicting least recently used ones first. Requests are keyed by the canonical form of their evidences
+    along with the parameters of the search, so the cache is only exact if the search is deterministic (e.g., psi mode
+    'mean'), and otherwise serves the result of the first search for every identical request. The ASTs do not depend
+    on how the evidences of a request are written, and are served along with the evidences of the request (see
+    ast_server._response_with_evidences).
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.responses = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(evidences, **params):
+        """
+        Gets the key of a request
+
+        :param evidences: the evidences (as a dict), or a key of them that is the same for all evidences that the model
+                          reads the same (see BayesianPredictor.evidence_key of lle models)
+        :param params: parameters of the search
+        :return: the key, which is the same for requests whose evidences differ only in the order of (and duplicates
+                 in) lists of strings, which are sets of evidences
+        """
+        if not isinstance(evidences, dict):
+            return json.dumps([evidences, params], sort_keys=True)
+        canonical = {name: sorted(set(value)) if isinstance(value, list) and all(isinstance(v, str) for v in value)
+                     else value for name, value in evidences.items()}
+        return json.dumps([canonical, params], sort_keys=True)
+
+    def get(self, key):
+        """
+        Gets the cached ASTs of a response
+
+        :param key: the key of the request
+        :return: the serialized ASTs, or None if they are not cached
+        """
+        with self.lock:
+            response = self.responses.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.responses.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key, response):
+        """
+        Adds the ASTs of a response, evicting least recently used ones until the cache is within its bound. ASTs
+        larger than the bound are not cached.
+
+        :param key: the key of the request
+        :param response: the serialized ASTs (bytes)
+        """
+        size = len(key) + len(response)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.responses:
+                self.size -= len(key) + len(self.responses.pop(key))
+            self.responses[key] = response
+            self.size += size
+            while self.size > self.max_bytes:
+                k, r = self.responses.popitem(last=False)
+                self.size -= len(k) + len(r)
+
+    def invalidate(self):
+        """
+        Drops all cached responses, e.g., when the model is reloaded
+        """
+        with self.lock:
+            self.responses.clear()
+            self.size = 0
@@ -0,0 +1,295 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+from collections import deque
+import threading
+import time
+import numpy as np
+
+from bayou.models.search import SearchProgress
+from bayou.server.metrics import RequestStats, tracking
+
+
+class _Job(object):
+
+    def __init__(self, evidences, num_psi_samples, beam_width, psi_mode, progress=None, stats=None, budget=None):
+        self.evidences = evidences
+        self.num_psi_samples = num_psi_samples
+        self.beam_width = beam_width
+        self.psi_mode = psi_mode
+        self.progress = progress
+        self.stats = stats if stats is not None else RequestStats()
+        self.budget = budget
+        self.started = None
+        self.records = queue.Queue()  # records of a streaming job, ending with None
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def flush(self):
+        if self.progress is not None:
+            for record in self.progress.pop():
+                self.records.put(record)
+
+    def finish(self, result=None, error=None):
+        self.flush()
+        if self.started is not None:
+            self.stats.search_seconds += time.time() - self.started
+        self.result = result
+        self.error = error
+        self.done.set()
+        self.records.put(None)
+
+
+class BatchScheduler(object):
+    """
+    Micro-batching scheduler for the inference of an (lle) BayesianPredictor shared by concurrent requests. Requests
+    are queued, and a single thread runs the model: requests that arrive within wait_window seconds of each other (up
+    to max_batch) are encoded in a single batch, and the beam searches of all running requests are interleaved so that
+    each of their steps shares one batched decoder call. Requests that arrive while searches are running join them at
+    the next step, as long as there are less than max_batch of them. A wider window (or a larger batch) trades latency
+    for throughput.
+
+    The scheduler is used in place of the predictor, with the same infer method, and delegates all other attributes to
+    the predictor.
+    """
+
+    def __init__(self, predictor, max_batch=8, wait_window=0.005):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.wait_window = wait_window
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='BatchScheduler', daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, attr):
+        return getattr(self.predictor, attr)
+
+    def close(self):
+        """
+        Stops the thread of the scheduler once the requests queued so far are done, and waits for it. No requests may be
+        made after.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def infer(self, evidences, num_psi_samples=100, beam_width=25, psi_mode='sample', stats=None, budget=None):
+        """
+        Returns an ordered (by probability) list of ASTs from the model, given evidences, using beam search. Blocks
+        until the request has been run along with others.
+
+        :param evidences: the input evidences
+        :param num_psi_samples: number of samples of the intent, averaged before AST construction
+        :param beam_width: width of the beam search
+        :param psi_mode: how samples of the intent are averaged (see BayesianPredictor.psi_average_from_evidence)
+        :param stats: RequestStats to add the work done to, including work shared with the rest of the batch, or None
+        :param budget: SearchBudget of the search (including the time the request waits to start), or None
+        :return: list of ASTs ordered by their probabilities
+        """
+        job = _Job(evidences, num_psi_samples, beam_width, psi_mode, stats=stats, budget=budget)
+        self.queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def infer_stream(self, evidences, num_psi_samples=100, beam_width=25, psi_mode='sample', provisional=False,
+                     stats=None, budget=None):
+        """
+        Generates the ASTs of infer as the beam search completes them (see BayesianPredictor.infer_stream). The search
+        is cancelled if the generator is closed before it finishes.
+
+        :param evidences: the input evidences
+        :param num_psi_samples: number of samples of the intent, averaged before AST construction
+        :param beam_width: width of the beam search
+        :param psi_mode: how samples of the intent are averaged (see BayesianPredictor.psi_average_from_evidence)
+        :param provisional: whether to also generate ASTs that are complete but not yet final
+        :param stats: RequestStats to add the work done to (see infer), or None
+        :param budget: SearchBudget of the search (see infer), or None
+        :return: generator of records of ASTs
+        """
+        job = _Job(evidences, num_psi_samples, beam_width, psi_mode, SearchProgress(self.predictor, provisional), stats,
+                   budget)
+        self.queue.put(job)
+        try:
+            while True:
+                record = job.records.get()
+                if record is None:
+                    break
+                yield record
+        finally:
+            job.cancelled = True
+        if job.error is not None:
+            raise job.error
+
+    def infer_batch(self, evidences_list, num_psi_samples=100, beam_width=25, psi_mode='sample', max_batch=None,
+                    stats=None, budget=None):
+        """
+        Generates the ASTs of infer for many sets of evidences (see BayesianPredictor.infer_batch), running them as
+        requests of the scheduler, at most max_batch at once, so that they are batched with each other and with other
+        requests. Items not yet done are cancelled if the generator is closed.
+
+        :param evidences_list: list of evidences
+        :param num_psi_samples: number of samples of the intent, averaged before AST construction
+        :param beam_width: width of the beam search
+        :param psi_mode: how samples of the intent are averaged (see BayesianPredictor.psi_average_from_evidence)
+        :param max_batch: maximum number of items run at once, by default the maximum batch of the scheduler
+        :param stats: RequestStats to add the work done for all items to (see infer), or None
+        :param budget: SearchBudget shared by the searches of all items (see infer), or None
+        :return: generator of (index of the evidences in the list, list of ASTs), in the order of the list
+        """
+        max_batch = max_batch or self.max_batch
+        stats = stats if stats is not None else RequestStats()
+        window = deque()
+        try:
+            for i, evidences in enumerate(evidences_list):
+                if len(window) >= max_batch:
+                    yield self._wait(*window.popleft())
+                job = _Job(evidences, num_psi_samples, beam_width, psi_mode, stats=stats, budget=budget)
+                self.queue.put(job)
+                window.append((i, job))
+            while len(window) > 0:
+                yield self._wait(*window.popleft())
+        finally:
+            for (_, job) in window:
+                job.cancelled = True
+
+    @staticmethod
+    def _wait(i, job):
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return i, job.result
+
+    def _run(self):
+        active = []  # list of [job, psi, search, paths the search is waiting for]
+        while not self.closed or len(active) > 0:
+            jobs = self._collect(len(active) == 0, self.max_batch - len(active))
+            if len(jobs) > 0:
+                logging.debug('starting {} requests along with {} running'.format(len(jobs), len(active)))
+                self._start(jobs, active)
+            if len(active) > 0:
+                self._step(active)
+
+    def _collect(self, block, limit):
+        # wait for a request if none is running, and then for others within the window. Requests cancelled while they
+        # were queued are finished without running, and do not count towards the limit.
+        jobs = []
+        deadline = None
+        while len(jobs) < limit:
+            try:
+                if not block:
+                    job = self.queue.get_nowait()
+                elif deadline is None:
+                    job = self.queue.get()
+                else:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    job = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if job is None:  # closed
+                self.closed = True
+                break
+            if job.cancelled:
+                job.finish()
+                continue
+            jobs.append(job)
+            if block and deadline is None:
+                deadline = time.time() + self.wait_window
+        return jobs
+
+    @staticmethod
+    def _stats(jobs):
+        # stats of the jobs, without duplicates (the items of a batch request share their stats)
+        return list({id(job.stats): job.stats for job in jobs}.values())
+
+    def _start(self, jobs, active):
+        # encode the evidences of all new requests at once, and start their searches. Requests cancelled since they
+        # were collected are finished without running.
+        for job in jobs:
+            if job.cancelled:
+                job.finish()
+        jobs = [job for job in jobs if not job.done.is_set()]
+        if len(jobs) == 0:
+            return
+        start = time.time()
+        try:
+            with tracking(self._stats(jobs)):
+                mean, covariance = self.predictor.psi_params_from_evidence_batch([job.evidences for job in jobs])
+        except Exception as e:
+            for job in jobs:
+                job.finish(error=e)
+            return
+        for stats in self._stats(jobs):
+            stats.psi_seconds += time.time() - start
+        for i, job in enumerate(jobs):
+            try:
+                psi = self.predictor.psi_average(mean[i:i+1], covariance[i:i+1], job.num_psi_samples, job.psi_mode)
+                search = self.predictor.beam_search(psi, job.beam_width, job.progress, job.budget)
+                job.started = time.time()
+                job.stats.beam_iterations += 1  # the last iteration of the search, which does not yield
+                active.append([job, psi, search, next(search)])
+            except StopIteration as e:
+                job.finish(result=e.value)
+            except Exception as e:
+                job.finish(error=e)
+
+    def _step(self, active):
+        # drop the searches of cancelled jobs
+        for (job, _, search, _) in active:
+            if job.cancelled:
+                search.close()
+                job.finish()
+        active[:] = [entry for entry in active if not entry[0].cancelled]
+        if len(active) == 0:
+            return
+
+        # run a single decoder call for the paths of all running searches, each path with the intent of its search
+        psis = np.concatenate([np.repeat(psi, len(paths), axis=0) for (_, psi, _, paths) in active])
+        paths = [path for (_, _, _, paths) in active for path in paths]
+        jobs = [job for (job, _, _, _) in active]
+        for job in jobs:
+            job.stats.beam_iterations += 1
+        for stats in self._stats(jobs):
+            stats.decoder_steps += 1
+        try:
+            with tracking(self._stats(jobs)):
+                dists = self.predictor.model.infer_ast_batch(self.predictor.sess, psis, paths,
+                                                              cache=self.predictor.state_cache)
+        except Exception as e:
+            for (job, _, _, _) in active:
+                job.finish(error=e)
+            del active[:]
+            return
+
+        running = []
+        offset = 0
+        for entry in active:
+            job, _, search, paths = entry
+            try:
+                entry[3] = search.send(dists[offset:offset + len(paths)])
+                job.flush()
+                running.append(entry)
+            except StopIteration as e:
+                job.finish(result=e.value)
+            except Exception as e:
+                job.finish(error=e)
+            offset += len(paths)
+        active[:] = running
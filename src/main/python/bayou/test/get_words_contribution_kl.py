@@ -75,12 +75,10 @@ def get(clargs):
             feed = {}
             feed[predictor.model.encoder.inputs[0].name] = batch
 
-            # two groups of tensors
-            # 'latent_size' list 'multi_outputs', each element (batch_size, max_words)
-            # 'latent_size' list 'latent_dims', each element (batch_size)
-            shared_list = sess.run(fetches=ev.softmax_outputs+ev.latent_dims, feed_dict=feed)
-            local_multi_outputs = shared_list[:latent_size]
-            local_latent_dims = shared_list[latent_size:]
+            # two tensors, stacked by latent dimension
+            # 'softmax_outputs', (latent_size, batch_size, max_words)
+            # 'latent_dims', (latent_size, batch_size)
+            local_multi_outputs, local_latent_dims = sess.run(fetches=[ev.softmax_outputs, ev.latent_dims], feed_dict=feed)
 
             for i in range(batch_size):
                 output = {}
@@ -33,8 +33,9 @@ def predict(clargs, sample_times=10, beam_width=30, beam_reserve_cut=15):
                 program_count += 1
                 print('current program 1-based index: %i' % program_count)
                 out_asts = []
+                psis = predictor.psi_samples_from_evidence(program, sample_times)
                 for i in range(sample_times):
-                    psi_batch = predictor.psi_from_evidence(program)
+                    psi_batch = psis[i:i+1]
                     the_psi = psi_batch[0]
                     print(the_psi)
                     asts = predictor.generate_asts_beam_search(psi_batch, beam_width=beam_width)
@@ -19,9 +19,8 @@ import json
 import math
 import random
 import numpy as np
-from itertools import chain
 
-import bayou.models.low_level_evidences.evidence
+from bayou.models.low_level_evidences.call_evidences import CallEvidences
 from bayou.models.low_level_evidences.utils import gather_calls
 
 HELP = """Use this script to extract evidences from a raw data file with sequences generated by driver.
@@ -35,6 +34,7 @@ def extract_evidence(clargs):
     print('done')
     done = 0
     programs = []
+    call_evidences = CallEvidences()  # programs share most of their calls, whose evidences are extracted once
     for program in js['programs']:
         sequences = program['sequences']
         if len(sequences) > clargs.max_seqs or \
@@ -43,12 +43,7 @@ def extract_evidence(clargs):
 
         calls = gather_calls(program['ast'])
 
-        apicalls = list(set(chain.from_iterable([bayou.models.low_level_evidences.evidence.APICalls.from_call(call)
-                                                 for call in calls])))
-        types = list(set(chain.from_iterable([bayou.models.low_level_evidences.evidence.Types.from_call(call)
-                                              for call in calls])))
-        keywords = list(set(chain.from_iterable([bayou.models.low_level_evidences.evidence.Keywords.from_call(call)
-                                                for call in calls])))
+        apicalls, types, keywords = [list(evidences) for evidences in call_evidences.evidences(calls)]
 
         if clargs.num_samples == 0:
             program['apicalls'] = apicalls
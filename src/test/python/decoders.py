@@ -0,0 +1,144 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+
+from bayou.models.low_level_evidences.infer import BayesianPredictor
+from bayou.models.low_level_evidences.model import Model
+from bayou.models.low_level_evidences.state_cache import DecoderStateCache
+
+
+class DecoderConfig(object):
+
+    def __init__(self, chars, num_layers):
+        self.chars = chars
+        self.vocab = dict(zip(chars, range(len(chars))))
+        self.vocab_size = len(chars)
+        self.num_layers = num_layers
+
+
+class Config(object):
+
+    def __init__(self, chars, num_layers, evidence=(), latent_size=2):
+        self.decoder = DecoderConfig(chars, num_layers)
+        self.evidence = list(evidence)
+        self.latent_size = latent_size
+
+
+class PrefixDecoder(object):
+    """
+    Decoder whose next token distribution is a function of the intent and of the (node, edge) prefix it has consumed,
+    for testing the inference of the lle model without a model. Its state is the id of the prefix, which is registered
+    when the prefix is first stepped. It counts its steps and the rows it stepped.
+
+    Its encoder reads the evidences as the model does, and the mean of psi is a pseudo-random function of the evidences
+    read (with a constant covariance). It records the number of sets of evidences of every run.
+    """
+    infer_ast_batch = Model.infer_ast_batch
+    infer_ast = Model.infer_ast
+    evidence_inputs = Model.evidence_inputs
+    evidence_inputs_batch = Model.evidence_inputs_batch
+
+    def __init__(self, chars, dist, num_layers=2, evidence=(), latent_size=2):
+        """
+        :param chars: the decoder vocabulary
+        :param dist: function of an intent (a single row) and a prefix (tuple of (node, edge)) to the next token
+                     distribution (over chars)
+        :param num_layers: number of decoder layers, each with the same state
+        :param evidence: the evidences read by the encoder
+        :param latent_size: size of psi
+        """
+        self.config = Config(chars, num_layers, evidence, latent_size)
+        self.dist = dist
+        self.prefixes = [()]
+        self.steps = 0
+        self.rows = 0
+        self.encoded = []
+
+    def infer_psi_params_batch(self, sess, evidences_list):
+        self.encoded.append(len(evidences_list))
+        inputs = self.evidence_inputs_batch(evidences_list)
+        mean = np.zeros([len(evidences_list), self.config.latent_size], dtype=np.float32)
+        for row in range(len(evidences_list)):
+            read = tuple(ev.key(inp[row]) for ev, inp in zip(self.config.evidence, inputs))
+            mean[row] = np.random.RandomState(abs(hash(read)) % (2 ** 32)).normal(size=self.config.latent_size)
+        return mean, np.full_like(mean, 0.25)
+
+    def infer_psi_params(self, sess, evidences):
+        return self.infer_psi_params_batch(sess, [evidences])
+
+    def infer_initial_state(self, sess, psis):
+        return [np.zeros([len(psis), 1]) for _ in range(self.config.decoder.num_layers)]
+
+    def infer_step(self, sess, psis, state, nodes, edges):
+        self.steps += 1
+        self.rows += len(nodes)
+        probs, ids = [], []
+        for psi, prefix_id, node, edge in zip(psis, state[0][:, 0], nodes, edges):
+            prefix = self.prefixes[int(prefix_id)] + ((node, edge),)
+            self.prefixes.append(prefix)
+            ids.append(len(self.prefixes) - 1)
+            probs.append(self.dist(psi, prefix))
+        ids = np.array(ids, dtype=np.float64).reshape(-1, 1)
+        return np.array(probs, dtype=np.float32), [ids for _ in range(self.config.decoder.num_layers)]
+
+
+def hashed_dist(num_chars):
+    """
+    Gets a next token distribution that is a pseudo-random function of the intent and prefix
+
+    :param num_chars: size of the vocabulary
+    :return: function of an intent and prefix to a distribution (see PrefixDecoder)
+    """
+    def dist(psi, prefix):
+        rng = np.random.RandomState(abs(hash((psi.tobytes(), prefix))) % (2 ** 32))
+        p = rng.rand(num_chars)
+        return p / p.sum()
+    return dist
+
+
+def evidence(cls, name, words):
+    """
+    Gets an evidence of a model with a vocabulary
+
+    :param cls: the class of the evidence
+    :param name: name of the evidence
+    :param words: the vocabulary
+    :return: the evidence
+    """
+    ev = cls()
+    ev.name = name
+    ev.tile = 1
+    ev.set_chars_vocab([words])
+    return ev
+
+
+def predictor(model, psi_cache=None):
+    """
+    Gets a BayesianPredictor of a model (e.g., a PrefixDecoder) without loading a saved one
+
+    :param model: the model
+    :param psi_cache: PsiCache of the predictor, or None
+    :return: the BayesianPredictor
+    """
+    bp = BayesianPredictor.__new__(BayesianPredictor)
+    bp.model = model
+    bp.sess = None
+    bp.save = None
+    bp._callmap = None
+    bp._call_evidences = None
+    bp.state_cache = DecoderStateCache()
+    bp.psi_cache = psi_cache
+    return bp
@@ -0,0 +1,93 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from collections import OrderedDict
+
+from bayou.models.low_level_evidences.evidence import APICalls
+from bayou.server.ast_server import _load_model, _load_predictor, _log_startup, _phase
+from decoders import PrefixDecoder, evidence, hashed_dist, predictor
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'main', 'python')
+
+
+# the modules of bayou.models (and of TensorFlow) that a fresh interpreter has loaded after running the code
+def loaded_modules(code):
+    script = '{}\nimport sys\nprint("\\n".join(m for m in sys.modules if m.startswith(("bayou.models", "tensorflow"))))'
+    return subprocess.check_output([sys.executable, '-c', script.format(code)], cwd=MAIN,
+                                   universal_newlines=True).split()
+
+
+class LazyStartupTest(unittest.TestCase):
+
+    def test_servers_do_not_import_the_inference_of_any_model_family(self):
+        modules = loaded_modules('import bayou.server.ast_server, bayou.server.async_ast_server')
+        self.assertEqual([m for m in modules if m.endswith('.infer') or m.startswith('tensorflow')], [])
+
+
+class StartupTimingTest(unittest.TestCase):
+
+    def test_phases_add_up_even_if_they_fail(self):
+        timings = OrderedDict()
+        with _phase(timings, 'import'):
+            pass
+        with self.assertRaises(ValueError), _phase(timings, 'model'):
+            raise ValueError()
+        with _phase(timings, 'import'):
+            pass
+        self.assertEqual(list(timings), ['import', 'model'])
+        self.assertTrue(all(seconds >= 0. for seconds in timings.values()))
+
+    def test_report_is_a_structured_record_of_the_phases(self):
+        timings = OrderedDict([('import', 1.), ('model', 2.5)])
+        with self.assertLogs(level='INFO') as logs:
+            _log_startup('loading model default from save', timings)
+        [record] = logs.records
+        self.assertEqual(record.getMessage(), 'loading model default from save took 3.50s (import 1.00s, model 2.50s)')
+        self.assertEqual(record.fields, {'startup': 'loading model default from save', 'seconds': 3.5,
+                                         'phases': timings})
+
+    def test_loading_a_preloaded_model_reports_its_warm_up(self):
+        model = PrefixDecoder(['DSubTree', 'STOP', 'a'], hashed_dist(3),
+                              evidence=[evidence(APICalls, 'apicalls', ['a'])])
+        params = {'num_psi_samples': 1, 'beam_width': 2, 'psi_mode': 'mean'}
+        with self.assertLogs(level='INFO') as logs:
+            hosted = _load_model(argparse.Namespace(), 'default', 'save', (None, predictor(model), params))
+        self.assertEqual([record.fields['phases'].keys() for record in logs.records if hasattr(record, 'fields')],
+                         [{'warm up'}])
+        self.assertEqual(hosted.search_params, params)
+        self.assertEqual(model.encoded, [1])
+
+    def test_config_is_timed_before_the_model_type_is_checked(self):
+        save_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(save_dir, 'config.json'), 'w') as f:
+                json.dump({'model': 'bogus'}, f)
+            timings = OrderedDict()
+            self.assertRaises(ValueError, _load_predictor, argparse.Namespace(), save_dir, None, timings)
+            self.assertEqual(list(timings), ['config'])
+        finally:
+            shutil.rmtree(save_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
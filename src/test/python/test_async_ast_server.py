@@ -0,0 +1,153 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import json
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from bayou.models.low_level_evidences.evidence import APICalls
+from bayou.server.async_ast_server import AsyncASTServer
+from bayou.server.model_host import HostedModel, ModelHost
+from decoders import PrefixDecoder, evidence, hashed_dist, predictor
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'DExcept', 'DLoop', 'a', 'b', 'c', 'd']
+SEARCH_PARAMS = {'num_psi_samples': 1, 'beam_width': 3, 'psi_mode': 'mean'}
+EVIDENCES = {'apicalls': ['a', 'b']}
+
+
+class SlowDecoder(PrefixDecoder):
+    """
+    PrefixDecoder whose steps take a while, so that a request is still searching when its client goes away
+    """
+    step_seconds = 0.05
+
+    def infer_step(self, sess, psis, state, nodes, edges):
+        time.sleep(self.step_seconds)
+        return super(SlowDecoder, self).infer_step(sess, psis, state, nodes, edges)
+
+
+def model():
+    return SlowDecoder(CHARS, hashed_dist(len(CHARS)), evidence=[evidence(APICalls, 'apicalls', ['a', 'b', 'c'])])
+
+
+# the number of steps the decoder runs for the search of the evidences
+def search_steps(js):
+    decoder = model()
+    predictor(decoder).infer(js, **SEARCH_PARAMS)
+    return decoder.steps
+
+
+# a generate asts request, as sent by a client
+def post(js):
+    body = json.dumps({'request type': 'generate asts', 'evidence': json.dumps(js)}).encode('utf-8')
+    return b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: ' + str(len(body)).encode('latin-1') + \
+        b'\r\n\r\n' + body
+
+
+def receive(sock):
+    data = b''
+    while True:
+        chunk = sock.recv(65536)
+        if len(chunk) == 0:
+            return data
+        data += chunk
+
+
+# runs a server of a SlowDecoder model in a thread on a free port of localhost
+class ServerTestCase(unittest.TestCase):
+
+    def start(self, server):
+        self.model = model()
+        hosted = HostedModel('default', 'test', predictor(self.model), SEARCH_PARAMS)
+        server.models.add('default', 'test', hosted)
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        self.port = listener.getsockname()[1]
+        listener.close()
+        self.server = server
+        self.thread = threading.Thread(target=server.serve_forever, args=('127.0.0.1', self.port))
+        self.thread.start()
+        for _ in range(100):  # until the server listens
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                return
+            except ConnectionError:
+                time.sleep(0.05)
+
+    def tearDown(self):
+        self.server.loop.call_soon_threadsafe(self.server.loop.stop)
+        self.thread.join()
+
+    def request(self, js, half_close=False):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        try:
+            sock.sendall(post(js))
+            if half_close:
+                sock.shutdown(socket.SHUT_WR)
+            head, _, body = receive(sock).partition(b'\r\n\r\n')
+        finally:
+            sock.close()
+        return head.split(b'\r\n')[0], body
+
+
+class AsyncASTServerTest(ServerTestCase):
+
+    def setUp(self):
+        self.start(AsyncASTServer(ModelHost(None)))
+
+    def test_stepwise_search_responds_with_the_asts_of_the_predictor(self):
+        status, body = self.request(EVIDENCES)
+        self.assertEqual(status, b'HTTP/1.1 200 OK')
+        expected = predictor(model()).infer(EVIDENCES, **SEARCH_PARAMS)
+        self.assertEqual(json.loads(body.decode('utf-8')), {'evidences': EVIDENCES, 'asts': expected})
+
+    def test_client_that_half_closes_its_connection_gets_the_response(self):
+        status, body = self.request(EVIDENCES, half_close=True)
+        self.assertEqual(status, b'HTTP/1.1 200 OK')
+        expected = predictor(model()).infer(EVIDENCES, **SEARCH_PARAMS)
+        self.assertEqual(json.loads(body.decode('utf-8')), {'evidences': EVIDENCES, 'asts': expected})
+
+    def test_client_that_resets_its_connection_cancels_the_search(self):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        sock.sendall(post(EVIDENCES))
+        while self.model.steps < 1:
+            time.sleep(0.01)
+        sock.close()  # resets the connection
+        steps = None
+        while steps != self.model.steps:  # until the search stops
+            steps = self.model.steps
+            time.sleep(10 * SlowDecoder.step_seconds)
+        self.assertLess(self.model.steps, search_steps(EVIDENCES))
+
+
+class AsyncASTServerTimeoutTest(ServerTestCase):
+
+    def setUp(self):
+        self.start(AsyncASTServer(ModelHost(None), request_timeout=3 * SlowDecoder.step_seconds))
+
+    def test_search_that_runs_out_of_time_is_cancelled(self):
+        status, body = self.request(EVIDENCES)
+        self.assertEqual(status, b'HTTP/1.1 503 Service Unavailable')
+        self.assertTrue(body.startswith(b'timed out after'))
+        self.assertLess(self.model.steps, search_steps(EVIDENCES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import argparse
+import json
+import unittest
+
+from bayou.models.low_level_evidences.evidence import APICalls
+from bayou.server.ast_server import _batch_request, _batch_response, _make_http_server, _stream_batch_results
+from bayou.server.model_host import HostedModel, ModelHost
+from decoders import PrefixDecoder, evidence, hashed_dist, predictor
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'DExcept', 'DLoop', 'a', 'b', 'c', 'd']
+SEARCH_PARAMS = {'num_psi_samples': 1, 'beam_width': 3, 'psi_mode': 'mean'}
+EVIDENCES = [{'apicalls': apicalls} for apicalls in [['a'], ['b'], ['a', 'c'], ['b', 'c'], ['a', 'b']]]
+
+
+def model():
+    return PrefixDecoder(CHARS, hashed_dist(len(CHARS)), evidence=[evidence(APICalls, 'apicalls', ['a', 'b', 'c'])])
+
+
+class BatchRequestTest(unittest.TestCase):
+
+    def test_evidences_are_objects_or_strings_of_them(self):
+        evidences_list, params = _batch_request({'evidences': [EVIDENCES[0], json.dumps(EVIDENCES[1])]})
+        self.assertEqual(evidences_list, EVIDENCES[:2])
+        self.assertEqual(params, {})
+
+    def test_search_parameters_override_those_of_the_server(self):
+        _, params = _batch_request({'evidences': [], 'search parameters': {'beam_width': 7}}, SEARCH_PARAMS)
+        self.assertEqual(params, dict(SEARCH_PARAMS, beam_width=7))
+        self.assertEqual(SEARCH_PARAMS['beam_width'], 3)
+
+    def test_invalid_search_parameter(self):
+        self.assertRaises(ValueError, _batch_request, {'evidences': [], 'search parameters': {'bogus': 1}},
+                          SEARCH_PARAMS)
+
+    def test_response_is_in_the_order_of_the_evidences(self):
+        results = [(1, ['b']), (0, ['a'])]
+        self.assertEqual(json.loads(_batch_response(EVIDENCES[:2], results)),
+                         {'results': [{'evidences': EVIDENCES[0], 'asts': ['a']},
+                                      {'evidences': EVIDENCES[1], 'asts': ['b']}]})
+
+    def test_stream_is_in_the_order_results_are_done(self):
+        lines = list(_stream_batch_results(EVIDENCES[:2], iter([(1, ['b']), (0, ['a'])])))
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'index': 1, 'evidences': EVIDENCES[1], 'asts': ['b']},
+                          {'index': 0, 'evidences': EVIDENCES[0], 'asts': ['a']},
+                          {'done': True, 'count': 2}])
+        self.assertTrue(all(line.endswith('\n') and line.count('\n') == 1 for line in lines))
+
+
+class InferBatchTest(unittest.TestCase):
+
+    def test_every_item_has_the_asts_of_infer(self):
+        expected = [predictor(model()).infer(js, **SEARCH_PARAMS) for js in EVIDENCES]
+        decoder = model()
+        results = list(predictor(decoder).infer_batch(EVIDENCES, max_batch=2, **SEARCH_PARAMS))
+        self.assertEqual(sorted(i for i, _ in results), list(range(len(EVIDENCES))))
+        self.assertEqual([asts for _, asts in sorted(results, key=lambda result: result[0])], expected)
+        # the first items are encoded together, and the others as items finish
+        self.assertEqual(decoder.encoded[0], 2)
+        self.assertEqual(sum(decoder.encoded), len(EVIDENCES))
+
+
+class BatchEndpointTest(unittest.TestCase):
+
+    def setUp(self):
+        models = ModelHost(None)
+        models.add('default', 'test', HostedModel('default', 'test', predictor(model()), SEARCH_PARAMS))
+        args = argparse.Namespace(max_bulk_batch=2, deadline=0, max_steps=0)
+        self.client = _make_http_server(models, args).test_client()
+        self.expected = [predictor(model()).infer(js, **SEARCH_PARAMS) for js in EVIDENCES]
+
+    def post(self, **request):
+        request = dict(request, **{'request type': 'generate asts batch', 'evidences': EVIDENCES})
+        return self.client.post('/', data=json.dumps(request))
+
+    def test_response(self):
+        response = self.post()
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(json.loads(response.get_data(as_text=True)),
+                         {'results': [{'evidences': js, 'asts': asts} for js, asts in zip(EVIDENCES, self.expected)]})
+
+    def test_stream(self):
+        response = self.post(stream=True)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(records[-1], {'done': True, 'count': len(EVIDENCES)})
+        self.assertEqual(sorted((record['index'], record['evidences'] == EVIDENCES[record['index']], record['asts'])
+                                for record in records[:-1]),
+                         [(i, True, asts) for i, asts in enumerate(self.expected)])
+
+    def test_invalid_search_parameter(self):
+        self.assertEqual(self.post(**{'search parameters': {'bogus': 1}}).status_code, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.state_cache import DecoderStateCache
+from bayou.models.low_level_evidences.utils import CHILD_EDGE, SIBLING_EDGE
+from decoders import PrefixDecoder, hashed_dist
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'a', 'b', 'c']
+
+
+class BatchedDecoderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = PrefixDecoder(CHARS, hashed_dist(len(CHARS)))
+        self.psi = np.array([[0.5, -1.]], dtype=np.float32)
+
+    def path(self, *nodes):
+        return [('DSubTree',) + nodes, (CHILD_EDGE,) + (SIBLING_EDGE,) * len(nodes)]
+
+    def test_batch_matches_paths_decoded_one_at_a_time(self):
+        paths = [self.path('a', 'b'), self.path('a', 'c'), self.path(), self.path('b', 'DBranch', 'a')]
+        dists = self.decoder.infer_ast_batch(None, self.psi, paths)
+        for (nodes, edges), dist in zip(paths, dists):
+            expected = self.decoder.dist(self.psi[0], tuple(zip(nodes, edges)))
+            np.testing.assert_allclose(dist, expected, rtol=1e-6)
+
+    def test_shared_prefixes_are_stepped_once(self):
+        # DSubTree, then a, then b and c in one batched step
+        self.decoder.infer_ast_batch(None, self.psi, [self.path('a', 'b'), self.path('a', 'c')])
+        self.assertEqual((self.decoder.steps, self.decoder.rows), (3, 4))
+
+    def test_cached_prefixes_are_not_stepped_again(self):
+        cache = DecoderStateCache()
+        self.decoder.infer_ast_batch(None, self.psi, [self.path('a', 'b')], cache=cache)
+        steps = self.decoder.steps
+        dists = self.decoder.infer_ast_batch(None, self.psi, [self.path('a', 'b'), self.path('a', 'b', 'c')],
+                                             cache=cache)
+        self.assertEqual(self.decoder.steps, steps + 1)
+        np.testing.assert_allclose(dists[1], self.decoder.dist(self.psi[0], tuple(zip(*self.path('a', 'b', 'c')))),
+                                   rtol=1e-6)
+
+    def test_rows_of_different_intents(self):
+        psis = np.array([[0., 1.], [1., 0.]], dtype=np.float32)
+        path = self.path('a')
+        dists = self.decoder.infer_ast_batch(None, psis, [path, path])
+        for psi, dist in zip(psis, dists):
+            np.testing.assert_allclose(dist, self.decoder.dist(psi, tuple(zip(*path))), rtol=1e-6)
+        self.assertFalse(np.allclose(dists[0], dists[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
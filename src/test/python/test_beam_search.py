@@ -0,0 +1,124 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.infer import BeamHeap, PathState, SearchBudget
+from decoders import PrefixDecoder, hashed_dist, predictor
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'DExcept', 'DLoop', 'a', 'b', 'c', 'd']
+
+
+def search(bp, beam_width, budget=None):
+    steps = bp.beam_search_steps(np.zeros([1, 2], dtype=np.float32), beam_width, budget=budget)
+    for _ in steps:
+        pass
+    return steps
+
+
+class BeamHeapTest(unittest.TestCase):
+
+    def test_keeps_most_likely_candidates_in_order(self):
+        beam = BeamHeap(2)
+        for fingerprint, log_pr in [('a', -3.), ('b', -1.), ('c', -2.), ('d', -5.)]:
+            beam.push(fingerprint, [fingerprint], log_pr)
+        self.assertEqual(beam.candidates(), [(['b'], -1.), (['c'], -2.)])
+        self.assertEqual(beam.fingerprints, {'b', 'c'})
+
+    def test_admits(self):
+        beam = BeamHeap(1)
+        self.assertTrue(beam.admits(-10.))
+        beam.push('a', ['a'], -1.)
+        self.assertFalse(beam.admits(-1.))
+        self.assertTrue(beam.admits(-0.5))
+
+    def test_duplicates_are_pushed_once(self):
+        beam = BeamHeap(3)
+        beam.push('a', ['a'], -1.)
+        beam.push('a', ['a'], -1.)
+        self.assertEqual(len(beam.candidates()), 1)
+
+    def test_ties_favor_the_first_candidate(self):
+        beam = BeamHeap(1)
+        beam.push('a', ['a'], -1.)
+        beam.push('b', ['b'], -1.)
+        self.assertEqual(beam.candidates(), [(['a'], -1.)])
+
+    def test_evicted_candidates_can_enter_again(self):
+        beam = BeamHeap(1)
+        beam.push('a', ['a'], -2.)
+        beam.push('b', ['b'], -1.)
+        beam.push('a', ['a'], -0.5)
+        self.assertEqual(beam.candidates(), [(['a'], -0.5)])
+
+
+class BeamSearchTest(unittest.TestCase):
+
+    def test_asts_are_complete_unique_and_ordered(self):
+        bp = predictor(PrefixDecoder(CHARS, hashed_dist(len(CHARS))))
+        asts = search(bp, 5).result
+        self.assertEqual(len(asts), 5)
+        probabilities = [float(ast['probability']) for ast in asts]
+        self.assertEqual(probabilities, sorted(probabilities, reverse=True))
+        self.assertEqual(len(set(repr(ast['ast']) for ast in asts)), 5)
+        for ast in asts:
+            self.assertEqual(ast['ast']['node'], 'DSubTree')
+
+    def test_most_likely_ast(self):
+        # STOP is by far the most likely token after a call, and a is after DSubTree and the calls other than a
+        def dist(psi, prefix):
+            p = np.full(len(CHARS), 0.01)
+            p[CHARS.index('STOP' if prefix[-1][0] == 'a' else 'a')] = 1.
+            return p / p.sum()
+        asts = search(predictor(PrefixDecoder(CHARS, dist)), 3).result
+        self.assertEqual(asts[0]['ast'], {'node': 'DSubTree', '_nodes': [{'node': 'DAPICall', '_call': 'a'}]})
+
+
+
+class SearchBudgetTest(unittest.TestCase):
+
+    def test_expired(self):
+        self.assertFalse(SearchBudget().expired(1000))
+        self.assertFalse(SearchBudget(steps=3).expired(2))
+        self.assertTrue(SearchBudget(steps=3).expired(3))
+        budget = SearchBudget(seconds=0.05)
+        self.assertFalse(budget.expired())
+        time.sleep(0.1)
+        self.assertTrue(budget.expired())
+
+    def test_generous_budget_does_not_change_the_search(self):
+        decoder = PrefixDecoder(CHARS, hashed_dist(len(CHARS)))
+        budget = SearchBudget(seconds=60., steps=1000)
+        self.assertEqual(search(predictor(decoder), 4, budget).result, search(predictor(decoder), 4).result)
+        self.assertEqual(budget.truncated, 0)
+
+    def test_out_of_budget_completes_candidates_greedily(self):
+        decoder = PrefixDecoder(CHARS, hashed_dist(len(CHARS)))
+        for steps in [0, 1, 3]:
+            budget = SearchBudget(steps=steps)
+            truncated = search(predictor(decoder), 4, budget)
+            self.assertEqual(budget.truncated, 1)
+            # every path of a candidate is extended at every greedy step, and is at most MAX_LENGTH long
+            self.assertLessEqual(truncated.steps, steps + PathState.MAX_LENGTH)
+            self.assertGreater(len(truncated.result), 0)
+            for ast in truncated.result:
+                self.assertEqual(ast['ast']['node'], 'DSubTree')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import shutil
+import tempfile
+import unittest
+
+from bayou.models.low_level_evidences.call_evidences import CallEvidences
+from bayou.models.low_level_evidences.evidence import APICalls, Types, Keywords
+
+READ_LINE = {'_call': 'java.io.BufferedReader.readLine()'}
+ADD = {'_call': 'java.util.ArrayList<java.lang.String>.add(java.lang.String)'}
+
+
+class CallEvidencesTest(unittest.TestCase):
+
+    def test_lookup_extracts_the_evidences_of_a_call_once(self):
+        call_evidences = CallEvidences()
+        evidences = call_evidences.lookup(READ_LINE)
+        self.assertEqual(evidences, (frozenset(APICalls.from_call(READ_LINE)), frozenset(Types.from_call(READ_LINE)),
+                                     frozenset(Keywords.from_call(READ_LINE))))
+        self.assertIn('readLine', evidences[0])
+        self.assertIn('BufferedReader', evidences[1])
+        self.assertIs(call_evidences.lookup(dict(READ_LINE)), evidences)
+        self.assertEqual(list(call_evidences.index), [READ_LINE['_call']])
+
+    def test_evidences_are_the_union_of_those_of_the_calls(self):
+        call_evidences = CallEvidences()
+        apicalls, types, keywords = call_evidences.evidences([READ_LINE, ADD, READ_LINE])
+        read_line, add = call_evidences.lookup(READ_LINE), call_evidences.lookup(ADD)
+        self.assertEqual(apicalls, read_line[0] | add[0])
+        self.assertEqual(types, read_line[1] | add[1])
+        self.assertEqual(keywords, read_line[2] | add[2])
+        self.assertEqual(call_evidences.evidences([]), (set(), set(), set()))
+
+    def test_save_and_load(self):
+        save = tempfile.mkdtemp()
+        try:
+            self.assertEqual(CallEvidences.load(save).index, dict())
+            call_evidences = CallEvidences.from_calls([READ_LINE, ADD])
+            call_evidences.save(save)
+            self.assertEqual(CallEvidences.load(save).index, call_evidences.index)
+        finally:
+            shutil.rmtree(save)
+
+
+if __name__ == '__main__':
+    unittest.main()
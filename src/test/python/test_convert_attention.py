@@ -0,0 +1,94 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.convert_attention import convert_variables
+
+HEADS, UNITS = 4, 3
+SLOTS = ['', '/Adam', '/Adam_1']
+
+
+def dense(n):
+    return 'dense' if n == 0 else 'dense_{}'.format(n)
+
+
+# the variables of a checkpoint with an attention scope per head: dense..dense_2 compute the softmax input and
+# dense_3..dense_5 the non-softmax input
+def per_head_variables(rng, weights='kernel', biases='bias'):
+    variables = {'mean/javadoc/sigma': np.float32(1.), 'mean/javadoc/embeddings': rng.rand(5, 2)}
+    for i in range(HEADS):
+        for n in range(6):
+            out = 1 if n % 3 == 2 else 2 * UNITS
+            for slot in SLOTS:
+                scope = 'mean/javadoc/encoder_attention_{}/{}/'.format(i, dense(n))
+                variables[scope + weights + slot] = rng.rand(2 * UNITS, out)
+                variables[scope + biases + slot] = rng.rand(out)
+    return variables
+
+
+class ConvertAttentionTest(unittest.TestCase):
+
+    def test_maps_heads_to_fused_variables(self):
+        converted = convert_variables(per_head_variables(np.random.RandomState(0)))
+        self.assertEqual(set(converted), {'mean/javadoc/sigma', 'mean/javadoc/embeddings'} | {
+            'mean/javadoc/{}{}/{}{}'.format(branch, k, name, slot) for branch in ['softmax', 'non_softmax']
+            for k in range(3) for name in ['kernel', 'bias'] for slot in SLOTS})
+        self.assertEqual(converted['mean/javadoc/softmax2/kernel'].shape, (HEADS, 2 * UNITS, 1))
+        self.assertEqual(converted['mean/javadoc/non_softmax1/bias/Adam'].shape, (HEADS, 2 * UNITS))
+
+    def test_stacks_heads_in_order(self):
+        variables = per_head_variables(np.random.RandomState(0), weights='weights', biases='biases')
+        converted = convert_variables(variables)
+        for i in range(HEADS):
+            np.testing.assert_array_equal(converted['mean/javadoc/non_softmax2/kernel/Adam_1'][i],
+                                          variables['mean/javadoc/encoder_attention_{}/dense_5/weights/Adam_1'
+                                                    .format(i)])
+            np.testing.assert_array_equal(converted['mean/javadoc/softmax0/bias'][i],
+                                          variables['mean/javadoc/encoder_attention_{}/dense/biases'.format(i)])
+
+    def test_fused_heads_compute_the_per_head_layers(self):
+        rng = np.random.RandomState(0)
+        variables = per_head_variables(rng)
+        converted = convert_variables(variables)
+        x = rng.rand(2, 5, 2 * UNITS)
+        for branch, first in [('softmax', 0), ('non_softmax', 3)]:
+            fused = x[None]
+            for k in range(3):
+                kernel = converted['mean/javadoc/{}{}/kernel'.format(branch, k)]
+                bias = converted['mean/javadoc/{}{}/bias'.format(branch, k)]
+                fused = np.einsum('hbtd,hde->hbte', np.broadcast_to(fused, (HEADS,) + fused.shape[1:]), kernel) + \
+                    bias[:, None, None]
+                fused = np.tanh(fused) if k < 2 else fused
+            for i in range(HEADS):
+                head = x
+                for k in range(3):
+                    scope = 'mean/javadoc/encoder_attention_{}/{}/'.format(i, dense(first + k))
+                    head = head.dot(variables[scope + 'kernel']) + variables[scope + 'bias']
+                    head = np.tanh(head) if k < 2 else head
+                np.testing.assert_allclose(fused[i], head)
+
+    def test_misnumbered_heads(self):
+        variables = per_head_variables(np.random.RandomState(0))
+        variables['mean/javadoc/encoder_attention_9/dense/kernel'] = \
+            variables.pop('mean/javadoc/encoder_attention_2/dense/kernel')
+        with self.assertRaises(ValueError):
+            convert_variables(variables)
+
+
+if __name__ == '__main__':
+    unittest.main()
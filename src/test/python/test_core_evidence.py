@@ -0,0 +1,70 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from bayou.models.embedding_store import EmbeddingStore
+
+try:  # core models run in TensorFlow, and their evidences need scikit-learn
+    import tensorflow as tf
+    from bayou.models.core.evidence import Javadoc
+except ImportError:
+    tf = None
+
+
+@unittest.skipIf(tf is None, 'requires TensorFlow and scikit-learn')
+class JavadocEmbeddingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.save = tempfile.mkdtemp()
+        self.embed_save_dir = os.path.join(self.save, 'embed_javadoc')
+        os.makedirs(self.embed_save_dir)
+        embedding = np.random.RandomState(0).rand(4, 3).astype(np.float32)
+        with tf.Graph().as_default(), tf.Session() as sess:
+            variable = tf.Variable(embedding, name='embedding')
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver({'embedding': variable}).save(sess, os.path.join(self.embed_save_dir, 'model'))
+        with open(os.path.join(self.embed_save_dir, 'config.json'), 'w') as f:
+            json.dump({'chars': ['read', 'a', 'file', 'line'], 'vocab_size': 4, 'embedding_size': 3}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.save)
+
+    def load_embedding(self):
+        javadoc = Javadoc('1', 10, [2], 4)
+        with tf.Graph().as_default():
+            javadoc.load_embedding(self.save)
+        return javadoc.final_embedding
+
+    def test_restored_and_stored_embeddings_are_the_same(self):
+        restored = self.load_embedding()  # from the checkpoint, and saved to the store
+        self.assertTrue(EmbeddingStore.exists(os.path.join(self.embed_save_dir, 'embedding')))
+        stored = self.load_embedding()
+        self.assertIsInstance(stored, np.memmap)
+        self.assertEqual(restored.dtype, np.float32)
+        self.assertEqual(stored.dtype, restored.dtype)
+        np.testing.assert_array_equal(stored, restored)
+        np.testing.assert_array_equal(restored[0], 0.)  # the padding character
+        np.testing.assert_allclose(np.linalg.norm(restored[1:], axis=1), 1., rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
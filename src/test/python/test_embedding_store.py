@@ -0,0 +1,118 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import glob
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from bayou.models.embedding_store import EmbeddingStore
+
+
+class EmbeddingStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.text = os.path.join(self.dir, 'glove.txt')
+        self.write_text(['the 0.1 0.2 0.3', 'café 1 2 3'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_text(self, lines, mtime=None):
+        with open(self.text, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        if mtime is not None:
+            os.utime(self.text, (mtime, mtime))
+
+    def test_save_and_load_memory_maps_vectors(self):
+        store = os.path.join(self.dir, 'store')
+        EmbeddingStore(['a', 'b'], np.arange(6).reshape(2, 3)).save(store)
+        embeddings = EmbeddingStore.load(store)
+        self.assertEqual(embeddings.words, ['a', 'b'])
+        self.assertIsInstance(embeddings.vectors, np.memmap)
+        self.assertEqual(embeddings.vectors.dtype, np.float32)
+        np.testing.assert_array_equal(embeddings.vectors, np.arange(6).reshape(2, 3))
+
+    def test_save_replaces_previous_vectors(self):
+        store = os.path.join(self.dir, 'store')
+        EmbeddingStore(['a'], np.zeros((1, 2))).save(store)
+        EmbeddingStore(['a', 'b'], np.ones((2, 2))).save(store)
+        self.assertEqual(len(glob.glob(store + '.*.npy')), 1)
+        self.assertEqual(EmbeddingStore.load(store).words, ['a', 'b'])
+
+    def test_open_converts_text_with_unk(self):
+        embeddings = EmbeddingStore.open(self.text, unk='<unk>')
+        self.assertEqual(embeddings.words, ['<unk>', 'the', 'café'])
+        self.assertIsInstance(embeddings.vectors, np.memmap)
+        np.testing.assert_allclose(embeddings.vectors[1:], [[0.1, 0.2, 0.3], [1, 2, 3]])
+        # the store is loaded as it is, with the same <unk> vector, until the text changes
+        np.testing.assert_array_equal(EmbeddingStore.open(self.text, unk='<unk>').vectors, embeddings.vectors)
+        self.write_text(['a 5 5 5'], mtime=time.time() + 10)
+        self.assertEqual(EmbeddingStore.open(self.text, unk='<unk>').words, ['<unk>', 'a'])
+
+    def test_open_converts_again_without_unk(self):
+        EmbeddingStore.open(self.text)
+        self.assertEqual(EmbeddingStore.open(self.text, unk='<unk>').words[0], '<unk>')
+
+    def test_open_store_without_text(self):
+        EmbeddingStore.open(self.text)
+        os.remove(self.text)
+        self.assertEqual(EmbeddingStore.open(self.text).words, ['the', 'café'])
+        self.assertRaises(ValueError, EmbeddingStore.open, self.text, '<unk>')
+
+    def test_is_fresh(self):
+        store = os.path.join(self.dir, 'store')
+        self.assertFalse(EmbeddingStore.is_fresh(store, self.text))
+        EmbeddingStore(['a'], np.zeros((1, 2))).save(store)
+        self.assertTrue(EmbeddingStore.is_fresh(store, self.text))
+        os.utime(self.text, (time.time() + 10, time.time() + 10))
+        self.assertFalse(EmbeddingStore.is_fresh(store, self.text))
+
+    def test_concurrent_loads_see_matching_words_and_vectors(self):
+        # the words of every save are their vectors, which differ from those of any other save
+        store = os.path.join(self.dir, 'store')
+        EmbeddingStore(['0'], np.zeros((1, 1))).save(store)
+        stop, errors = threading.Event(), []
+
+        def save():
+            for i in range(200):
+                values = np.arange(1 + i % 5) + 10 * (i + 1)
+                EmbeddingStore([str(v) for v in values], values.reshape(-1, 1)).save(store)
+            stop.set()
+
+        def load():
+            try:
+                while not stop.is_set():
+                    embeddings = EmbeddingStore.load(store)
+                    self.assertEqual(embeddings.words, [str(int(v)) for v in embeddings.vectors[:, 0]])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=save)] + [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
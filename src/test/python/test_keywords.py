@@ -0,0 +1,84 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bayou.models.low_level_evidences.evidence import Keywords
+
+
+# a WordNet lemmatizer that records the words it is asked for, or fails as without the WordNet data
+def wordnet(lemmas, calls, available=True):
+    def lemmatize(word):
+        calls.append(word)
+        if not available:
+            raise LookupError('Resource wordnet not found')
+        return lemmas.get(word, word)
+    return lemmatize
+
+
+class LemmaTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.save = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.save)
+
+    def test_training_lemmatizes_every_word_once(self):
+        keywords, calls = Keywords(), []
+        keywords.wordnet_lemmatize = wordnet({'reading': 'read'}, calls)
+        self.assertEqual(keywords.lemmatize('reading'), 'read')
+        self.assertEqual(keywords.lemmatize('reading'), 'read')
+        self.assertEqual(keywords.lemmatize('file'), 'file')
+        self.assertEqual(calls, ['reading', 'file'])
+        self.assertEqual(keywords.lemmas, {'reading': 'read', 'file': 'file'})
+
+    def test_save_and_load(self):
+        keywords = Keywords()
+        keywords.lemmas = {'reading': 'read', 'files': 'file', 'file': 'file'}
+        keywords.save_lemmas(self.save)
+        with open(os.path.join(self.save, Keywords.LEMMAS_FILE)) as f:
+            self.assertEqual(json.load(f), {'words': ['file'], 'lemmas': {'reading': 'read', 'files': 'file'}})
+        loaded = Keywords()
+        loaded.load_lemmas(self.save)
+        self.assertEqual(loaded.lemmas, keywords.lemmas)
+
+    def test_inference_looks_up_the_table_before_wordnet(self):
+        keywords = Keywords()
+        keywords.lemmas = {'reading': 'read', 'file': 'file'}
+        keywords.save_lemmas(self.save)
+        loaded, calls = Keywords(), []
+        loaded.load_lemmas(self.save)
+        loaded.wordnet_lemmatize = wordnet({'writing': 'write'}, calls)
+        self.assertEqual([loaded.lemmatize(w) for w in ['reading', 'file', 'writing', 'writing']],
+                         ['read', 'file', 'write', 'write'])
+        self.assertEqual(calls, ['writing'])
+        self.assertNotIn('writing', loaded.lemmas)  # the table does not grow at inference
+
+    def test_unseen_words_are_their_own_lemmas_without_wordnet(self):
+        keywords, calls = Keywords(), []
+        keywords.load_lemmas(self.save)  # a model saved without a table
+        keywords.wordnet_lemmatize = wordnet({}, calls, available=False)
+        self.assertEqual(keywords.lemmatize('writing'), 'writing')
+        self.assertEqual(keywords.lemmatize('writing'), 'writing')
+        self.assertEqual(calls, ['writing'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from bayou.server.metrics import Counter, Histogram, ServerMetrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter_renders_labels(self):
+        counter = Counter('requests_total', 'Requests.', ['type'])
+        counter.inc(type='generate "asts"')
+        counter.inc(2, type='generate "asts"')
+        self.assertEqual(counter.render(), ['# HELP requests_total Requests.', '# TYPE requests_total counter',
+                                            'requests_total{type="generate \\"asts\\""} 3.0'])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('seconds', 'Seconds.', buckets=(1., 2.))
+        for value in [0.5, 1.5, 3.]:
+            histogram.observe(value)
+        self.assertEqual(histogram.render()[2:], ['seconds_bucket{le="1.0"} 1', 'seconds_bucket{le="2.0"} 2',
+                                                  'seconds_bucket{le="+Inf"} 3', 'seconds_sum 5.0',
+                                                  'seconds_count 3'])
+
+    def test_server_metrics_render_without_and_with_models(self):
+        metrics = ServerMetrics()
+        self.assertNotIn('bayou_model_version{', metrics.render())
+        metrics.add_models(lambda: {'default': 2})
+        metrics.add_cache('default/response', lambda: {'default/response': (3, 1)})
+        with metrics.request('generate asts'):
+            pass
+        rendered = metrics.render()
+        self.assertIn('bayou_model_version{model="default"} 2.0', rendered)
+        self.assertIn('bayou_cache_hit_ratio{cache="default/response"} 0.75', rendered)
+        self.assertIn('bayou_requests_total{type="generate asts"} 1.0', rendered)
+
+    def test_cache_counts_are_counters(self):
+        metrics = ServerMetrics()
+        counts = {'default/response': (3, 1)}
+        metrics.add_cache('default/response', lambda: counts)
+        rendered = metrics.render()
+        self.assertIn('# TYPE bayou_cache_hits_total counter\nbayou_cache_hits_total{cache="default/response"} 3.0',
+                      rendered)
+        self.assertIn('# TYPE bayou_cache_misses_total counter\nbayou_cache_misses_total{cache="default/response"} 1.0',
+                      rendered)
+        self.assertIn('# TYPE bayou_cache_hit_ratio gauge', rendered)
+        counts['default/response'] = (5, 1)  # collected when rendered
+        self.assertIn('bayou_cache_hits_total{cache="default/response"} 5.0', metrics.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import signal
+import threading
+import time
+import unittest
+
+from bayou.server.model_host import HostedModel, ModelHost
+
+
+def wait_for(condition, timeout=5.):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class ModelHostTest(unittest.TestCase):
+
+    def setUp(self):
+        self.closed = []
+        self.models = ModelHost(lambda name, save_dir: HostedModel(name, save_dir, object(), {},
+                                                                   close=lambda: self.closed.append(name)))
+        self.models.add('a', 'dir_a')
+        self.models.add('b', 'dir_b')
+
+    def test_reload_swaps_in_new_version_and_closes_old_one_when_unused(self):
+        with self.models.use('a') as old:
+            self.assertEqual(self.models.reload('a'), ['a'])
+            self.assertTrue(wait_for(lambda: self.models.versions()['a'] == 2))
+            self.assertEqual(self.closed, [])
+        self.assertIsNot(self.models.get('a'), old)
+        self.assertEqual(self.closed, ['a'])
+        self.assertEqual(self.models.versions()['b'], 1)
+
+    def test_failed_reload_keeps_current_version(self):
+        def fail(name, save_dir):
+            raise IOError('no checkpoint')
+        self.models.load = fail
+        self.models.reload('a')
+        self.assertTrue(wait_for(lambda: len(self.models.reloading) == 0))
+        self.assertEqual(self.models.versions(), {'a': 1, 'b': 1})
+
+    @unittest.skipUnless(hasattr(signal, 'SIGHUP'), 'requires SIGHUP')
+    def test_signal_while_holding_the_lock_reloads_after_release(self):
+        reload = threading.Event()
+        self.models.reload_on(reload)
+        previous = signal.signal(signal.SIGHUP, lambda signum, frame: reload.set())
+        try:
+            # the signal arrives while the main thread holds the lock, e.g., while it serves a request
+            with self.models.lock:
+                os.kill(os.getpid(), signal.SIGHUP)
+                time.sleep(0.05)
+            self.assertTrue(wait_for(lambda: self.models.versions() == {'a': 2, 'b': 2}))
+        finally:
+            signal.signal(signal.SIGHUP, previous)
+
+
+if __name__ == '__main__':
+    unittest.main()
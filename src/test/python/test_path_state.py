@@ -0,0 +1,185 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.infer import BayesianPredictor, PathState, TooLongPathError, \
+    InvalidSketchError
+from bayou.models.low_level_evidences.utils import CHILD_EDGE, SIBLING_EDGE
+
+NODES = ['STOP', 'DBranch', 'DExcept', 'DLoop', 'DSubTree', 'a', 'b', 'c', 'd', 'e', 'f']
+
+
+# the parser that PathState replaces, which parses a whole path at once
+class IncompletePathError(Exception):
+    pass
+
+
+def consume_until_STOP(path, idx, check_call=False):
+    if idx >= len(path):
+        raise IncompletePathError
+    while path[idx][0] != 'STOP':
+        node, edge = path[idx]
+        if check_call:
+            if node in ['DBranch', 'DExcept', 'DLoop', 'DSubTree']:
+                raise InvalidSketchError
+            idx += 1
+            if idx >= len(path):
+                raise IncompletePathError
+            continue
+        if edge == SIBLING_EDGE:
+            idx += 1
+            if idx >= len(path):
+                raise IncompletePathError
+            continue
+        if node == 'DBranch':
+            idx = consume_until_STOP(path, idx + 1, check_call=True)
+            if idx > 0:
+                idx = consume_until_STOP(path, idx + 1)
+                if idx > 0:
+                    consume_until_STOP(path, idx + 1)
+            return -1
+        elif node == 'DExcept':
+            idx = consume_until_STOP(path, idx + 1)
+            if idx > 0:
+                consume_until_STOP(path, idx + 1)
+            return -1
+        elif node == 'DLoop':
+            idx = consume_until_STOP(path, idx + 1, check_call=True)
+            if idx > 0:
+                consume_until_STOP(path, idx + 1)
+            return -1
+        else:
+            raise ValueError('Invalid node/edge: ' + str((node, edge)))
+    return idx
+
+
+def is_complete_path(path):
+    try:
+        if len(path) > 30:
+            raise TooLongPathError
+        nodes = [node for (node, edge) in path]
+        if nodes.count('DBranch') > 2 or nodes.count('DLoop') > 2 or nodes.count('DExcept') > 2:
+            raise TooLongPathError
+        calls = [call for (call, edge) in path if call not in ['DSubTree', 'DBranch', 'DLoop', 'DExcept', 'STOP']]
+        for call in calls:
+            if nodes.count(call) > 1:
+                raise TooLongPathError
+        consume_until_STOP(path, 1)
+        return True
+    except IncompletePathError:
+        return False
+
+
+def outcome(is_complete, path):
+    try:
+        return is_complete(path)
+    except (TooLongPathError, InvalidSketchError) as e:
+        return type(e)
+
+
+# a random path as the beam search makes them: DBranch, DExcept and DLoop take either edge, other nodes the sibling edge
+def random_path(rng, length):
+    path = [('DSubTree', CHILD_EDGE)]
+    for _ in range(length):
+        node = rng.choice(NODES)
+        edge = rng.choice([CHILD_EDGE, SIBLING_EDGE]) if node in PathState.NODES else SIBLING_EDGE
+        path.append((node, edge))
+    return path
+
+
+class PathStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.predictor = BayesianPredictor.__new__(BayesianPredictor)
+
+    def test_matches_whole_path_parser_on_random_paths(self):
+        rng = random.Random(0)
+        outcomes = set()
+        for _ in range(20000):
+            path = random_path(rng, rng.randint(0, 35))
+            expected = outcome(is_complete_path, path)
+            self.assertEqual(outcome(self.predictor.is_complete_path, path), expected, path)
+            outcomes.add(expected)
+        self.assertEqual(outcomes, {True, False, TooLongPathError, InvalidSketchError})
+
+    def test_prefixes_match_whole_path_parser(self):
+        # the states of the prefixes of a path, as the beam search keeps them, parse every prefix
+        rng = random.Random(1)
+        for _ in range(2000):
+            path = random_path(rng, rng.randint(0, 35))
+            state = PathState()
+            for i in range(1, len(path) + 1):
+                if i > 1:
+                    state = state.step(*path[i - 1])
+                expected = outcome(is_complete_path, path[:i])
+                actual = state.error if state.error is not None else state.complete
+                self.assertEqual(actual, expected, path[:i])
+
+    def test_blocks(self):
+        state = PathState()
+        for node, edge in [('DBranch', CHILD_EDGE), ('a', SIBLING_EDGE), ('STOP', SIBLING_EDGE),
+                           ('b', SIBLING_EDGE), ('STOP', SIBLING_EDGE)]:
+            state = state.step(node, edge)
+            self.assertFalse(state.complete)
+        state = state.step('STOP', SIBLING_EDGE)
+        self.assertTrue(state.complete)
+        self.assertIsNone(state.error)
+
+    def test_condition_must_only_have_calls(self):
+        state = PathState().step('DLoop', CHILD_EDGE).step('DBranch', SIBLING_EDGE)
+        self.assertIs(state.error, InvalidSketchError)
+
+    def test_child_edge_from_a_call_is_invalid(self):
+        self.assertRaises(ValueError, PathState().step, 'a', CHILD_EDGE)
+
+
+class LegalTokensTest(unittest.TestCase):
+
+    def setUp(self):
+        self.vocab = dict(zip(NODES, range(len(NODES))))
+        self.call_only = np.array([node not in ['DBranch', 'DExcept', 'DLoop', 'DSubTree'] for node in NODES])
+
+    # a token is legal if appending it (with every edge the beam search would take) keeps the path valid
+    @staticmethod
+    def is_legal(state, node):
+        edges = [CHILD_EDGE, SIBLING_EDGE] if node in PathState.NODES else [SIBLING_EDGE]
+        return all(state.step(node, edge).error is None for edge in edges)
+
+    def test_legal_tokens_keep_random_paths_valid(self):
+        rng = random.Random(2)
+        checked = 0
+        for _ in range(3000):
+            state = PathState()
+            for node, edge in random_path(rng, rng.randint(0, 35))[1:]:
+                state = state.step(node, edge)
+                if state.error is not None:
+                    break
+                mask = state.legal(self.vocab, self.call_only)
+                self.assertEqual(mask.dtype, bool)
+                self.assertEqual(list(mask), [self.is_legal(state, node) for node in NODES])
+                checked += 1
+        self.assertGreater(checked, 10000)
+
+    def test_invalid_paths_have_no_legal_tokens(self):
+        state = PathState().step('a', SIBLING_EDGE).step('a', SIBLING_EDGE)
+        self.assertFalse(state.legal(self.vocab, self.call_only).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+from urllib.request import urlopen
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'main', 'python')
+
+# a prefork server whose workers respond with their pid, and exit (or hang) when asked to
+SERVER = '''
+import os, sys, time
+from bayou.server.prefork import PreforkServer
+
+def make_app():
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/exit':
+            os._exit(1)
+        if environ['PATH_INFO'] == '/hang':
+            time.sleep(600)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [str(os.getpid()).encode('utf-8')]
+    return app
+
+PreforkServer('127.0.0.1', int(sys.argv[1]), int(sys.argv[2]), make_app, timeout=1., poll_interval=0.1).serve_forever()
+'''
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class PreforkServerTest(unittest.TestCase):
+
+    def start(self, num_workers):
+        self.port = free_port()
+        self.master = subprocess.Popen([sys.executable, '-c', SERVER, str(self.port), str(num_workers)], cwd=MAIN)
+        for _ in range(100):  # until the workers are ready
+            try:
+                return self.get('/')
+            except OSError:
+                time.sleep(0.1)
+        self.fail('the server did not start')
+
+    def tearDown(self):
+        if self.master.poll() is None:
+            self.master.kill()
+            self.master.wait()
+
+    def get(self, path, timeout=10.):
+        with urlopen('http://127.0.0.1:{}{}'.format(self.port, path), timeout=timeout) as response:
+            return int(response.read())
+
+    # the pid of the worker that handles the next request, once one is handling requests again
+    def next_worker(self):
+        for _ in range(100):
+            try:
+                return self.get('/')
+            except OSError:
+                time.sleep(0.1)
+        self.fail('no worker handles requests')
+
+    def test_workers_handle_requests(self):
+        self.start(2)
+        pids = set(self.get('/') for _ in range(20))
+        self.assertLessEqual(len(pids), 2)
+        self.assertNotIn(self.master.pid, pids)
+
+    def test_worker_that_exits_is_restarted(self):
+        pid = self.start(1)
+        self.assertRaises(OSError, self.get, '/exit')
+        self.assertNotEqual(self.next_worker(), pid)
+
+    def test_worker_without_a_heartbeat_is_killed_and_restarted(self):
+        pid = self.start(1)
+        self.assertRaises(OSError, self.get, '/hang', 5.)  # the worker is killed after a second without a heartbeat
+        self.assertNotEqual(self.next_worker(), pid)
+
+    def test_sigterm_stops_the_workers(self):
+        pid = self.start(1)
+        self.master.send_signal(signal.SIGTERM)
+        self.assertEqual(self.master.wait(10), 0)
+        self.assertRaises(ProcessLookupError, os.kill, pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.evidence import APICalls, Types
+from bayou.models.low_level_evidences.psi_cache import PsiCache
+from decoders import evidence
+
+LATENT_SIZE = 3
+
+
+class Config(object):
+    pass
+
+
+class SumEncoder(object):
+    """
+    Encoder whose encoding of a set of words is the sum of their indices in every latent dimension, and which records
+    the rows it encodes
+    """
+
+    def __init__(self, evidence):
+        self.config = Config()
+        self.config.evidence = evidence
+        self.config.latent_size = LATENT_SIZE
+        self.encoded = []
+
+    def infer_encodings(self, sess, inputs, indices):
+        results = []
+        for i in indices:
+            self.encoded.append((self.config.evidence[i].name, len(inputs[i])))
+            encodings = np.array([[np.sum(row[row >= 0]) + 1.] * LATENT_SIZE for row in inputs[i]])
+            results.append((encodings, np.float32(i + 2.)))
+        return results
+
+
+class PsiCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.evidence = [evidence(APICalls, 'apicalls', ['read', 'write', 'close']),
+                         evidence(Types, 'types', ['File', 'String'])]
+        self.model = SumEncoder(self.evidence)
+
+    def inputs(self, rows):
+        return [ev.wrangle([row[i] for row in rows]) for i, ev in enumerate(self.evidence)]
+
+    def expected(self, rows):
+        # psi of every row computed directly from the encodings of its evidences
+        mean, covariance = [], []
+        for row in rows:
+            terms = []
+            for i, ev in enumerate(self.evidence):
+                wrangled = ev.wrangle([row[i]])
+                if ev.present(wrangled)[0]:
+                    sigma_sq = (i + 2.) ** 2
+                    terms.append(((np.sum(wrangled[wrangled >= 0]) + 1.) / sigma_sq, 1. / sigma_sq))
+            d = 1. + sum(t[1] for t in terms)
+            mean.append([sum(t[0] for t in terms) / d] * LATENT_SIZE)
+            covariance.append([1. / d] * LATENT_SIZE)
+        return np.array(mean), np.array(covariance)
+
+    def test_psi_params_match_direct_computation(self):
+        rows = [(['read', 'close'], ['File']), ([], ['String']), (['write'], []), ([], [])]
+        mean, covariance = PsiCache().psi_params(self.model, None, self.inputs(rows))
+        expected_mean, expected_covariance = self.expected(rows)
+        np.testing.assert_allclose(mean, expected_mean, rtol=1e-6)
+        np.testing.assert_allclose(covariance, expected_covariance, rtol=1e-6)
+
+    def test_evidences_are_encoded_once_in_any_order(self):
+        cache = PsiCache()
+        cache.psi_params(self.model, None, self.inputs([(['read', 'close'], ['File'])]))
+        self.assertEqual(self.model.encoded, [('apicalls', 1), ('types', 1)])
+        # the same API calls in another order, with other types: only the types are encoded
+        rows = [(['close', 'read', 'read'], ['String'])]
+        mean, _ = cache.psi_params(self.model, None, self.inputs(rows))
+        self.assertEqual(self.model.encoded, [('apicalls', 1), ('types', 1), ('types', 1)])
+        np.testing.assert_allclose(mean, self.expected(rows)[0], rtol=1e-6)
+        self.assertEqual(cache.stats()['apicalls'], {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_missing_evidences_are_encoded_in_one_batch(self):
+        PsiCache().psi_params(self.model, None, self.inputs([(['read'], []), (['write'], []), (['close'], [])]))
+        self.assertEqual(self.model.encoded, [('apicalls', 3)])
+
+    def test_lru_eviction_and_expiry(self):
+        cache = PsiCache(max_size=2, ttl=0.05)
+        for key in [b'a', b'b', b'c']:
+            cache.put('apicalls', key, key)
+        self.assertIsNone(cache.get('apicalls', b'a'))
+        self.assertEqual(cache.get('apicalls', b'c'), b'c')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('apicalls', b'c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.evidence import APICalls
+from bayou.models.low_level_evidences.infer import BayesianPredictor
+from decoders import PrefixDecoder, evidence, hashed_dist, predictor
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'DExcept', 'DLoop', 'a', 'b', 'c', 'd']
+EVIDENCES = {'apicalls': ['a', 'b']}
+MEAN = np.array([[1., -2.]], dtype=np.float32)
+COVARIANCE = np.array([[0.25, 4.]], dtype=np.float32)
+
+
+class ParamsCache(object):
+    """
+    Psi cache that holds the mean and covariance of psi for any evidences, and records the rows it is asked for
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def psi_params(self, model, sess, inputs):
+        self.rows.append(len(inputs[0]))
+        return np.tile(MEAN, [len(inputs[0]), 1]), np.tile(COVARIANCE, [len(inputs[0]), 1])
+
+
+class PsiSamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.model = PrefixDecoder(CHARS, hashed_dist(len(CHARS)),
+                                   evidence=[evidence(APICalls, 'apicalls', ['a', 'b'])])
+
+    def test_mean_mode_is_the_mean(self):
+        self.assertIs(BayesianPredictor.psi_average(MEAN, COVARIANCE, 100, mode='mean'), MEAN)
+
+    def test_samples_are_averaged_with_the_distribution_of_the_average(self):
+        psis = np.concatenate([BayesianPredictor.psi_average(MEAN, COVARIANCE, 4) for _ in range(4000)])
+        self.assertEqual(psis.dtype, np.float32)
+        self.assertEqual(psis.shape, (4000, 2))
+        # the average of 4 samples has the mean of psi and a quarter of its covariance
+        np.testing.assert_allclose(psis.mean(axis=0), MEAN[0], atol=0.05)
+        np.testing.assert_allclose(psis.var(axis=0), COVARIANCE[0] / 4, rtol=0.1)
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, BayesianPredictor.psi_average, MEAN, COVARIANCE, 100, 'median')
+
+    def test_average_runs_the_encoder_once(self):
+        bp = predictor(self.model)
+        psi = bp.psi_average_from_evidence(EVIDENCES, num_samples=100)
+        self.assertEqual(self.model.encoded, [1])
+        self.assertEqual(psi.shape, (1, 2))
+        mean, _ = self.model.infer_psi_params(None, EVIDENCES)
+        np.testing.assert_array_equal(bp.psi_average_from_evidence(EVIDENCES, mode='mean'), mean)
+
+    def test_batch_of_samples_from_a_single_run_of_the_encoder(self):
+        cache = ParamsCache()
+        psis = predictor(self.model, psi_cache=cache).psi_samples_from_evidence(EVIDENCES, 5000)
+        self.assertEqual(cache.rows, [1])
+        self.assertEqual(psis.dtype, np.float32)
+        self.assertEqual(psis.shape, (5000, 2))
+        np.testing.assert_allclose(psis.mean(axis=0), MEAN[0], atol=0.1)
+        np.testing.assert_allclose(psis.var(axis=0), COVARIANCE[0], rtol=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import json
+import logging
+import threading
+import unittest
+
+from bayou.server.metrics import RequestStats
+from bayou.server.request_log import JsonFormatter, QueueLogging, RequestLog
+
+
+class RecordingHandler(logging.Handler):
+    """
+    Handler that keeps the records it handles, along with the threads that handle them
+    """
+
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.records = []
+        self.threads = []
+
+    def emit(self, record):
+        self.records.append(record)
+        self.threads.append(threading.current_thread())
+
+
+class JsonFormatterTest(unittest.TestCase):
+
+    def test_record_is_a_line_of_json_with_its_fields(self):
+        record = logging.LogRecord('bayou.requests', logging.INFO, 'ast_server.py', 12, 'request\n%s', ('done',), None)
+        record.fields = {'request_type': 'generate asts', 'seconds': 0.5}
+        line = JsonFormatter().format(record)
+        self.assertNotIn('\n', line)
+        entry = json.loads(line)
+        self.assertEqual({k: entry[k] for k in ['level', 'source', 'message', 'request_type', 'seconds']},
+                         {'level': 'INFO', 'source': 'ast_server.py:12', 'message': 'request\ndone',
+                          'request_type': 'generate asts', 'seconds': 0.5})
+
+
+class QueueLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.root_handlers, self.root_level = list(self.root.handlers), self.root.level
+        self.handler = RecordingHandler()
+        self.logging = QueueLogging([self.handler], level=logging.DEBUG)
+
+    def tearDown(self):
+        self.logging.stop()
+        self.root.handlers = self.root_handlers
+        self.root.setLevel(self.root_level)
+
+    def test_records_are_written_in_order_by_a_background_thread(self):
+        self.logging.start()
+        for i in range(100):
+            logging.getLogger('test').info('record %d', i)
+        self.logging.stop()  # writes the queued records
+        self.assertEqual([record.getMessage() for record in self.handler.records],
+                         ['record {}'.format(i) for i in range(100)])
+        self.assertNotIn(threading.current_thread(), self.handler.threads)
+
+    def test_handler_levels_are_respected(self):
+        warnings = RecordingHandler(logging.WARNING)
+        self.logging = QueueLogging([self.handler, warnings], level=logging.DEBUG)
+        self.logging.start()
+        logging.getLogger('test').debug('debug')
+        logging.getLogger('test').warning('warning')
+        self.logging.stop()
+        self.assertEqual([record.getMessage() for record in self.handler.records], ['debug', 'warning'])
+        self.assertEqual([record.getMessage() for record in warnings.records], ['warning'])
+
+    def test_restart_replaces_the_queue_handler(self):
+        self.logging.start()
+        self.logging.start()  # as in a forked worker
+        logging.getLogger('test').info('once')
+        self.logging.stop()
+        self.assertEqual([record.getMessage() for record in self.handler.records], ['once'])
+
+
+class RequestLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.log = RequestLog()
+        self.log.logger.addHandler(self.handler)
+        self.log.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.log.logger.removeHandler(self.handler)
+        self.log.logger.setLevel(logging.NOTSET)
+
+    def test_sampling(self):
+        self.assertFalse(any(RequestLog(0.).sampled() for _ in range(100)))
+        self.assertTrue(all(RequestLog(1.).sampled() for _ in range(100)))
+
+    def test_record_of_a_request(self):
+        stats = RequestStats()
+        stats.decoder_steps = 7
+        self.log.log('generate asts', 0.25, stats, request='{}', response=b'{"asts": []}')
+        [record] = self.handler.records
+        self.assertEqual(record.levelno, logging.INFO)
+        self.assertEqual({k: record.fields[k] for k in ['request_type', 'seconds', 'decoder_steps', 'request',
+                                                        'response']},
+                         {'request_type': 'generate asts', 'seconds': 0.25, 'decoder_steps': 7, 'request': '{}',
+                          'response': '{"asts": []}'})
+        self.assertNotIn('error', record.fields)
+
+    def test_record_of_a_failed_request(self):
+        self.log.log('generate asts', 0.25, error=ValueError('Invalid model: zzz'))
+        [record] = self.handler.records
+        self.assertEqual(record.levelno, logging.WARNING)
+        self.assertEqual(record.fields['error'], 'ValueError: Invalid model: zzz')
+        self.assertNotIn('request', record.fields)
+
+
+if __name__ == '__main__':
+    unittest.main()
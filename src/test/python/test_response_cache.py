@@ -0,0 +1,140 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import threading
+import unittest
+
+from bayou.models.low_level_evidences.evidence import APICalls, Keywords
+from bayou.models.search import SearchBudget
+from bayou.server.ast_server import _asts_response, _handle_generate_asts_request
+from bayou.server.metrics import RequestStats
+from bayou.server.response_cache import ResponseCache
+from decoders import PrefixDecoder, evidence, hashed_dist, predictor
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'DExcept', 'DLoop', 'a', 'b', 'c', 'd']
+SEARCH_PARAMS = {'beam_width': 3, 'num_psi_samples': 10, 'psi_mode': 'mean'}
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_key_ignores_order_and_duplicates_of_sets(self):
+        key = ResponseCache.key({'apicalls': ['read', 'close'], 'javadoc': 'read a file'}, beam_width=5)
+        self.assertEqual(key, ResponseCache.key({'javadoc': 'read a file', 'apicalls': ['close', 'read', 'read']},
+                                                beam_width=5))
+        self.assertNotEqual(key, ResponseCache.key({'apicalls': ['read', 'close'], 'javadoc': 'read a file'},
+                                                   beam_width=10))
+
+    def test_get_and_put(self):
+        cache = ResponseCache()
+        self.assertIsNone(cache.get('k'))
+        cache.put('k', b'response')
+        self.assertEqual(cache.get('k'), b'response')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_bounded_by_bytes_evicting_least_recently_used(self):
+        cache = ResponseCache(max_bytes=25)
+        cache.put('a', b'x' * 9)
+        cache.put('b', b'x' * 9)
+        cache.get('a')
+        cache.put('c', b'x' * 9)
+        self.assertEqual(cache.size, 20)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('a', b'x')  # replaced, not counted twice
+        self.assertEqual(cache.size, 12)
+
+    def test_larger_than_bound_is_not_cached(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put('k', b'x' * 10)
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(cache.size, 0)
+
+    def test_invalidate(self):
+        cache = ResponseCache()
+        cache.put('k', b'response')
+        cache.invalidate()
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(cache.size, 0)
+
+    def test_concurrent_puts_stay_within_bound(self):
+        cache = ResponseCache(max_bytes=1000)
+
+        def put(thread):
+            for i in range(2000):
+                cache.put('{}/{}'.format(thread, i % 50), b'x' * (i % 40))
+                cache.get('{}/{}'.format(thread, (i + 7) % 50))
+
+        threads = [threading.Thread(target=put, args=(thread,)) for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertEqual(cache.size, sum(len(k) + len(r) for k, r in cache.responses.items()))
+
+
+
+class GenerateAstsCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        keywords = evidence(Keywords, 'keywords', ['read', 'file'])
+        keywords.lemmas = {'reads': 'read', 'read': 'read', 'files': 'file', 'file': 'file'}
+        self.model = PrefixDecoder(CHARS, hashed_dist(len(CHARS)),
+                                   evidence=[evidence(APICalls, 'apicalls', ['a', 'b', 'c']), keywords])
+        self.predictor = predictor(self.model)
+        self.cache = ResponseCache()
+
+    def generate(self, js, stats=None):
+        return _handle_generate_asts_request({'evidence': json.dumps(js)}, self.predictor, SEARCH_PARAMS, self.cache,
+                                             stats)
+
+    def test_responses_are_those_of_the_search(self):
+        js = {'apicalls': ['a', 'b'], 'keywords': ['read']}
+        asts = self.predictor.infer(js, **SEARCH_PARAMS)
+        self.assertEqual(self.generate(js), _asts_response(js, asts, self.predictor).encode('utf-8'))
+        self.assertEqual(self.generate(js), _asts_response(js, asts, self.predictor).encode('utf-8'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_evidences_the_model_reads_the_same_share_asts_but_not_evidences(self):
+        first = {'apicalls': ['a', 'b'], 'keywords': ['read', 'file']}
+        response = json.loads(self.generate(first).decode('utf-8'))
+        steps = self.model.steps
+        for js in [{'keywords': ['files', 'reads', 'read'], 'apicalls': ['b', 'a', 'a']},
+                   {'apicalls': ['b', 'a', 'unknown'], 'keywords': ['file', 'read'], 'javadoc': None}]:
+            self.assertEqual(json.loads(self.generate(js).decode('utf-8')), {'evidences': js,
+                                                                           'asts': response['asts']})
+        self.assertEqual(self.model.steps, steps)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_other_evidences_miss(self):
+        self.generate({'apicalls': ['a', 'b'], 'keywords': ['read']})
+        self.generate({'apicalls': ['a', 'c'], 'keywords': ['read']})
+        self.generate({'apicalls': ['a', 'b'], 'keywords': ['file']})
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 3))
+
+    def test_truncated_searches_are_not_cached(self):
+        js = {'apicalls': ['a'], 'keywords': []}
+        stats = RequestStats()
+        stats.budget = SearchBudget(steps=1)
+        self.generate(js, stats)
+        self.assertEqual(stats.budget.truncated, 1)
+        self.generate(js)
+        self.generate(js)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+import unittest
+
+from bayou.models.low_level_evidences.evidence import APICalls
+from bayou.server.metrics import RequestStats
+from bayou.server.scheduler import BatchScheduler, _Job
+from decoders import PrefixDecoder, evidence, hashed_dist, predictor
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'DExcept', 'DLoop', 'a', 'b', 'c', 'd']
+SEARCH_PARAMS = {'num_psi_samples': 10, 'beam_width': 3, 'psi_mode': 'mean'}
+EVIDENCES = [{'apicalls': apicalls} for apicalls in [['a'], ['b'], ['a', 'c'], ['b', 'c']]]
+
+
+def model():
+    return PrefixDecoder(CHARS, hashed_dist(len(CHARS)), evidence=[evidence(APICalls, 'apicalls', ['a', 'b', 'c'])])
+
+
+# run requests from concurrent threads, returning their results in order
+def concurrently(infer, requests):
+    results = [None] * len(requests)
+
+    def run(i):
+        results[i] = infer(requests[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class BatchSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = model()
+        self.scheduler = BatchScheduler(predictor(self.model), max_batch=4, wait_window=0.2)
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def test_concurrent_requests_are_batched_with_the_results_of_the_predictor(self):
+        stats = [RequestStats() for _ in EVIDENCES]
+        results = concurrently(lambda i: self.scheduler.infer(EVIDENCES[i], stats=stats[i], **SEARCH_PARAMS),
+                               list(range(len(EVIDENCES))))
+        self.assertEqual(results, [predictor(model()).infer(js, **SEARCH_PARAMS) for js in EVIDENCES])
+        self.assertEqual(self.model.encoded, [len(EVIDENCES)])
+
+        # every step of the interleaved searches is a single decoder call, shared by all searches still running, so
+        # every request takes the steps its search takes alone, and the decoder runs as many steps as the longest one
+        alone = []
+        for js in EVIDENCES:
+            bp = predictor(model())
+            steps = bp.beam_search_steps(bp.psi_average_from_evidence(js, mode='mean'), SEARCH_PARAMS['beam_width'])
+            for _ in steps:
+                pass
+            alone.append(steps.steps)
+        self.assertEqual([s.decoder_steps for s in stats], alone)
+        self.assertLessEqual(self.model.steps, max(alone))
+
+    def test_requests_beyond_the_batch_run_as_others_finish(self):
+        scheduler = BatchScheduler(predictor(self.model), max_batch=2, wait_window=0.2)
+        try:
+            results = concurrently(lambda js: scheduler.infer(js, **SEARCH_PARAMS), EVIDENCES)
+        finally:
+            scheduler.close()
+        self.assertEqual(results, [predictor(model()).infer(js, **SEARCH_PARAMS) for js in EVIDENCES])
+        self.assertEqual(sum(self.model.encoded), len(EVIDENCES))
+        self.assertLessEqual(max(self.model.encoded), 2)
+
+    def test_requests_cancelled_while_queued_are_not_run(self):
+        # hold the scheduler in the encoder of a first request while others are queued
+        entered, release = threading.Event(), threading.Event()
+        encode = self.model.infer_psi_params_batch
+
+        def held(sess, evidences_list):
+            entered.set()
+            release.wait(5.)
+            return encode(sess, evidences_list)
+        self.model.infer_psi_params_batch = held
+
+        first = threading.Thread(target=self.scheduler.infer, args=(EVIDENCES[0],), kwargs=SEARCH_PARAMS)
+        first.start()
+        self.assertTrue(entered.wait(5.))
+        cancelled = _Job(EVIDENCES[1], **SEARCH_PARAMS)
+        self.scheduler.queue.put(cancelled)
+        cancelled.cancelled = True
+        release.set()
+        first.join()
+        self.assertTrue(cancelled.done.wait(5.))
+        self.assertIsNone(cancelled.started)
+        self.assertEqual((cancelled.result, cancelled.error), (None, None))
+        self.assertEqual(self.scheduler.infer(EVIDENCES[2], **SEARCH_PARAMS),
+                         predictor(model()).infer(EVIDENCES[2], **SEARCH_PARAMS))
+        self.assertEqual(self.model.encoded, [1, 1])
+
+    def test_closing_a_stream_cancels_its_search(self):
+        records = self.scheduler.infer_stream(EVIDENCES[0], provisional=True, **SEARCH_PARAMS)
+        next(records)
+        records.close()
+        self.assertEqual(self.scheduler.infer(EVIDENCES[1], **SEARCH_PARAMS),
+                         predictor(model()).infer(EVIDENCES[1], **SEARCH_PARAMS))
+
+    def test_errors_fail_the_requests_of_the_batch(self):
+        def fail(sess, evidences_list):
+            raise ValueError('encoder failed')
+        self.model.infer_psi_params_batch = fail
+        with self.assertRaises(ValueError):
+            self.scheduler.infer(EVIDENCES[0], **SEARCH_PARAMS)
+
+
+if __name__ == '__main__':
+    unittest.main()
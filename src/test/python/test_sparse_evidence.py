@@ -0,0 +1,78 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.evidence import APICalls, Keywords
+
+WORDS = ['readLine', 'close', 'write', 'flush']
+
+
+def evidence(cls, words=WORDS):
+    ev = cls()
+    ev.set_chars_vocab([words])
+    return ev
+
+
+# the multi-hot vectors that evidences were wrangled into before, as a reference
+def multi_hot(ev, data):
+    dense = np.zeros((len(data), 1, ev.vocab_size), dtype=np.float32)
+    for i, words in enumerate(data):
+        for w in words:
+            if ev.encodes(w):
+                dense[i, 0, ev.vocab[w]] = 1.
+    return dense
+
+
+class SparseEvidenceTest(unittest.TestCase):
+
+    def test_wrangle_into_sorted_indices_padded(self):
+        ev = evidence(APICalls)
+        wrangled = ev.wrangle([['write', 'close', 'write'], [], ['unseen', 'readLine']])
+        self.assertEqual(wrangled.dtype, np.int32)
+        self.assertEqual(wrangled.tolist(), [sorted([ev.vocab['write'], ev.vocab['close']]), [-1, -1],
+                                             [ev.vocab['readLine'], -1]])
+        self.assertEqual(ev.wrangle([[], ['unseen']]).tolist(), [[-1], [-1]])
+
+    def test_present(self):
+        ev = evidence(APICalls)
+        wrangled = ev.wrangle([['close'], [], ['unseen']])
+        self.assertEqual(ev.present(wrangled).tolist(), [True, False, False])
+
+    def test_key_ignores_padding(self):
+        ev = evidence(APICalls)
+        narrow = ev.wrangle([['close', 'flush']])
+        wide = ev.wrangle([['flush', 'close'], ['close', 'flush', 'write']])
+        self.assertEqual(ev.key(narrow[0]), ev.key(wide[0]))
+        self.assertNotEqual(ev.key(wide[0]), ev.key(wide[1]))
+
+    def test_densify_into_multi_hot_vectors(self):
+        ev = evidence(APICalls)
+        data = [['write', 'close'], [], ['unseen', 'readLine', 'flush']]
+        dense = ev.densify(ev.wrangle(data))
+        self.assertEqual(dense.dtype, np.float32)
+        np.testing.assert_array_equal(dense, multi_hot(ev, data))
+
+    def test_keywords_do_not_encode_stop_words(self):
+        ev = evidence(Keywords, ['read', 'the', 'file'])
+        wrangled = ev.wrangle([['read', 'the', 'file'], ['the']])
+        self.assertEqual(wrangled.tolist(), [sorted([ev.vocab['read'], ev.vocab['file']]), [-1, -1]])
+        self.assertEqual(ev.present(wrangled).tolist(), [True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
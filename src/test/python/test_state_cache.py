@@ -0,0 +1,110 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import sys
+import threading
+import unittest
+
+import numpy as np
+
+from bayou.models.low_level_evidences.state_cache import DecoderStateCache
+
+VOCAB = 100
+UNITS = 8
+
+
+def state():
+    return [np.zeros(UNITS, dtype=np.float32)]
+
+
+def dist():
+    return np.zeros(VOCAB, dtype=np.float32)
+
+
+NODE_BYTES = UNITS * 4 + VOCAB * 4
+
+
+class DecoderStateCacheTest(unittest.TestCase):
+
+    def test_lookup_finds_longest_prefix(self):
+        cache = DecoderStateCache()
+        root = cache.add_root(np.zeros(2, dtype=np.float32), state())
+        a = cache.insert(root, ('a', 'V'), state(), dist())
+        b = cache.insert(a, ('b', 'H'), state(), dist())
+        self.assertEqual(cache.lookup(root, [('a', 'V'), ('b', 'H')]), (b, 2))
+        self.assertEqual(cache.lookup(root, [('a', 'V'), ('c', 'H')]), (a, 1))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_add_root_and_insert_keep_existing_nodes(self):
+        cache = DecoderStateCache()
+        psi = np.ones(2, dtype=np.float32)
+        root = cache.add_root(psi, state())
+        self.assertIs(cache.add_root(psi, state()), root)
+        a = cache.insert(root, ('a', 'V'), state(), dist())
+        self.assertIs(cache.insert(root, ('a', 'V'), state(), dist()), a)
+        self.assertEqual(len(cache), 2)
+
+    def test_trim_bounds_bytes_and_evicts_least_recently_used_leaves(self):
+        cache = DecoderStateCache(max_bytes=UNITS * 4 + 3 * NODE_BYTES)
+        root = cache.add_root(np.zeros(2, dtype=np.float32), state())
+        a = cache.insert(root, ('a', 'V'), state(), dist())
+        cache.insert(a, ('b', 'V'), state(), dist())
+        cache.insert(root, ('c', 'V'), state(), dist())
+        cache.lookup(root, [('a', 'V'), ('b', 'V')])
+        cache.insert(a, ('d', 'V'), state(), dist())
+        cache.trim()
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertEqual(sorted(root.children), [('a', 'V')])
+        self.assertEqual(sorted(a.children), [('b', 'V'), ('d', 'V')])
+
+    def test_concurrent_searches(self):
+        cache = DecoderStateCache(max_bytes=50 * NODE_BYTES)
+        psis = [np.full(2, i, dtype=np.float32) for i in range(4)]
+        errors = []
+
+        def search(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(2000):
+                    psi = psis[rng.randrange(len(psis))]
+                    root = cache.get_root(psi)
+                    if root is None:
+                        root = cache.add_root(psi, state())
+                    tokens = [(rng.choice('abc'), 'V') for _ in range(rng.randint(1, 6))]
+                    node, depth = cache.lookup(root, tokens)
+                    for token in tokens[depth:]:
+                        node = cache.insert(node, token, state(), dist())
+                    cache.trim()
+            except Exception as e:
+                errors.append(e)
+
+        # switch threads often, so that unguarded check-then-act sequences interleave
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=search, args=(seed,)) for seed in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertEqual(cache.size, sum(DecoderStateCache.node_bytes(node) for node in cache.lru))
+
+
+if __name__ == '__main__':
+    unittest.main()
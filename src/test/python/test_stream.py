@@ -0,0 +1,111 @@
+# Copyright 2017 Rice University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+import argparse
+import json
+import unittest
+
+from bayou.models.low_level_evidences.evidence import APICalls
+from bayou.server.ast_server import _make_http_server, _stream_asts
+from bayou.server.model_host import HostedModel, ModelHost
+from decoders import PrefixDecoder, evidence, hashed_dist, predictor
+
+CHARS = ['DSubTree', 'STOP', 'DBranch', 'DExcept', 'DLoop', 'a', 'b', 'c', 'd']
+SEARCH_PARAMS = {'num_psi_samples': 1, 'beam_width': 5, 'psi_mode': 'mean'}
+EVIDENCES = {'apicalls': ['a', 'b']}
+
+
+def model():
+    return PrefixDecoder(CHARS, hashed_dist(len(CHARS)), evidence=[evidence(APICalls, 'apicalls', ['a', 'b', 'c'])])
+
+
+class CorePredictor(object):
+    """
+    Predictor of a core model, whose search is not step-wise
+    """
+
+    def __init__(self, asts):
+        self.asts = asts
+
+    def infer(self, evidences, **search_params):
+        return self.asts
+
+
+# the records of a stream, checking that every chunk is a single line of JSON
+def records(chunks):
+    result = []
+    for chunk in chunks:
+        assert chunk.endswith('\n') and chunk.count('\n') == 1, chunk
+        result.append(json.loads(chunk))
+    return result
+
+
+# strip the rank and final fields of records, leaving the ASTs as returned by infer
+def asts(records):
+    return [{k: v for k, v in record.items() if k not in ['rank', 'final']} for record in records]
+
+
+class StreamAstsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.expected = predictor(model()).infer(EVIDENCES, **SEARCH_PARAMS)
+
+    def test_final_records_come_in_rank_order_then_the_end_record(self):
+        stream = records(_stream_asts(EVIDENCES, predictor(model()), SEARCH_PARAMS))
+        self.assertEqual(stream[-1], {'done': True, 'count': len(self.expected)})
+        self.assertEqual([record['final'] for record in stream[:-1]], [True] * len(self.expected))
+        self.assertEqual([record['rank'] for record in stream[:-1]], list(range(len(self.expected))))
+        self.assertEqual(asts(stream[:-1]), self.expected)
+
+    def test_provisional_records_are_not_counted(self):
+        stream = records(_stream_asts(EVIDENCES, predictor(model()), SEARCH_PARAMS, provisional=True))
+        final = [record for record in stream[:-1] if record['final']]
+        self.assertEqual([record['rank'] for record in final], list(range(len(self.expected))))
+        self.assertEqual(asts(final), self.expected)
+        self.assertTrue(all('rank' not in record for record in stream[:-1] if not record['final']))
+        self.assertEqual(stream[-1], {'done': True, 'count': len(self.expected)})
+
+    def test_asts_of_core_models_are_all_final(self):
+        expected = [{'ast': {'node': 'DSubTree', '_nodes': []}, 'probability': p} for p in [-1., -2.]]
+        stream = records(_stream_asts(EVIDENCES, CorePredictor(expected), SEARCH_PARAMS))
+        self.assertEqual(stream, [dict(expected[0], rank=0, final=True), dict(expected[1], rank=1, final=True),
+                                  {'done': True, 'count': 2}])
+
+
+class StreamRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        models = ModelHost(None)
+        models.add('default', 'test', HostedModel('default', 'test', predictor(model()), SEARCH_PARAMS))
+        args = argparse.Namespace(max_bulk_batch=16, deadline=0, max_steps=0)
+        self.client = _make_http_server(models, args).test_client()
+
+    def test_response_is_the_ndjson_stream(self):
+        request = {'request type': 'generate asts stream', 'evidence': json.dumps(EVIDENCES)}
+        response = self.client.post('/', data=json.dumps(request))
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).split('\n')
+        self.assertEqual(lines[-1], '')  # every record ends with a newline
+        self.assertEqual([json.loads(line) for line in lines[:-1]],
+                         records(_stream_asts(EVIDENCES, predictor(model()), SEARCH_PARAMS)))
+
+    def test_invalid_model_fails_before_the_stream_starts(self):
+        request = {'request type': 'generate asts stream', 'evidence': json.dumps(EVIDENCES), 'model': 'other'}
+        self.assertEqual(self.client.post('/', data=json.dumps(request)).status_code, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()